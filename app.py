@@ -1,13 +1,18 @@
+import os
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-from sqlalchemy import create_engine, text
 
 # Import core modules
 from core.sql_generator import generate_sql
 from core.sql_executor import execute_sql
 from core.smart_agent import process_question_with_retry
 from core.database import init_db
+from core.ingestion import load_uploads, file_digest
+from core.duckdb_backend import use_duckdb
+from core.query_cache import get_sql_cache
+from core.visualizer import auto_visualize
+from core.exporter import EXPORT_FORMATS, available_formats, exporter
+from core.result_store import create_result_store
 
 # --- CẤU HÌNH TRANG WEB ---
 st.set_page_config(page_title="Engineering AI Assistant", page_icon="🤖", layout="wide")
@@ -20,72 +25,125 @@ data_source = st.sidebar.radio("Chọn nguồn dữ liệu:", ("Database Mặc 
 current_engine = None
 
 if data_source == "Upload File CSV":
-    uploaded_file = st.sidebar.file_uploader("Tải lên file CSV của bạn", type=["csv"])
-    if uploaded_file:
-        # 1. Đọc file CSV
-        df_uploaded = pd.read_csv(uploaded_file)
-        st.sidebar.success(f"Đã tải lên: {df_uploaded.shape[0]} dòng")
-        
-        # 2. Tạo Database tạm trong RAM (In-memory SQLite)
-        temp_engine = create_engine('sqlite:///:memory:')
-        
-        # 3. Đẩy dữ liệu CSV vào bảng tên là 'my_table'
-        df_uploaded.to_sql('my_data', temp_engine, index=False, if_exists='replace')
-        
-        current_engine = temp_engine
-        st.info("💡 Mẹo: Dữ liệu của bạn đang ở trong bảng tên là **`my_data`**.")
+    # DuckDB đọc thẳng được cả Parquet
+    upload_types = ["csv", "parquet"] if use_duckdb() else ["csv"]
+    uploaded_files = st.sidebar.file_uploader("Tải lên file CSV của bạn", type=upload_types, accept_multiple_files=True)
+    if uploaded_files:
+        # 1. Băm nội dung file 1 lần cho mỗi lần upload (file_id đổi khi upload lại), không băm lại mỗi lần rerun
+        digests = st.session_state.setdefault("upload_digests", {})
+        for f in uploaded_files:
+            if f.file_id not in digests:
+                digests[f.file_id] = file_digest(f)
+
+        # 2. Nạp vào DB SQLite trên đĩa (.cache/uploads): file đã nạp rồi thì mở lại, không đọc lại CSV
+        with st.spinner("Đang nạp dữ liệu..."):
+            current_engine, uploaded_tables = load_uploads(uploaded_files, [digests[f.file_id] for f in uploaded_files])
+
+        for table_name, info in uploaded_tables.items():
+            st.sidebar.success(f"Đã tải lên `{info['file_name']}`: {info['rows']:,} dòng -> bảng `{table_name}`")
+        table_list = ", ".join(f"**`{name}`**" for name in uploaded_tables)
+        st.info(f"💡 Mẹo: Dữ liệu của bạn nằm trong bảng {table_list}.")
         with st.expander("Xem dữ liệu thô"):
-            st.dataframe(df_uploaded.head())
+            for table_name in uploaded_tables:
+                st.caption(table_name)
+                st.dataframe(pd.read_sql_query(f'SELECT * FROM "{table_name}" LIMIT 5', current_engine))
 else:
     # Dùng DB mặc định
-    st.sidebar.info("Đang sử dụng dữ liệu giả lập từ `factory.db`")
-    current_engine = None # Core sẽ tự load init_db()
+    current_engine = init_db() # Engine dùng chung từ registry (không tạo lại mỗi lần rerun)
+    backend_label = " (chạy trên DuckDB)" if current_engine.dialect.name == "duckdb" else ""
+    st.sidebar.info(f"Đang sử dụng dữ liệu giả lập từ `factory.db`{backend_label}")
+
+# Thống kê cache SQL (để điều chỉnh kích thước cache)
+sql_cache = get_sql_cache()
+if sql_cache is not None:
+    cache_stats = sql_cache.stats()
+    st.sidebar.caption(
+        f"⚡ SQL cache: {cache_stats['hits']} hit / {cache_stats['misses']} miss "
+        f"({cache_stats['entries']}/{cache_stats['max_entries']} mục)"
+    )
 
 # --- QUẢN LÝ SESSION STATE ---
+# messages chỉ giữ handle nhẹ của kết quả; DataFrame / biểu đồ nằm trong result_store (giới hạn RAM, tràn xuống đĩa)
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "result_store" not in st.session_state:
+    st.session_state.result_store = create_result_store()
+result_store = st.session_state.result_store
+
+store_stats = result_store.stats()
+st.sidebar.caption(
+    f"🗂️ Kết quả phiên: {store_stats['in_memory']}/{store_stats['results']} trong RAM "
+    f"({store_stats['bytes'] / 1024 / 1024:.0f}/{store_stats['max_bytes'] / 1024 / 1024:.0f} MB)"
+)
+if st.sidebar.button("🧹 Xóa lịch sử chat"):
+    st.session_state.messages = []
+    result_store.clear()
+
+# --- HIỂN THỊ BẢNG THEO TRANG (không render toàn bộ kết quả lớn) ---
+PAGE_SIZES = [50, 200, 1000]
+
+def show_dataframe(df, key):
+    if df.attrs.get('truncated'):
+        st.warning(f"⚠️ Kết quả quá lớn, chỉ hiển thị {len(df)} dòng đầu tiên.")
+
+    if len(df) <= PAGE_SIZES[0]:
+        st.dataframe(df, use_container_width=True)
+        return
+
+    col_size, col_page = st.columns(2)
+    page_size = col_size.selectbox("Số dòng/trang", PAGE_SIZES, key=f"{key}_size")
+    num_pages = (len(df) - 1) // page_size + 1
+    page = col_page.number_input(f"Trang (1-{num_pages})", min_value=1, max_value=num_pages, value=1, key=f"{key}_page")
+    start = (page - 1) * page_size
+    st.dataframe(df.iloc[start:start + page_size], use_container_width=True)
 
-for message in st.session_state.messages:
+def download_buttons(df, key):
+    """
+    Nút tải CSV / Parquet. File chỉ được tạo khi bấm (truyền hàm thay vì bytes dựng sẵn mỗi lần rerun).
+    df: DataFrame hoặc hàm trả về DataFrame (nạp lại từ result_store khi bấm).
+    """
+    columns = st.columns(len(available_formats()))
+    for column, fmt in zip(columns, available_formats()):
+        info = EXPORT_FORMATS[fmt]
+        column.download_button(f"📥 Tải kết quả ({info['label']})", exporter(df, fmt), f"data.{info['extension']}",
+                               info["mime"], key=f"{key}_{fmt}", on_click="ignore")
+
+# Chỉ vẽ đầy đủ (bảng + biểu đồ) N kết quả gần nhất; kết quả cũ hơn hiện tóm tắt + vài dòng đầu,
+# bật "Xem đầy đủ" mới nạp lại -> mỗi lần rerun không vẽ lại toàn bộ lịch sử
+RECENT_RESULTS = int(os.getenv("RESULT_EXPANDED_RECENT", "3"))
+
+def stored_frame(handle):
+    # Kết quả không còn trong result_store (thư mục phiên đã bị xóa) -> chỉ còn các dòng xem trước
+    df = result_store.frame(handle)
+    return df if df is not None else handle["preview"]
+
+def show_result(handle, key, expanded):
+    if not expanded:
+        st.caption(f"📄 {handle['rows']:,} dòng × {len(handle['columns'])} cột — xem trước {len(handle['preview'])} dòng đầu")
+        st.dataframe(handle["preview"], use_container_width=True)
+        expanded = st.toggle("🔎 Xem đầy đủ" + (" (kèm biểu đồ)" if handle["has_chart"] else ""), key=f"{key}_full")
+        if not expanded:
+            download_buttons(lambda: stored_frame(handle), key=f"{key}_download")
+            return
+
+    df = result_store.frame(handle)
+    if df is None:
+        st.caption("Kết quả này không còn được lưu.")
+        return
+    show_dataframe(df, key=key)
+    download_buttons(df, key=f"{key}_download")
+    chart = result_store.chart(handle)
+    if chart is not None:
+        st.plotly_chart(chart, use_container_width=True, key=f"{key}_chart")
+
+result_indexes = [i for i, m in enumerate(st.session_state.messages) if "result" in m]
+recent_indexes = set(result_indexes[-RECENT_RESULTS:]) if RECENT_RESULTS > 0 else set()
+
+for idx, message in enumerate(st.session_state.messages):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
-        if "data" in message:
-            st.dataframe(message["data"])
-        if "chart" in message:
-            st.plotly_chart(message["chart"], use_container_width=True)
-
-# --- HÀM VẼ BIỂU ĐỒ (Giữ nguyên) ---
-def auto_visualize(df):
-    if df.empty or len(df) < 2: return None
-    
-    # 1. Logic vẽ biểu đồ Dự báo (Nếu có cột 'Type')
-    if 'Type' in df.columns and 'Forecast' in df['Type'].values:
-        # Tìm cột ngày và số
-        date_cols = df.select_dtypes(include=['datetime']).columns
-        num_cols = df.select_dtypes(include=['float', 'int']).columns
-        val_col = [c for c in num_cols if c != 'date_ordinal'][0] # Loại bỏ cột phụ nếu có
-        
-        chart = px.line(
-            df, 
-            x=date_cols[0], 
-            y=val_col, 
-            color='Type', # Chia màu theo Lịch sử/Dự báo
-            title=f"Forecast Analysis: {val_col}",
-            markers=True,
-            line_dash='Type' # Nét đứt cho dự báo
-        )
-        return chart
-
-    # 2. Logic vẽ biểu đồ thường (Cũ)
-    num_cols = df.select_dtypes(include=['float', 'int']).columns.tolist()
-    cat_cols = df.select_dtypes(include=['object', 'string']).columns.tolist()
-    date_cols = df.select_dtypes(include=['datetime']).columns.tolist()
-    
-    if len(cat_cols) >= 1 and len(num_cols) >= 1:
-        return px.bar(df, x=cat_cols[0], y=num_cols[0], title=f"{num_cols[0]} by {cat_cols[0]}")
-    elif len(date_cols) >= 1 and len(num_cols) >= 1:
-        return px.line(df, x=date_cols[0], y=num_cols[0], title="Trend over Time")
-        
-    return None
+        if "result" in message:
+            show_result(message["result"], key=f"history_{idx}", expanded=idx in recent_indexes)
 
 # --- LOGIC CHAT ---
 if prompt := st.chat_input("Hỏi gì đó về dữ liệu..."):
@@ -99,9 +157,27 @@ if prompt := st.chat_input("Hỏi gì đó về dữ liệu..."):
         # GỌI SMART AGENT
         with st.status("🤖 AI đang xử lý...", expanded=True) as status:
             st.write("Đang phân tích và truy vấn...")
-            
+            sql_placeholder = st.empty()
+            timings_placeholder = st.empty()
+            stage_lines = []
+            stage_labels = {"schema": "Nạp schema", "generate": "Viết SQL", "fix": "Sửa SQL", "validate": "Kiểm tra SQL",
+                            "execute": "Chạy truy vấn", "forecast": "Dự báo"}
+
+            # Đẩy tiến trình lên giao diện ngay khi có (SQL đang viết dở, thời gian từng bước)
+            def on_progress(kind, data):
+                if kind == "attempt" and data > 1:
+                    status.update(label=f"🛠️ Đang sửa SQL (lần thử {data})...")
+                elif kind == "sql":
+                    status.update(label="✍️ AI đang viết SQL...")
+                    sql_placeholder.code(data, language="sql")
+                elif kind == "stage":
+                    stage_lines.append(f"- {stage_labels.get(data['stage'], data['stage'])}: {data['seconds']:.2f}s")
+                    timings_placeholder.markdown("\n".join(stage_lines))
+                    if data["stage"] == "validate":
+                        status.update(label="🗄️ Đang truy vấn dữ liệu...")
+
             # Gọi hàm xử lý có vòng lặp
-            result = process_question_with_retry(prompt, engine=current_engine, max_retries=3)
+            result = process_question_with_retry(prompt, engine=current_engine, max_retries=3, on_progress=on_progress)
             
             if isinstance(result, pd.DataFrame):
                 status.update(label="Thành công!", state="complete", expanded=False)
@@ -127,13 +203,12 @@ if prompt := st.chat_input("Hỏi gì đó về dữ liệu..."):
                     with st.expander("Xem câu lệnh SQL đã chạy"):
                         st.code(result.attrs['final_sql'], language="sql")
 
-                st.dataframe(result, use_container_width=True)
+                show_dataframe(result, key=f"history_{len(st.session_state.messages)}")
                 
-                # Nút download
-                csv_data = result.to_csv(index=False).encode('utf-8')
-                st.download_button("📥 Tải kết quả (CSV)", csv_data, "data.csv", "text/csv")
+                # Nút download (tạo file khi bấm)
+                download_buttons(result, key=f"history_{len(st.session_state.messages)}_download")
                 
-                chart_obj = auto_visualize(result)
+                chart_obj = auto_visualize(result, engine=current_engine)
                 if chart_obj:
                     st.plotly_chart(chart_obj, use_container_width=True)
                 
@@ -142,7 +217,5 @@ if prompt := st.chat_input("Hỏi gì đó về dữ liệu..."):
         # Lưu lịch sử chat
         msg_data = {"role": "assistant", "content": response_text}
         if isinstance(result, pd.DataFrame) and not result.empty:
-            msg_data["data"] = result
-        if chart_obj:
-            msg_data["chart"] = chart_obj
+            msg_data["result"] = result_store.put(result, chart_obj)
         st.session_state.messages.append(msg_data)
\ No newline at end of file
@@ -0,0 +1,189 @@
+import time
+import weakref
+import asyncio
+import functools
+import pandas as pd
+from core.database import init_db
+from core.sql_generator import generate_sql, fix_sql_query, lookup_cached_sql, remember_sql, forget_sql
+from core.sql_executor import execute_sql
+from core.forecast_cache import fetch_forecast_history
+from core.schema_cache import get_schema_snapshot
+from core.smart_agent import question_steps, finalize_result, validate_against_schema
+
+# --- ASYNC PIPELINE ---
+# Chạy nhiều câu hỏi cùng lúc: phần gọi AI và phần truy vấn DB chạy trong thread pool,
+# giới hạn song song riêng cho từng loại + token bucket cho quota của Gemini.
+
+
+class TokenBucket:
+    """
+    Giới hạn tốc độ gọi AI: rate token/giây, tích lũy tối đa capacity token.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class BatchLimits:
+    """
+    Giới hạn tài nguyên dùng chung cho 1 lần chạy batch.
+    llm_concurrency / db_concurrency: số lời gọi AI / truy vấn DB chạy song song tối đa.
+    llm_rate_per_minute: quota gọi AI mỗi phút (None = không giới hạn).
+    """
+    def __init__(self, llm_concurrency=4, db_concurrency=4, llm_rate_per_minute=60):
+        self.llm_semaphore = asyncio.Semaphore(llm_concurrency)
+        self.db_semaphore = asyncio.Semaphore(db_concurrency)
+        self.llm_bucket = None
+        if llm_rate_per_minute:
+            self.llm_bucket = TokenBucket(rate=llm_rate_per_minute / 60, capacity=max(1, llm_concurrency))
+
+    async def call_llm(self, func, *args, **kwargs):
+        async with self.llm_semaphore:
+            if self.llm_bucket is not None:
+                await self.llm_bucket.acquire()
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def call_db(self, func, *args, **kwargs):
+        async with self.db_semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+
+_default_limits = weakref.WeakKeyDictionary()
+
+
+def default_limits():
+    """
+    BatchLimits dùng chung cho các lời gọi lẻ (không truyền limits) trong cùng 1 event loop, để token bucket và
+    semaphore thực sự giới hạn các lời gọi đó. Theo từng loop vì asyncio.Semaphore / Lock gắn với loop đã dùng nó.
+    """
+    loop = asyncio.get_running_loop()
+    limits = _default_limits.get(loop)
+    if limits is None:
+        limits = _default_limits[loop] = BatchLimits()
+    return limits
+
+
+async def agenerate_sql(question: str, engine=None, limits=None, stats=None, on_progress=None):
+    """
+    Bản async của generate_sql. Cache hit không tốn quota AI.
+    """
+    limits = limits or default_limits()
+    cached_sql = await limits.call_db(lookup_cached_sql, question, engine)
+    if cached_sql:
+        if on_progress is not None:
+            on_progress("sql", cached_sql)
+        return cached_sql
+    return await limits.call_llm(generate_sql, question, engine, use_cache=False, stats=stats, on_progress=on_progress)
+
+
+async def afix_sql_query(original_question: str, broken_sql: str, error_message: str, engine=None, limits=None,
+                         stats=None, on_progress=None):
+    """
+    Bản async của fix_sql_query.
+    """
+    limits = limits or default_limits()
+    return await limits.call_llm(fix_sql_query, original_question, broken_sql, error_message, engine, stats=stats,
+                                 on_progress=on_progress)
+
+
+async def aexecute_sql(sql_query: str, engine=None, limits=None, **kwargs):
+    """
+    Bản async của execute_sql (kwargs: timeout, cancel_event, max_rows...).
+    """
+    limits = limits or default_limits()
+    return await limits.call_db(execute_sql, sql_query, engine, **kwargs)
+
+
+def async_steps(limits):
+    """
+    Bảng hàm async cho question_steps (core/smart_agent.py): gọi AI qua giới hạn AI, truy vấn DB qua giới hạn DB,
+    các bước còn lại (kiểm tra SQL, cache SQL, dự báo) chạy trong thread pool, không chặn event loop.
+    """
+    return {
+        "schema": functools.partial(limits.call_db, get_schema_snapshot),
+        "generate": functools.partial(agenerate_sql, limits=limits),
+        "fix": functools.partial(afix_sql_query, limits=limits),
+        "validate": functools.partial(asyncio.to_thread, validate_against_schema),
+        "forecast_history": functools.partial(limits.call_db, fetch_forecast_history),
+        "execute": functools.partial(aexecute_sql, limits=limits),
+        "remember": functools.partial(asyncio.to_thread, remember_sql),
+        "forget": functools.partial(asyncio.to_thread, forget_sql),
+        "finalize": functools.partial(asyncio.to_thread, finalize_result),
+    }
+
+
+async def arun_steps(steps, handlers):
+    """
+    Bản async của run_steps: chạy generator question_steps, await từng bước.
+    """
+    send, value = steps.send, None
+    while True:
+        try:
+            name, args, kwargs = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            send, value = steps.send, await handlers[name](*args, **kwargs)
+        except BaseException as e:
+            send, value = steps.throw, e
+
+
+async def aprocess_question(question: str, engine=None, max_retries=3, limits=None, timeout=None, cancel_event=None,
+                            stats=None):
+    """
+    Bản async của process_question_with_retry (dùng chung vòng lặp question_steps, cùng kiểu kết quả trả về).
+    """
+    steps = question_steps(question, engine, max_retries, timeout, cancel_event, stats, mode="async")
+    return await arun_steps(steps, async_steps(limits or default_limits()))
+
+
+async def aprocess_questions_batch(questions, engine=None, max_retries=3, llm_concurrency=4, db_concurrency=4,
+                                   llm_rate_per_minute=60, timeout=None, on_result=None):
+    """
+    Trả lời nhiều câu hỏi đồng thời. Lỗi của câu này không ảnh hưởng câu khác.
+    Output: list (đúng thứ tự input) các dict {index, question, result, error, elapsed, stats}.
+    on_result: hàm gọi với từng dict ngay khi câu đó xong (theo thứ tự xong), VD để ghi kết quả/checkpoint dần.
+    """
+    if engine is None:
+        engine = init_db()
+    limits = BatchLimits(llm_concurrency, db_concurrency, llm_rate_per_minute)
+
+    async def run_one(index, question):
+        started = time.perf_counter()
+        stats = {}
+        try:
+            res = await aprocess_question(question, engine, max_retries, limits, timeout, stats=stats)
+        except Exception as e:
+            res = f"System Error: {e}"
+        item = {"index": index, "question": question, "result": None, "error": None,
+                "elapsed": round(time.perf_counter() - started, 3), "stats": stats}
+        if isinstance(res, pd.DataFrame):
+            item["result"] = res
+        else:
+            item["error"] = res
+        if on_result is not None:
+            on_result(item)
+        return item
+
+    return await asyncio.gather(*(run_one(i, q) for i, q in enumerate(questions)))
+
+
+def process_questions_batch(questions, engine=None, **kwargs):
+    """
+    Bản đồng bộ của aprocess_questions_batch (dùng cho script/báo cáo chạy đêm).
+    """
+    return asyncio.run(aprocess_questions_batch(questions, engine, **kwargs))
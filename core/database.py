@@ -1,9 +1,12 @@
 # core/database.py
 import os
+import atexit
+import threading
 import urllib
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, ForeignKey, PrimaryKeyConstraint
 from sqlalchemy.orm import declarative_base, relationship
 from dotenv import load_dotenv
+from core.tracing import traced
 
 # Load biến môi trường
 load_dotenv()
@@ -40,9 +43,131 @@ class MaintenanceLog(Base):
     technician = relationship("Technician", back_populates="logs")
 
 
-def init_db(db_name=None):
+# --- ROLLUP (bảng tổng hợp sẵn, xem core/rollups.py) ---
+class MaintenanceMonthlyRollup(Base):
     """
-    Hàm kết nối Database linh hoạt (SQL Server hoặc SQLite)
+    maintenance_logs gộp theo tháng x máy x kỹ sư. Được cập nhật tăng dần theo id (core/rollups.py).
+    month: ngày đầu tháng. cost_count: số dòng có cost (để tính AVG đúng khi cost bị NULL).
+    """
+    __tablename__ = 'rollup_maintenance_monthly'
+    __table_args__ = (PrimaryKeyConstraint('month', 'machine_id', 'technician_id'),)
+    month = Column(Date, nullable=False)
+    machine_id = Column(Integer, ForeignKey('machines.id'), nullable=False)
+    technician_id = Column(Integer, ForeignKey('technicians.id'), nullable=False)
+    log_count = Column(Integer, nullable=False)
+    cost_count = Column(Integer, nullable=False)
+    total_cost = Column(Float)
+    min_cost = Column(Float)
+    max_cost = Column(Float)
+    success_count = Column(Integer, nullable=False)
+    pending_count = Column(Integer, nullable=False)
+    failed_count = Column(Integer, nullable=False)
+
+class RollupState(Base):
+    """
+    Watermark của từng rollup: id lớn nhất đã gộp, số dòng nguồn đã gộp / bị bỏ qua (thiếu ngày, máy, kỹ sư).
+    Tên bắt đầu bằng "_agent_" nên không xuất hiện trong schema gửi cho AI.
+    """
+    __tablename__ = '_agent_rollup_state'
+    name = Column(String(100), primary_key=True)
+    last_id = Column(Integer, nullable=False)
+    source_rows = Column(Integer, nullable=False)
+    skipped_rows = Column(Integer, nullable=False)
+    refreshed_at = Column(Float)
+
+
+# --- ENGINE REGISTRY ---
+# Mỗi connection string chỉ có 1 engine (kèm connection pool) dùng chung cho cả tiến trình.
+# Tránh việc mỗi câu hỏi lại phải login ODBC và chạy create_all() từ đầu.
+_engines = {}
+_schema_ready = set()
+_engines_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_flag(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _pool_options(connection_string):
+    """
+    Cấu hình pool đọc từ .env (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE).
+    """
+    options = {"pool_pre_ping": True}
+    # SQLite in-memory dùng SingletonThreadPool, không nhận tham số kích thước pool
+    if connection_string.startswith("sqlite") and ":memory:" in connection_string:
+        return options
+    options.update(
+        pool_size=_env_int("DB_POOL_SIZE", 5),
+        max_overflow=_env_int("DB_MAX_OVERFLOW", 10),
+        pool_recycle=_env_int("DB_POOL_RECYCLE", 1800),
+    )
+    return options
+
+
+def get_engine(connection_string, create_schema=False, **engine_kwargs):
+    """
+    Lấy engine dùng chung theo connection string (tạo mới nếu chưa có).
+    create_schema=True: chạy Base.metadata.create_all() một lần duy nhất cho engine này.
+    """
+    key = (connection_string, tuple(sorted(engine_kwargs.items())))
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            options = _pool_options(connection_string)
+            options.update(engine_kwargs)
+            engine = create_engine(connection_string, **options)
+            _engines[key] = engine
+
+        if create_schema and key not in _schema_ready:
+            Base.metadata.create_all(engine)
+            _schema_ready.add(key)
+
+    return engine
+
+
+def dispose_engines():
+    """
+    Đóng toàn bộ connection pool (gọi khi tắt ứng dụng).
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _schema_ready.clear()
+
+
+atexit.register(dispose_engines)
+
+
+def release_engines(path):
+    """
+    Đóng và bỏ khỏi registry các engine trỏ vào file path (gọi trước khi xóa file đó).
+    Trả về False (không đóng engine nào) nếu còn kết nối đang được mượn, tức là có truy vấn đang chạy trên file.
+    """
+    path = os.path.abspath(path)
+    with _engines_lock:
+        keys = [key for key, engine in _engines.items()
+                if engine.url.database and os.path.abspath(engine.url.database) == path]
+        if any(getattr(_engines[key].pool, "checkedout", lambda: 0)() for key in keys):
+            return False
+        for key in keys:
+            _engines.pop(key).dispose()
+            _schema_ready.discard(key)
+    return True
+
+
+def build_connection_string(db_name=None):
+    """
+    Chọn connection string: SQL Server nếu .env đủ thông tin, ngược lại fallback về SQLite.
+    Trả về (connection_string, mô tả để log).
     """
     # 1. Lấy thông tin từ .env
     server = os.getenv("DB_SERVER")
@@ -51,29 +176,42 @@ def init_db(db_name=None):
     password = os.getenv("DB_PASSWORD")
     driver = os.getenv("DB_DRIVER", "ODBC Driver 17 for SQL Server")
 
-    connection_string = ""
-
     # 2. Kiểm tra: Nếu có đủ thông tin thì dùng SQL Server
     if server and database and username and password:
         # Mã hóa password để tránh lỗi ký tự đặc biệt (@, /...)
         params = urllib.parse.quote_plus(
             f"DRIVER={{{driver}}};SERVER={server};DATABASE={database};UID={username};PWD={password}; TrustServerCertificate=yes"
         )
-        connection_string = f"mssql+pyodbc:///?odbc_connect={params}"
-        print(f"🔗 Đang kết nối tới SQL Server: {server}/{database}")
-    
-    else:
-        # Fallback về SQLite nếu không cấu hình .env
-        if not db_name: db_name = 'factory.db'
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        db_path = os.path.join(base_dir, db_name)
-        connection_string = f'sqlite:///{db_path}'
-        print("🔗 Đang kết nối tới SQLite (Local)")
-
-    # 3. Tạo Engine
-    engine = create_engine(connection_string)
-    
-    # Tạo bảng nếu chưa có
-    Base.metadata.create_all(engine)
-    
-    return engine
\ No newline at end of file
+        return f"mssql+pyodbc:///?odbc_connect={params}", f"SQL Server: {server}/{database}"
+
+    # Fallback về SQLite nếu không cấu hình .env
+    if not db_name: db_name = 'factory.db'
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    db_path = os.path.join(base_dir, db_name)
+    return f'sqlite:///{db_path}', "SQLite (Local)"
+
+
+@traced("init_db", attributes=lambda engine: {"dialect": engine.dialect.name})
+def init_db(db_name=None, create_schema=None, backend=None, **engine_kwargs):
+    """
+    Hàm kết nối Database linh hoạt (SQL Server hoặc SQLite).
+    Trả về engine dùng chung từ registry, KHÔNG cần dispose sau mỗi lần dùng.
+    create_schema: tạo bảng nếu chưa có (mặc định đọc từ DB_CREATE_SCHEMA, tắt).
+    backend: "duckdb" để chạy truy vấn phân tích trên bản DuckDB chỉ đọc của file SQLite (mặc định DB_BACKEND).
+        Script ghi dữ liệu (seed, refresh rollup...) truyền backend="sqlite".
+    engine_kwargs: tham số thêm cho create_engine (VD: fast_executemany=True khi nạp dữ liệu lớn).
+    """
+    connection_string, label = build_connection_string(db_name)
+
+    if create_schema is None:
+        create_schema = _env_flag("DB_CREATE_SCHEMA")
+
+    if connection_string.startswith("sqlite:///") and not create_schema:
+        from core.duckdb_backend import use_duckdb, mirror_sqlite, get_duckdb_engine
+        if use_duckdb(backend):
+            return get_duckdb_engine(mirror_sqlite(connection_string.replace("sqlite:///", "", 1)))
+
+    if not any(key[0] == connection_string for key in _engines):
+        print(f"🔗 Đang kết nối tới {label}")
+
+    return get_engine(connection_string, create_schema=create_schema, **engine_kwargs)
@@ -0,0 +1,132 @@
+import re
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+# --- DIALECT ---
+# Nhận diện dialect của engine và dịch SQL kiểu T-SQL (TOP, GETDATE, FORMAT...) sang dialect thật
+# ngay tại local, để SQLite fallback / CSV upload không phải tốn thêm 1 vòng fix_sql_query.
+
+# Tên dialect SQLAlchemy -> tên dialect của sqlglot
+SQLGLOT_DIALECTS = {
+    "mssql": "tsql",
+    "sqlite": "sqlite",
+    "duckdb": "duckdb",
+    "postgresql": "postgres",
+    "mysql": "mysql",
+}
+
+# Dấu hiệu câu SQL đang viết theo T-SQL
+_TSQL_MARKERS = re.compile(
+    r"\bTOP\s*\(?\s*\d|\bGETDATE\s*\(|\bFORMAT\s*\(|\bDATEADD\s*\(|\bDATEDIFF\s*\(|\bDATEPART\s*\(|"
+    r"\bDATENAME\s*\(|\bDATEFROMPARTS\s*\(|\bEOMONTH\s*\(|\bISNULL\s*\(|\bLEN\s*\(|\bCONVERT\s*\(|"
+    r"\bYEAR\s*\(|\bMONTH\s*\(|\bDAY\s*\(|\[\w[^\]]*\]",
+    re.IGNORECASE,
+)
+
+# Quy tắc cú pháp đưa vào prompt theo từng dialect
+DIALECT_RULES = {
+    "tsql": {
+        "name": "SQL Server (T-SQL)",
+        "rules": [
+            "Dùng `TOP n` thay vì `LIMIT n`. (Ví dụ: `SELECT TOP 5 * FROM...`)",
+            "Dùng `GETDATE()` thay vì `now()`.",
+            "Dùng `FORMAT(date_col, 'yyyy-MM-dd')` nếu cần format ngày.",
+        ],
+    },
+    "sqlite": {
+        "name": "SQLite",
+        "rules": [
+            "Dùng `LIMIT n` ở cuối câu (KHÔNG dùng `TOP n`).",
+            "Dùng `date('now')` / `datetime('now')` thay vì `GETDATE()`; cộng trừ ngày: `date('now', '-3 months')`.",
+            "Dùng `strftime('%Y-%m', date_col)` để nhóm theo tháng (KHÔNG dùng FORMAT, YEAR(), MONTH()).",
+            "Dùng `COALESCE` thay vì `ISNULL`, `LENGTH` thay vì `LEN`.",
+        ],
+    },
+    "duckdb": {
+        "name": "DuckDB",
+        "rules": [
+            "Dùng `LIMIT n` ở cuối câu (KHÔNG dùng `TOP n`).",
+            "Dùng `current_date` / `now()` thay vì `GETDATE()`; cộng trừ ngày: `current_date - INTERVAL 3 MONTH`.",
+            "Dùng `date_trunc('month', date_col)` để nhóm theo tháng; `strftime(date_col, '%Y-%m')` nếu cần chuỗi.",
+            "Dùng `year(date_col)`, `month(date_col)`; `COALESCE` thay vì `ISNULL`, `length` thay vì `LEN`.",
+            "Chia số nguyên dùng `/` cho kết quả số thực, `//` cho phép chia lấy phần nguyên.",
+        ],
+    },
+}
+
+
+def get_sqlglot_dialect(engine=None):
+    """
+    Dialect sqlglot tương ứng với engine (mặc định T-SQL).
+    """
+    if engine is None:
+        return "tsql"
+    return SQLGLOT_DIALECTS.get(engine.dialect.name, engine.dialect.name)
+
+
+def get_dialect_rules(dialect):
+    """
+    (Tên hiển thị, danh sách quy tắc cú pháp) cho prompt. Dialect lạ thì chỉ dặn dùng đúng cú pháp.
+    """
+    info = DIALECT_RULES.get(dialect)
+    if info is None:
+        return dialect, [f"Sử dụng đúng cú pháp của {dialect}."]
+    return info["name"], info["rules"]
+
+
+def looks_like_tsql(sql_query: str) -> bool:
+    return bool(_TSQL_MARKERS.search(sql_query))
+
+
+def _strftime_int(fmt, value):
+    return exp.Cast(
+        this=exp.Anonymous(this="STRFTIME", expressions=[exp.Literal.string(fmt), value]),
+        to=exp.DataType.build("INTEGER"),
+    )
+
+
+def _fix_for_sqlite(node):
+    """
+    Bổ sung các hàm ngày tháng sqlglot chưa tự dịch sang SQLite (YEAR, MONTH, DATEPART, DATEFROMPARTS).
+    """
+    parts = {exp.Year: "%Y", exp.Month: "%m", exp.Day: "%d"}
+    for node_type, fmt in parts.items():
+        if isinstance(node, node_type):
+            return _strftime_int(fmt, node.this.transform(_fix_for_sqlite))
+
+    if isinstance(node, exp.Extract):
+        unit = node.this.name.lower()
+        fmt = {"year": "%Y", "yy": "%Y", "yyyy": "%Y", "month": "%m", "mm": "%m", "m": "%m",
+               "day": "%d", "dd": "%d", "d": "%d", "hour": "%H", "hh": "%H"}.get(unit)
+        if fmt:
+            return _strftime_int(fmt, node.expression.transform(_fix_for_sqlite))
+
+    if isinstance(node, exp.DateFromParts):
+        return exp.Anonymous(this="PRINTF", expressions=[
+            exp.Literal.string("%04d-%02d-%02d"),
+            *(node.args[part].transform(_fix_for_sqlite) for part in ("year", "month", "day")),
+        ])
+    return node
+
+
+def transpile_sql(sql_query: str, engine=None, dialect=None):
+    """
+    Dịch SQL kiểu T-SQL sang dialect của engine (TOP -> LIMIT, GETDATE -> CURRENT_TIMESTAMP,
+    FORMAT -> strftime...). SQL đã đúng dialect, hoặc không dịch được, thì giữ nguyên.
+    """
+    target = dialect or get_sqlglot_dialect(engine)
+    if target == "tsql" or not sql_query or not looks_like_tsql(sql_query):
+        return sql_query
+
+    try:
+        tree = sqlglot.parse_one(sql_query, read="tsql")
+        if target == "sqlite":
+            tree = tree.transform(_fix_for_sqlite)
+        translated = tree.sql(dialect=target)
+    except SqlglotError as e:
+        print(f"⚠️ Không dịch được SQL sang {target}: {e}")
+        return sql_query
+
+    print(f"🔁 Đã dịch SQL từ T-SQL sang {target}.")
+    return translated
@@ -0,0 +1,163 @@
+import os
+import numpy as np
+import pandas as pd
+import sqlglot
+from sqlglot import exp
+from core.sql_validator import parse_sql
+from core.dialect import get_sqlglot_dialect
+from core.sql_executor import execute_sql
+
+# --- RÚT GỌN DỮ LIỆU CHO BIỂU ĐỒ ---
+# Plotly phải chuyển toàn bộ điểm sang JSON rồi trình duyệt mới vẽ: chuỗi thời gian 100k+ dòng làm treo cả hai.
+# - Biểu đồ đường: giữ tối đa CHART_MAX_POINTS điểm, chọn bằng LTTB (giữ hình dạng đường) hoặc min-max
+#   (giữ đỉnh / đáy của từng khoảng), đặt bằng CHART_DOWNSAMPLE=lttb|minmax.
+# - Biểu đồ cột: cộng theo nhóm, giữ CHART_MAX_BARS nhóm lớn nhất, phần còn lại gộp vào 1 cột "Khác".
+# - Kết quả bị cắt bớt (RESULT_MAX_ROWS) hoặc quá CHART_PUSHDOWN_ROWS dòng: tính gộp ngay trong DB
+#   (GROUP BY / NTILE trên câu SQL gốc) để biểu đồ phủ toàn bộ dữ liệu chứ không chỉ phần đã đọc về.
+OTHER_LABEL = "Khác"
+_SOURCE = "_chart_source"
+
+
+def chart_budgets():
+    """
+    Ngân sách điểm của biểu đồ: (CHART_MAX_POINTS, CHART_MAX_BARS, CHART_PUSHDOWN_ROWS, CHART_DOWNSAMPLE).
+    """
+    return (
+        int(os.getenv("CHART_MAX_POINTS", "2000")),
+        int(os.getenv("CHART_MAX_BARS", "30")),
+        int(os.getenv("CHART_PUSHDOWN_ROWS", "100000")),
+        os.getenv("CHART_DOWNSAMPLE", "lttb").strip().lower(),
+    )
+
+
+def _as_float(values):
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype("datetime64[ns]").astype(np.int64).astype(float)
+    return values.astype(float)
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: chọn n_out điểm (luôn giữ điểm đầu và cuối) sao cho đường nối các điểm
+    giống đường gốc nhất. x phải đã sắp tăng dần. Trả về mảng chỉ số.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x, y = _as_float(x), _as_float(y)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)  # n_out - 2 khoảng ở giữa
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        # Điểm "kế tiếp" = trung bình của khoảng sau (khoảng cuối -> điểm cuối)
+        nxt_end = edges[i + 2] if i + 2 < len(edges) else n
+        if i + 1 < len(edges) - 1:
+            avg_x, avg_y = x[end:nxt_end].mean(), y[end:nxt_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        # Chọn điểm tạo tam giác lớn nhất với điểm đã chọn trước đó và điểm "kế tiếp"
+        area = np.abs((x[prev] - avg_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (avg_y - y[prev]))
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+    return selected
+
+
+def minmax_indices(x, y, n_out):
+    """
+    Chia n điểm thành n_out / 2 khoảng đều nhau, giữ điểm nhỏ nhất và lớn nhất của mỗi khoảng
+    (không mất đỉnh / đáy). x phải đã sắp tăng dần. Trả về mảng chỉ số (theo thứ tự x).
+    """
+    n = len(x)
+    buckets = max(n_out // 2, 1)
+    if n_out >= n:
+        return np.arange(n)
+    y = _as_float(y)
+    bucket = np.arange(n) * buckets // n
+    order = np.lexsort((y, bucket))  # trong từng khoảng: y tăng dần
+    bounds = np.flatnonzero(np.r_[True, bucket[order][1:] != bucket[order][:-1], True])
+    keep = np.concatenate([order[bounds[:-1]], order[bounds[1:] - 1]])
+    return np.unique(keep)
+
+
+def downsample_line(df, x_col, y_col, n_out, method="lttb"):
+    """
+    Rút gọn 1 chuỗi (đã bỏ dòng thiếu x / y) về tối đa n_out điểm, sắp theo x.
+    """
+    data = df.dropna(subset=[x_col, y_col]).sort_values(x_col, kind="stable")
+    if len(data) <= n_out:
+        return data
+    pick = minmax_indices if method == "minmax" else lttb_indices
+    return data.iloc[pick(data[x_col].to_numpy(), data[y_col].to_numpy(), n_out)]
+
+
+def top_n_with_other(df, cat_col, value_col, n):
+    """
+    Cộng value_col theo cat_col, giữ n nhóm lớn nhất (giảm dần), gộp các nhóm còn lại
+    vào 1 dòng "Khác (k nhóm)". Trả về (DataFrame 2 cột, số nhóm ban đầu).
+    """
+    totals = df.groupby(cat_col, sort=False, observed=True, dropna=False)[value_col].sum()
+    if len(totals) <= n:
+        return totals.reset_index(), len(totals)
+    top = totals.nlargest(n)
+    result = top.reset_index()
+    result[cat_col] = result[cat_col].astype(str)
+    other = pd.DataFrame({cat_col: [f"{OTHER_LABEL} ({len(totals) - n} nhóm)"],
+                          value_col: [totals.drop(top.index).sum()]})
+    return pd.concat([result, other], ignore_index=True), len(totals)
+
+
+def _pushdown_sql(sql_query, template, engine):
+    """
+    Ghép câu SQL gốc làm subquery vào template (viết bằng SQL chung, bảng nguồn tên _chart_source)
+    rồi sinh SQL theo dialect của DB. None nếu không parse được.
+    """
+    dialect = get_sqlglot_dialect(engine)
+    statements = parse_sql(sql_query.strip().rstrip(";"), dialect)
+    if not statements or len(statements) != 1 or not isinstance(statements[0], exp.Query):
+        return None
+    inner = statements[0].copy()
+    if not inner.args.get("limit") and not inner.args.get("offset"):
+        inner.set("order", None)  # ORDER BY trong subquery vô nghĩa (SQL Server còn báo lỗi)
+    outer = sqlglot.parse_one(template)
+    for table in list(outer.find_all(exp.Table)):
+        if table.name == _SOURCE:
+            table.replace(inner.subquery("_chart"))
+    return outer.sql(dialect=dialect)
+
+
+def _ident(name):
+    return exp.to_identifier(str(name), quoted=True).sql()
+
+
+def pushdown_bar(sql_query, engine, cat_col, value_col):
+    """
+    Tổng value_col theo cat_col tính trong DB (phủ toàn bộ dữ liệu, kể cả phần bị cắt khi đọc về).
+    Trả về DataFrame 2 cột, hoặc None nếu không làm được (lỗi SQL, kết quả vẫn bị cắt).
+    """
+    cat, value = _ident(cat_col), _ident(value_col)
+    sql = _pushdown_sql(sql_query, f"SELECT {cat}, SUM({value}) AS {value} FROM {_SOURCE} GROUP BY {cat}", engine)
+    if sql is None:
+        return None
+    df = execute_sql(sql, engine=engine)
+    return df if isinstance(df, pd.DataFrame) and not df.attrs.get("truncated") else None
+
+
+def pushdown_line(sql_query, engine, x_col, y_col, buckets):
+    """
+    Chia chuỗi (theo thứ tự x) thành `buckets` khoảng bằng NTILE ngay trong DB, mỗi khoảng trả về
+    x đầu khoảng, trung bình, min, max của y. Trả về DataFrame (x_col, y_col, y_min, y_max) hoặc None.
+    """
+    x, y = _ident(x_col), _ident(y_col)
+    template = (
+        f"SELECT MIN({x}) AS {x}, AVG(CAST({y} AS DOUBLE)) AS {y}, MIN({y}) AS y_min, MAX({y}) AS y_max "
+        f"FROM (SELECT {x}, {y}, NTILE({int(buckets)}) OVER (ORDER BY {x}) AS _bucket FROM {_SOURCE} "
+        f"WHERE {x} IS NOT NULL AND {y} IS NOT NULL) AS _buckets GROUP BY _bucket ORDER BY 1"
+    )
+    sql = _pushdown_sql(sql_query, template, engine)
+    if sql is None:
+        return None
+    df = execute_sql(sql, engine=engine)
+    return df if isinstance(df, pd.DataFrame) and not df.attrs.get("truncated") else None
@@ -0,0 +1,200 @@
+import os
+import re
+import glob
+import sqlite3
+import threading
+from contextlib import closing
+from urllib.parse import urlencode
+import pandas as pd
+from core.query_cache import BASE_DIR
+from core.database import get_engine
+
+try:
+    import duckdb
+except ImportError:  # duckdb không bắt buộc, thiếu thì dùng SQLite như cũ
+    duckdb = None
+
+try:
+    import duckdb_engine  # noqa: F401  (đăng ký dialect "duckdb" cho SQLAlchemy)
+except ImportError:
+    duckdb_engine = None
+
+# --- DUCKDB BACKEND ---
+# SQLite là row-store, chạy GROUP BY / JOIN lớn trên 1 luồng. DuckDB (column-store, chạy song song trên mọi
+# core) dùng cho phần phân tích khi DB_BACKEND=duckdb:
+# - DB mặc định (SQLite fallback): chép sang 1 file .duckdb chỉ đọc (.cache/duckdb), chép lại khi file SQLite đổi.
+# - File upload (core/ingestion.py): tạo VIEW đọc thẳng file CSV/Parquet (read_csv_auto / read_parquet),
+#   không có bước nạp dữ liệu.
+# Kết quả đọc về dạng Arrow (xem sql_executor._read_arrow).
+DEFAULT_DUCKDB_DIR = os.path.join(BASE_DIR, ".cache", "duckdb")
+MIRROR_CHUNK_ROWS = 200_000
+
+_mirror_lock = threading.Lock()
+_warned = False
+
+
+def duckdb_available():
+    return duckdb is not None and duckdb_engine is not None
+
+
+def use_duckdb(backend=None):
+    """
+    True nếu chọn DuckDB (tham số backend hoặc DB_BACKEND=duckdb) và đã cài duckdb + duckdb-engine.
+    Chọn DuckDB mà chưa cài -> cảnh báo 1 lần rồi dùng SQLite.
+    """
+    global _warned
+    backend = (backend or os.getenv("DB_BACKEND") or "sqlite").strip().lower()
+    if backend != "duckdb":
+        return False
+    if duckdb_available():
+        return True
+    if not _warned:
+        print("⚠️ DB_BACKEND=duckdb nhưng chưa cài duckdb / duckdb-engine (pip install duckdb duckdb-engine), dùng SQLite.")
+        _warned = True
+    return False
+
+
+def get_duckdb_engine(path, read_only=True):
+    """
+    Engine dùng chung (registry của core/database.py) cho 1 file DuckDB.
+    read_only: nhiều tiến trình mở cùng file được, và chặn luôn mọi lệnh ghi.
+    Cấu hình: DUCKDB_THREADS (mặc định = số core), DUCKDB_MEMORY_LIMIT (VD: 4GB).
+    """
+    options = {}
+    if read_only:
+        options["access_mode"] = "read_only"
+    if os.getenv("DUCKDB_THREADS"):
+        options["threads"] = int(os.getenv("DUCKDB_THREADS"))
+    if os.getenv("DUCKDB_MEMORY_LIMIT"):
+        options["memory_limit"] = os.getenv("DUCKDB_MEMORY_LIMIT")
+    query = f"?{urlencode(options)}" if options else ""
+    return get_engine(f"duckdb:///{os.path.abspath(path)}{query}")
+
+
+def quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _duckdb_type(declared):
+    """
+    Kiểu khai báo trong SQLite (tự do, VD: VARCHAR(255), DATETIME) -> kiểu DuckDB.
+    """
+    declared = (declared or "").upper()
+    if "INT" in declared:
+        return "BIGINT"
+    if any(word in declared for word in ("REAL", "FLOA", "DOUB", "NUMERIC", "DECIMAL")):
+        return "DOUBLE"
+    if "BOOL" in declared:
+        return "BOOLEAN"
+    if "DATETIME" in declared or "TIMESTAMP" in declared:
+        return "TIMESTAMP"
+    if "DATE" in declared:
+        return "DATE"
+    return "VARCHAR"
+
+
+def _sqlite_tables(conn):
+    """
+    {tên bảng: (cột [(tên, kiểu DuckDB, not null)], khóa chính, khóa ngoại [(cột, bảng, cột)])}
+    theo thứ tự bảng được tham chiếu đứng trước (để tạo khóa ngoại).
+    """
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    )]
+    tables = {}
+    for name in names:
+        info = conn.execute(f"PRAGMA table_info({quote(name)})").fetchall()
+        columns = [(row[1], _duckdb_type(row[2]), bool(row[3])) for row in info]
+        pk = [row[1] for row in sorted(info, key=lambda r: r[5]) if row[5]]
+        fks = [(row[3], row[2], row[4]) for row in conn.execute(f"PRAGMA foreign_key_list({quote(name)})")]
+        tables[name] = (columns, pk, [fk for fk in fks if fk[1] in names and fk[1] != name and fk[2]])
+
+    ordered, seen = [], set()
+
+    def visit(name):
+        if name in seen:
+            return
+        seen.add(name)
+        for _, referred, _ in tables[name][2]:
+            visit(referred)
+        ordered.append(name)
+
+    for name in names:
+        visit(name)
+    return {name: tables[name] for name in ordered}
+
+
+def _create_table_sql(name, columns, pk, fks):
+    parts = [f"{quote(col)} {col_type}{' NOT NULL' if not_null else ''}" for col, col_type, not_null in columns]
+    if pk:
+        parts.append(f"PRIMARY KEY ({', '.join(quote(c) for c in pk)})")
+    for column, referred, referred_column in fks:
+        parts.append(f"FOREIGN KEY ({quote(column)}) REFERENCES {quote(referred)} ({quote(referred_column)})")
+    return f"CREATE TABLE {quote(name)} ({', '.join(parts)})"
+
+
+def _copy_sqlite(sqlite_path, target_path, with_foreign_keys=True):
+    with closing(sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True)) as source, \
+            closing(duckdb.connect(target_path)) as target:
+        for name, (columns, pk, fks) in _sqlite_tables(source).items():
+            target.execute(_create_table_sql(name, columns, pk, fks if with_foreign_keys else []))
+            for chunk in pd.read_sql_query(f"SELECT * FROM {quote(name)}", source, chunksize=MIRROR_CHUNK_ROWS):
+                target.register("_chunk", chunk)
+                # DuckDB tự ép kiểu chuỗi ngày của SQLite ('2025-01-31') sang DATE / TIMESTAMP
+                target.execute(f"INSERT INTO {quote(name)} SELECT * FROM _chunk")
+                target.unregister("_chunk")
+        target.execute("CHECKPOINT")
+
+
+def mirror_sqlite(sqlite_path, mirror_dir=None):
+    """
+    Bản DuckDB (chỉ đọc) của 1 file SQLite. Tên file gồm mtime + kích thước của SQLite (và file -wal):
+    SQLite đổi -> chép sang file mới (engine cũ vẫn đọc file cũ cho tới khi hết dùng), xóa các bản cũ.
+    Trả về đường dẫn file .duckdb.
+    """
+    mirror_dir = mirror_dir or os.getenv("DUCKDB_DIR") or DEFAULT_DUCKDB_DIR
+    os.makedirs(mirror_dir, exist_ok=True)
+
+    version = []
+    for path in (sqlite_path, f"{sqlite_path}-wal"):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            version.append(f"{stat.st_mtime_ns:x}{stat.st_size:x}")
+    stem = re.sub(r"[^A-Za-z0-9_]+", "_", os.path.splitext(os.path.basename(sqlite_path))[0])
+    target = os.path.join(mirror_dir, f"{stem}-{'-'.join(version)}.duckdb")
+
+    with _mirror_lock:
+        if os.path.exists(target):
+            return target
+        print(f"🦆 Đang chép {os.path.basename(sqlite_path)} sang DuckDB...")
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        try:
+            try:
+                _copy_sqlite(sqlite_path, tmp_path)
+            except duckdb.ConstraintException as e:
+                # SQLite mặc định không kiểm tra khóa ngoại -> dữ liệu có thể "mồ côi"; chép lại không kèm FK
+                print(f"⚠️ Dữ liệu vi phạm khóa ngoại ({e}), chép lại không kèm khóa ngoại.")
+                os.remove(tmp_path)
+                _copy_sqlite(sqlite_path, tmp_path, with_foreign_keys=False)
+            os.replace(tmp_path, target)
+        finally:
+            for leftover in (tmp_path, f"{tmp_path}.wal"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        for old in glob.glob(os.path.join(mirror_dir, f"{stem}-*.duckdb")):
+            if old != target:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+    return target
+
+
+def file_view_sql(view_name, file_path):
+    """
+    VIEW đọc thẳng file: .parquet -> read_parquet, còn lại -> read_csv_auto (tự dò dấu phân cách / kiểu cột).
+    """
+    path = os.path.abspath(file_path).replace("'", "''")
+    reader = "read_parquet" if file_path.lower().endswith(".parquet") else "read_csv_auto"
+    return f"CREATE OR REPLACE VIEW {quote(view_name)} AS SELECT * FROM {reader}('{path}')"
@@ -0,0 +1,83 @@
+import io
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow không bắt buộc: CSV dùng pandas, không xuất được Parquet
+    pa = None
+
+# --- XUẤT KẾT QUẢ ---
+# Chỉ tạo file khi người dùng bấm tải (app.py truyền hàm vào st.download_button), không dựng sẵn
+# bản CSV của mọi kết quả ở mỗi lần Streamlit rerun. Ghi bằng Arrow: cột chuỗi Arrow / category
+# chuyển sang Arrow gần như không phải chép, không qua từng ô Python như DataFrame.to_csv.
+EXPORT_FORMATS = {
+    "csv": {"label": "CSV", "extension": "csv", "mime": "text/csv"},
+    "parquet": {"label": "Parquet", "extension": "parquet", "mime": "application/vnd.apache.parquet"},
+}
+
+
+def available_formats():
+    """
+    Các định dạng xuất được với thư viện đang cài (Parquet cần pyarrow).
+    """
+    return [fmt for fmt in EXPORT_FORMATS if fmt == "csv" or pa is not None]
+
+
+def _to_arrow(df: pd.DataFrame):
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """
+    DataFrame -> CSV (UTF-8, có dòng tiêu đề).
+    """
+    if pa is not None:
+        try:
+            table = _to_arrow(df)
+            for i, field in enumerate(table.schema):
+                column = table.column(i)
+                if pa.types.is_dictionary(field.type):
+                    # Cột category (dictionary) ghi theo giá trị, không theo mã
+                    column = column.cast(field.type.value_type)
+                elif pa.types.is_timestamp(field.type):
+                    # Không có phần lẻ của giây thì ghi "2025-01-31 08:00:00" (như pandas), không thêm ".000000"
+                    try:
+                        column = column.cast(pa.timestamp("s", field.type.tz))
+                    except pa.ArrowInvalid:
+                        pass
+                table = table.set_column(i, field.name, column)
+            sink = io.BytesIO()
+            pa_csv.write_csv(table, sink, pa_csv.WriteOptions(quoting_style="needed"))
+            return sink.getvalue()
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            pass  # Cột object lẫn kiểu -> dùng pandas
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    """
+    DataFrame -> Parquet (nén zstd, giữ nguyên kiểu cột; category -> dictionary).
+    """
+    if pa is None:
+        raise RuntimeError("Xuất Parquet cần cài pyarrow.")
+    sink = io.BytesIO()
+    pq.write_table(_to_arrow(df), sink, compression="zstd")
+    return sink.getvalue()
+
+
+def export_bytes(df: pd.DataFrame, fmt="csv") -> bytes:
+    if fmt == "parquet":
+        return to_parquet_bytes(df)
+    return to_csv_bytes(df)
+
+
+def exporter(df, fmt="csv"):
+    """
+    Hàm không tham số tạo file khi được gọi (dùng làm data cho st.download_button).
+    df: DataFrame, hoặc hàm trả về DataFrame (VD: nạp lại kết quả đã tràn xuống đĩa chỉ khi bấm tải).
+    """
+    if callable(df):
+        return lambda: export_bytes(df(), fmt)
+    return lambda: export_bytes(df, fmt)
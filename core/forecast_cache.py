@@ -0,0 +1,573 @@
+import os
+import math
+import time
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import sqlglot
+from sqlglot import exp
+from core.query_cache import BASE_DIR
+from core.result_cache import canonicalize_sql
+from core.schema_cache import get_schema_snapshot
+from core.sql_validator import parse_sql
+from core.dialect import get_sqlglot_dialect
+from core.index_advisor import database_key
+from core.sql_executor import execute_sql, EMPTY_RESULT_MESSAGE
+from core.forecaster import find_date_columns, find_forecast_columns, series_key, series_sums, to_days
+
+# --- FORECAST CACHE ---
+# Câu hỏi dự báo lặp lại (VD: "dự báo chi phí tháng sau" mỗi sáng) phải quét lại toàn bộ lịch sử.
+# Với câu SQL lịch sử dạng SUM/COUNT ... GROUP BY, kết quả cộng dồn được theo từng dòng nguồn:
+# - Lần đầu: chạy câu SQL giới hạn id <= MAX(id) (watermark), lưu các điểm + thống kê đủ
+#   (n, Σx, Σy, Σxy, Σx²) của từng chuỗi xuống đĩa.
+# - Lần sau: chỉ chạy câu SQL trên các dòng id trong (watermark, MAX(id) mới], cộng phần chênh vào
+#   các điểm và thống kê đủ -> O(số dòng mới), không quét lại lịch sử, không fit lại từ đầu.
+# Khóa gồm schema hash: schema đổi thì các bản lưu cũ của DB đó bị xóa.
+# Dùng lại trạng thái chỉ tốn truy vấn theo index (MAX(id), đọc các dòng id > watermark), không quét lại lịch sử.
+# Dòng cũ bị sửa / xóa không đổi MAX(id):
+# - bảng sự kiện có cột updated_at (có index): đếm dòng cũ có updated_at mới hơn lần đọc trước (quét index theo khoảng);
+# - trạng thái dựng quá FORECAST_CACHE_MAX_AGE_HOURS giờ được đọc lại toàn bộ;
+# - FORECAST_CACHE_CHECKSUM=1 (tùy chọn, quét toàn bộ lịch sử mỗi lần): so tổng từng cột giá trị trên id <= watermark.
+# Mọi truy vấn kiểm tra chạy qua execute_sql (cùng timeout / cancel_event với câu lịch sử).
+DEFAULT_FORECAST_CACHE_PATH = os.path.join(BASE_DIR, ".cache", "forecast_cache.db")
+# Tên cột thời điểm sửa dòng dùng làm watermark phát hiện UPDATE (phải có index để MAX / lọc theo khoảng rẻ)
+UPDATED_AT_COLUMNS = ("updated_at", "modified_at", "last_modified", "last_updated", "updated_on", "modified_on")
+
+
+def _env_flag(name, default=True):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+class IncrementalPlan:
+    """
+    Phân tích 1 câu SQL lịch sử: bảng sự kiện (bảng lớn nhất, có khóa chính số nguyên), vị trí các cột khóa
+    (GROUP BY) và các cột giá trị cộng dồn được (SUM / COUNT).
+    """
+    def __init__(self, select, fact_table, fact_ref, pk, tables, key_positions, value_positions, dialect,
+                 updated_column=None):
+        self.select = select
+        self.fact_table = fact_table
+        self.fact_ref = fact_ref
+        self.pk = pk
+        self.tables = tables
+        self.key_positions = key_positions
+        self.value_positions = value_positions
+        self.dialect = dialect
+        self.updated_column = updated_column
+
+    def _fact_query(self, *expressions):
+        return sqlglot.select(*expressions).from_(exp.to_table(self.fact_table, quoted=True))
+
+    def _fact_column(self, name):
+        return exp.column(name, quoted=True)
+
+    def max_updated_sql(self):
+        return self._fact_query(exp.Max(this=self._fact_column(self.updated_column))).sql(dialect=self.dialect)
+
+    def updated_rows_sql(self, watermark, since):
+        """
+        Số dòng cũ (id <= watermark) có updated_at mới hơn since (lọc theo index của updated_at).
+        """
+        return self._fact_query(exp.Count(this=exp.Star())).where(
+            exp.GT(this=self._fact_column(self.updated_column), expression=exp.Literal.string(since)),
+            exp.LTE(this=self._fact_column(self.pk), expression=exp.Literal.number(int(watermark))),
+        ).sql(dialect=self.dialect)
+
+    def versions_sql(self, snapshot, engine):
+        """
+        1 câu UNION ALL: MAX(id) của bảng sự kiện (tra index, không đếm), số dòng + MAX khóa chính của các bảng
+        danh mục (nhỏ). None nếu không có bảng nào cần kiểm tra.
+        """
+        quote = engine.dialect.identifier_preparer.quote
+        probes = []
+        for table in self.tables:
+            if table == self.fact_table:
+                probes.append(f"SELECT '{table}' AS table_name, 0 AS row_count, MAX({quote(self.pk)}) AS max_id "
+                              f"FROM {quote(table)}")
+                continue
+            # View DuckDB đọc thẳng file upload (tên file theo hash nội dung) -> không đổi
+            if snapshot.tables[table].get("view") and engine.dialect.name == "duckdb":
+                continue
+            pk = snapshot.tables[table].get("primary_key") or []
+            max_expr = f"MAX({quote(pk[0])})" if len(pk) == 1 else "NULL"
+            probes.append(f"SELECT '{table}', COUNT(*), {max_expr} FROM {quote(table)}")
+        return " UNION ALL ".join(probes)
+
+    def bounded_sql(self, lo, hi):
+        """
+        Câu SQL gốc chỉ trên các dòng nguồn có lo < id <= hi (lo=None: từ đầu).
+        """
+        column = f"{self.fact_ref}.{self.pk}"
+        select = self.select.where(f"{column} <= {int(hi)}", append=True, copy=True)
+        if lo is not None:
+            select = select.where(f"{column} > {int(lo)}", append=True, copy=False)
+        return select.sql(dialect=self.dialect)
+
+    def checksum_sql(self, hi):
+        """
+        Tổng của từng cột giá trị trên các dòng nguồn có id <= hi (bỏ GROUP BY): bằng tổng các điểm đã lưu
+        nếu các dòng cũ không bị sửa.
+        """
+        select = self.select.copy()
+        select.set("expressions", [
+            select.expressions[position].unalias().as_(f"_v{i}") for i, position in enumerate(self.value_positions)
+        ])
+        select.set("group", None)
+        select.set("order", None)
+        select = select.where(f"{self.fact_ref}.{self.pk} <= {int(hi)}", append=True, copy=False)
+        return select.sql(dialect=self.dialect)
+
+
+def plan_incremental(sql_query, snapshot, dialect=None):
+    """
+    Trả về IncrementalPlan nếu kết quả câu SQL cộng dồn được theo dòng nguồn, ngược lại None.
+    Điều kiện: 1 câu SELECT có GROUP BY, chỉ INNER JOIN, không HAVING / TOP / LIMIT / DISTINCT /
+    subquery / window; mỗi cột trả về là khóa GROUP BY hoặc đúng 1 hàm SUM(...) / COUNT(...) (không DISTINCT).
+    """
+    statements = parse_sql(sql_query, dialect)
+    if not statements or len(statements) != 1 or not isinstance(statements[0], exp.Select):
+        return None
+    select = statements[0]
+    if not select.args.get("group") or any(select.args.get(arg) for arg in ("having", "limit", "offset", "distinct")):
+        return None
+    if any(select.find(node) for node in (exp.Subquery, exp.CTE, exp.SetOperation, exp.Window)):
+        return None
+    for join in select.args.get("joins") or []:
+        if join.text("side") or join.text("kind").upper() not in ("", "INNER"):
+            return None
+
+    key_positions, value_positions = [], []
+    for position, expression in enumerate(select.expressions):
+        inner = expression.unalias()
+        if isinstance(inner, (exp.Sum, exp.Count)):
+            if isinstance(inner.this, exp.Distinct) or inner.this.find(exp.AggFunc):
+                return None
+            value_positions.append(position)
+        elif isinstance(inner, exp.Star) or inner.find(exp.AggFunc):
+            return None  # AVG, MAX, ROUND(SUM(...))... không cộng dồn được
+        else:
+            key_positions.append(position)
+    if not key_positions or not value_positions:
+        return None
+
+    # Bảng sự kiện = bảng có nhiều dòng nhất trong câu SQL, phải có khóa chính là 1 cột số nguyên
+    sources = {}
+    for table in select.find_all(exp.Table):
+        real = next((t for t in snapshot.tables if t.lower() == table.name.lower()), None)
+        if real is None:
+            return None
+        sources[table.alias_or_name] = real
+    if len(set(sources.values())) != len(sources):
+        return None  # Self-join: không biết giới hạn id ở phía nào
+    fact_ref, fact_table = max(sources.items(), key=lambda item: snapshot.tables[item[1]].get("row_estimate") or 0)
+    pk = snapshot.tables[fact_table].get("primary_key") or []
+    if len(pk) != 1:
+        return None
+    pk_type = next((c["type"] for c in snapshot.tables[fact_table]["columns"] if c["name"] == pk[0]), "")
+    if "INT" not in pk_type.upper():
+        return None
+
+    return IncrementalPlan(select, fact_table, fact_ref, pk[0], sorted(set(sources.values())),
+                           key_positions, value_positions, dialect, updated_at_column(snapshot, fact_table))
+
+
+def updated_at_column(snapshot, table):
+    """
+    Cột thời điểm sửa dòng (updated_at...) của bảng, chỉ nhận nếu là cột đầu của 1 index; không có -> None.
+    """
+    info = snapshot.tables[table]
+    indexed = {str(index["columns"][0]).lower() for index in info.get("indexes") or [] if index.get("columns")}
+    for column in info["columns"]:
+        name = str(column["name"])
+        if name.lower() in UPDATED_AT_COLUMNS and name.lower() in indexed:
+            return name
+    return None
+
+
+# --- TRẠNG THÁI DỰ BÁO ---
+
+def _add(old, delta):
+    """
+    Cộng kiểu SUM của SQL: NULL + x = x.
+    """
+    if delta is None or (isinstance(delta, float) and np.isnan(delta)):
+        return old
+    if old is None or (isinstance(old, float) and np.isnan(old)):
+        return delta
+    return old + delta
+
+
+def _same_total(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return math.isclose(float(a), float(b), rel_tol=1e-9, abs_tol=1e-6)
+
+
+def state_totals(state):
+    """
+    Tổng từng cột giá trị trên mọi điểm đã lưu (NULL bỏ qua như SUM của SQL).
+    """
+    totals = [None] * len(state["value_positions"])
+    for values in state["points"].values():
+        totals = [_add(total, value) for total, value in zip(totals, values)]
+    return totals
+
+
+def _rows(df):
+    return [series_key(row) for row in df.itertuples(index=False)]
+
+
+def history_frame(state):
+    """
+    DataFrame lịch sử (đúng tên + thứ tự cột như câu SQL) dựng lại từ các điểm đã lưu.
+    """
+    columns = state["columns"]
+    key_positions, value_positions = state["key_positions"], state["value_positions"]
+    records = []
+    for key, values in state["points"].items():
+        row = [None] * len(columns)
+        for position, value in zip(key_positions, key):
+            row[position] = value
+        for position, value in zip(value_positions, values):
+            row[position] = value
+        records.append(row)
+    df = pd.DataFrame.from_records(records, columns=columns)
+    for position in value_positions:
+        df[columns[position]] = pd.to_numeric(df[columns[position]], errors='coerce')
+    return df
+
+
+def _forecast_roles(df):
+    """
+    (cột nhóm, cột thời gian, cột giá trị) mà bước dự báo sẽ dùng (cùng logic với smart_agent), hoặc None.
+    """
+    df = df.copy()
+    date_cols = find_date_columns(df)
+    group_cols, value_cols = find_forecast_columns(df, date_cols)
+    if len(date_cols) == 0 or not value_cols:
+        return None, df
+    return (tuple(group_cols), date_cols[0], value_cols[0]), df
+
+
+def rebuild_sums(state):
+    """
+    Tính lại thống kê đủ của mọi chuỗi từ các điểm đã lưu (lần đầu, hoặc khi dữ liệu mới làm đổi vai trò cột).
+    """
+    roles, df = _forecast_roles(history_frame(state))
+    state["roles"], state["sums"] = roles, {}
+    if roles is None:
+        return state
+    group_cols, time_col, value_col = roles
+    df = df.dropna(subset=[time_col, value_col])
+    if df.empty:
+        return state
+    if group_cols:
+        codes, uniques = pd.factorize(pd.MultiIndex.from_frame(df[list(group_cols)]))
+        keys = [series_key(u if isinstance(u, tuple) else (u,)) for u in uniques]
+    else:
+        codes, keys = np.zeros(len(df), dtype=np.int64), [()]
+    sums = series_sums(codes, to_days(df[time_col].to_numpy()), df[value_col].to_numpy(dtype=float), len(keys))
+    state["sums"] = {key: row.tolist() for key, row in zip(keys, sums)}
+    return state
+
+
+def build_state(df, plan):
+    state = {
+        "built_at": time.time(),
+        "columns": list(df.columns),
+        "key_positions": plan.key_positions,
+        "value_positions": plan.value_positions,
+        "points": {},
+    }
+    keys = _rows(df.iloc[:, plan.key_positions])
+    values = _rows(df.iloc[:, plan.value_positions])
+    state["points"] = {key: list(vals) for key, vals in zip(keys, values)}
+    return rebuild_sums(state)
+
+
+def fold_in(state, delta_df):
+    """
+    Cộng kết quả trên các dòng mới vào trạng thái: chỉ cập nhật các điểm / chuỗi bị ảnh hưởng.
+    Trả về số điểm thay đổi.
+    """
+    if list(delta_df.columns) != state["columns"]:
+        raise ValueError("Cột của phần dữ liệu mới khác lần trước.")
+    keys = _rows(delta_df.iloc[:, state["key_positions"]])
+    deltas = _rows(delta_df.iloc[:, state["value_positions"]])
+
+    roles = state.get("roles")
+    if roles is not None:
+        group_cols, time_col, value_col = roles
+        columns = state["columns"]
+        key_index = {columns[p]: i for i, p in enumerate(state["key_positions"])}
+        value_index = {columns[p]: i for i, p in enumerate(state["value_positions"])}
+        if time_col not in key_index or value_col not in value_index or any(c not in key_index for c in group_cols):
+            roles = None
+        else:
+            times = pd.to_datetime(pd.Series([k[key_index[time_col]] for k in keys], dtype=object),
+                                   errors='coerce', format='mixed')
+            if times.isna().any():
+                roles = None  # Mốc thời gian mới không đọc được -> tính lại toàn bộ bên dưới
+            else:
+                xs = to_days(times.to_numpy())
+
+    for i, (key, delta) in enumerate(zip(keys, deltas)):
+        old = state["points"].get(key)
+        new = list(delta) if old is None else [_add(o, d) for o, d in zip(old, delta)]
+        state["points"][key] = new
+        if roles is None:
+            continue
+        # Cập nhật thống kê đủ của chuỗi chứa điểm này
+        y_old = None if old is None else old[value_index[value_col]]
+        y_new = new[value_index[value_col]]
+        if y_new is None or (isinstance(y_new, float) and np.isnan(y_new)):
+            continue
+        x = xs[i]
+        sums = state["sums"].setdefault(series_key(key[key_index[c]] for c in group_cols), [0.0] * 5)
+        if y_old is None or (isinstance(y_old, float) and np.isnan(y_old)):
+            sums[0] += 1
+            sums[1] += x
+            sums[4] += x * x
+            y_old = 0.0
+        sums[2] += y_new - y_old
+        sums[3] += x * (y_new - y_old)
+
+    if roles is None:
+        rebuild_sums(state)
+    return len(keys)
+
+
+# --- LƯU TRÊN ĐĨA ---
+
+class ForecastCache:
+    """
+    Trạng thái dự báo theo (DB, schema hash, SQL chuẩn hóa), lưu trên đĩa (SQLite) nên dùng lại được
+    giữa các phiên. Giới hạn số bản lưu bằng LRU (max_entries).
+    """
+    def __init__(self, path=DEFAULT_FORECAST_CACHE_PATH, max_entries=200, max_points=500_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_points = max_points
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS forecast_state ("
+                " db TEXT, schema_hash TEXT, sql TEXT, state BLOB NOT NULL, watermark INTEGER,"
+                " updated_at REAL, last_used REAL, PRIMARY KEY (db, sql))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:  # tự commit/rollback
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, db, schema_hash, sql_query):
+        sql_query = canonicalize_sql(sql_query)
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT state, schema_hash FROM forecast_state WHERE db = ? AND sql = ?", (db, sql_query)
+            ).fetchone()
+            if row is None or row[1] != schema_hash:
+                self.misses += 1
+                return None
+            conn.execute(
+                "UPDATE forecast_state SET last_used = ? WHERE db = ? AND sql = ?", (time.time(), db, sql_query)
+            )
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, db, schema_hash, sql_query, state):
+        if len(state["points"]) > self.max_points:
+            return False
+        now = time.time()
+        payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, self._connect() as conn:
+            # Schema đã đổi -> trạng thái cũ của DB này không dùng được nữa
+            conn.execute("DELETE FROM forecast_state WHERE db = ? AND schema_hash != ?", (db, schema_hash))
+            conn.execute(
+                "INSERT OR REPLACE INTO forecast_state (db, schema_hash, sql, state, watermark, updated_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (db, schema_hash, canonicalize_sql(sql_query), payload, state["watermark"], now, now),
+            )
+            conn.execute(
+                "DELETE FROM forecast_state WHERE rowid NOT IN ("
+                " SELECT rowid FROM forecast_state ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+        return True
+
+    def evict(self, db=None):
+        with self._lock, self._connect() as conn:
+            if db is None:
+                conn.execute("DELETE FROM forecast_state")
+            else:
+                conn.execute("DELETE FROM forecast_state WHERE db = ?", (db,))
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM forecast_state").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": entries,
+        }
+
+
+_forecast_cache = None
+_forecast_cache_lock = threading.Lock()
+
+
+def get_forecast_cache():
+    """
+    Forecast cache dùng chung. Trả về None nếu FORECAST_CACHE_ENABLED=0.
+    Cấu hình: FORECAST_CACHE_PATH, FORECAST_CACHE_MAX_ENTRIES, FORECAST_CACHE_MAX_POINTS.
+    """
+    global _forecast_cache
+    if not _env_flag("FORECAST_CACHE_ENABLED"):
+        return None
+    with _forecast_cache_lock:
+        if _forecast_cache is None:
+            _forecast_cache = ForecastCache(
+                path=os.getenv("FORECAST_CACHE_PATH") or DEFAULT_FORECAST_CACHE_PATH,
+                max_entries=int(os.getenv("FORECAST_CACHE_MAX_ENTRIES", "200")),
+                max_points=int(os.getenv("FORECAST_CACHE_MAX_POINTS", "500000")),
+            )
+    return _forecast_cache
+
+
+def _probe(sql, engine, timeout, cancel_event):
+    """
+    Chạy 1 câu kiểm tra qua execute_sql (không cache, cùng timeout / cancel_event với câu lịch sử).
+    Trả về DataFrame, hoặc chuỗi lỗi.
+    """
+    res = execute_sql(sql, engine, use_cache=False, timeout=timeout, cancel_event=cancel_event)
+    return res if isinstance(res, pd.DataFrame) else str(res)
+
+
+def _scalar_text(value):
+    # Giá trị watermark updated_at -> chuỗi so sánh được trong SQL ('2025-01-31 08:00:00')
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat(sep=" ")
+    return str(value)
+
+
+def _old_rows_changed(engine, plan, state, timeout, cancel_event):
+    """
+    Dòng cũ (id <= watermark) đã bị sửa / xóa? True / False, hoặc chuỗi lỗi của execute_sql.
+    - Có cột updated_at: đếm dòng cũ có updated_at mới hơn lần đọc trước (O(số dòng vừa sửa)).
+    - FORECAST_CACHE_CHECKSUM=1: so tổng từng cột giá trị với tổng các điểm đã lưu (quét toàn bộ lịch sử).
+    """
+    if plan.updated_column is not None and state.get("updated_max") is not None:
+        res = _probe(plan.updated_rows_sql(state["watermark"], state["updated_max"]), engine, timeout, cancel_event)
+        if isinstance(res, str):
+            return res
+        if int(res.iloc[0, 0] or 0):
+            return True
+    if _env_flag("FORECAST_CACHE_CHECKSUM", False):
+        res = _probe(plan.checksum_sql(state["watermark"]), engine, timeout, cancel_event)
+        if isinstance(res, str):
+            return res
+        current = [None if pd.isna(v) else float(v) for v in res.iloc[0]]
+        return not all(_same_total(a, b) for a, b in zip(current, state_totals(state)))
+    return False
+
+
+def fetch_forecast_history(sql_query, engine, timeout=None, cancel_event=None):
+    """
+    Dữ liệu lịch sử cho dự báo, dùng lại trạng thái đã lưu và chỉ đọc các dòng mới từ DB.
+    Trả về:
+    - None: câu SQL không cộng dồn được / cache tắt -> caller chạy execute_sql như bình thường;
+    - chuỗi lỗi của execute_sql (timeout, lỗi SQL...);
+    - DataFrame lịch sử, attrs['forecast_sums'] = {"roles", "sums"} để bước dự báo không phải fit lại.
+    Đọc lại toàn bộ khi: MAX(id) giảm (bảng bị nạp lại), bảng danh mục (machines...) thay đổi, dòng cũ bị sửa
+    (theo updated_at / FORECAST_CACHE_CHECKSUM, xem _old_rows_changed), hoặc trạng thái cũ hơn
+    FORECAST_CACHE_MAX_AGE_HOURS.
+    """
+    cache = get_forecast_cache()
+    if cache is None:
+        return None
+    snapshot = get_schema_snapshot(engine)
+    plan = plan_incremental(sql_query, snapshot, get_sqlglot_dialect(engine))
+    if plan is None:
+        return None
+
+    db = database_key(engine)
+    res = _probe(plan.versions_sql(snapshot, engine), engine, timeout, cancel_event)
+    if isinstance(res, str):
+        return res
+    versions = {str(name): (count, str(watermark)) for name, count, watermark in res.itertuples(index=False, name=None)}
+    fact_max = versions.pop(plan.fact_table)[1]
+    fact_max = int(float(fact_max)) if fact_max not in ("None", "nan", "<NA>") else 0
+    dimensions = sorted(versions.items())
+
+    state = cache.get(db, snapshot.schema_hash, sql_query)
+    max_age = float(os.getenv("FORECAST_CACHE_MAX_AGE_HOURS", "24")) * 3600
+    mode = "full"
+    if state is not None and max_age and time.time() - state.get("built_at", 0) > max_age:
+        print("⌛ Dự báo: mô hình đã lưu quá hạn, đọc lại toàn bộ lịch sử.")
+        state = None
+    if state is not None and state["dimensions"] == dimensions and fact_max >= state["watermark"]:
+        changed = _old_rows_changed(engine, plan, state, timeout, cancel_event)
+        if isinstance(changed, str):
+            return changed
+        if changed:
+            print("⚠️ Dự báo: dữ liệu cũ đã bị sửa, đọc lại toàn bộ lịch sử.")
+        else:
+            mode = "delta" if fact_max > state["watermark"] else "hit"
+
+    # Watermark updated_at lấy trước khi đọc dữ liệu: dòng sửa trong lúc đọc vẫn bị phát hiện ở lần sau
+    updated_max = None
+    if mode != "hit" and plan.updated_column is not None:
+        res = _probe(plan.max_updated_sql(), engine, timeout, cancel_event)
+        if isinstance(res, str):
+            return res
+        updated_max = _scalar_text(res.iloc[0, 0])
+
+    if mode == "delta":
+        res = execute_sql(plan.bounded_sql(state["watermark"], fact_max), engine, use_cache=False,
+                          timeout=timeout, cancel_event=cancel_event)
+        if isinstance(res, str) and res != EMPTY_RESULT_MESSAGE:
+            return res
+        changed = fold_in(state, res) if isinstance(res, pd.DataFrame) else 0
+        print(f"➕ Dự báo: cộng các dòng id {state['watermark'] + 1:,}..{fact_max:,} vào mô hình đã lưu "
+              f"({changed} điểm thay đổi).")
+    elif mode == "full":
+        res = execute_sql(plan.bounded_sql(None, fact_max), engine, use_cache=False,
+                          timeout=timeout, cancel_event=cancel_event)
+        if not isinstance(res, pd.DataFrame):
+            return res
+        if res.attrs.get('truncated'):
+            return res  # Kết quả bị cắt -> không lưu trạng thái thiếu
+        state = build_state(res, plan)
+    else:
+        print("♻️ Dự báo: không có dữ liệu mới, dùng lại mô hình đã lưu.")
+
+    if mode != "hit":
+        state.update(watermark=fact_max, dimensions=dimensions, updated_max=updated_max)
+        cache.put(db, snapshot.schema_hash, sql_query, state)
+
+    df = history_frame(state)
+    if df.empty:
+        return EMPTY_RESULT_MESSAGE
+    df.attrs['forecast_cache'] = mode
+    if state.get("roles") is not None:
+        df.attrs['forecast_sums'] = {"roles": state["roles"], "sums": state["sums"]}
+    return df
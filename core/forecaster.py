@@ -1,47 +1,182 @@
 import pandas as pd
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from datetime import timedelta
+from core.tracing import traced
 
-def forecast_data(df: pd.DataFrame, time_col: str, value_col: str, months=3):
+# --- DỰ BÁO (LINEAR REGRESSION) ---
+# Fit đường thẳng y = a + b * ngày cho từng chuỗi bằng NumPy (công thức đóng của bình phương tối thiểu,
+# tính cho mọi chuỗi cùng lúc bằng np.bincount) thay vì mỗi chuỗi 1 model sklearn.
+# Mốc tương lai theo tháng dương lịch (31/01 -> 28/02 -> 31/03), không cộng i * 30 ngày.
+_SINGLE_GROUP = "__series__"
+DATE_LIKE_PATTERN = r"^\s*\d{1,4}[-/.]\d{1,2}"
+
+
+def _to_datetime(values):
+    times = pd.to_datetime(values, format='mixed')
+    if getattr(times.dt, "tz", None) is not None:
+        times = times.dt.tz_localize(None)
+    return times
+
+
+def find_date_columns(df):
+    """
+    Cột ngày tháng của kết quả. SQLite trả ngày dạng chuỗi ('2025-01' / '2025-01-31')
+    nên thử chuyển các cột chuỗi mà mọi giá trị đều parse được thành ngày.
+    """
+    date_cols = df.select_dtypes(include=['datetime']).columns
+    if len(date_cols) > 0:
+        return date_cols
+    for col in df.select_dtypes(include=['object', 'string']).columns:
+        # Chỉ thử cột có dạng ngày (2025-01, 31/01/2025...): dateutil parse được cả tên như "M0"
+        if not df[col].astype(str).str.match(DATE_LIKE_PATTERN).all():
+            continue
+        parsed = pd.to_datetime(df[col], errors='coerce', format='mixed')
+        if parsed.notna().all():
+            df[col] = parsed
+    return df.select_dtypes(include=['datetime']).columns
+
+
+def find_forecast_columns(df, date_cols):
+    """
+    (cột nhóm, cột giá trị) cho dự báo. Cột chữ (tên máy, khu vực...) là nhóm; cột số dạng id / *_id
+    cũng là nhóm nếu không có cột chữ; các cột số còn lại là giá trị.
+    """
+    num_cols = [c for c in df.select_dtypes(include=['number']).columns if c not in date_cols]
+    id_cols = [c for c in num_cols if str(c).lower() == 'id' or str(c).lower().endswith('_id')]
+    value_cols = [c for c in num_cols if c not in id_cols]
+    cat_cols = [c for c in df.select_dtypes(include=['object', 'string', 'category']).columns if c not in date_cols]
+    return cat_cols or id_cols, value_cols
+
+
+def fit_linear_trends(codes, x, y, n_groups):
+    """
+    Bình phương tối thiểu cho nhiều chuỗi cùng lúc: y = intercept + slope * x, tách theo codes (0..n_groups-1).
+    Chuỗi chỉ có 1 mốc thời gian -> slope = 0, intercept = trung bình (giống sklearn).
+    Trả về (intercept, slope), mỗi mảng dài n_groups.
+    """
+    n = np.bincount(codes, minlength=n_groups).astype(float)
+    mean_x = np.bincount(codes, x, n_groups) / n
+    mean_y = np.bincount(codes, y, n_groups) / n
+    # Trừ trung bình từng chuỗi trước khi nhân để không mất chính xác (x là số ngày, cỡ 20.000)
+    dx = x - mean_x[codes]
+    sxx = np.bincount(codes, dx * dx, n_groups)
+    sxy = np.bincount(codes, dx * (y - mean_y[codes]), n_groups)
+    slope = np.divide(sxy, sxx, out=np.zeros(n_groups), where=sxx > 0)
+    return mean_y - slope * mean_x, slope
+
+
+def to_days(times):
+    """
+    Ngày -> số ngày kể từ 1970-01-01 (float), trục x của mọi phép fit.
+    """
+    return np.asarray(times).astype("datetime64[D]").astype(np.int64).astype(float)
+
+
+def series_key(values):
+    """
+    Khóa của 1 chuỗi (tuple giá trị các cột nhóm, kiểu Python thuần để dùng làm khóa dict / pickle).
+    """
+    return tuple(v.item() if isinstance(v, np.generic) else v for v in values)
+
+
+def series_sums(codes, x, y, n_groups):
+    """
+    Thống kê đủ (sufficient statistics) của từng chuỗi: mảng (n_groups, 5) gồm n, Σx, Σy, Σxy, Σx².
+    Có thêm điểm mới thì chỉ cần cộng dồn, không phải fit lại từ đầu.
+    """
+    return np.stack([
+        np.bincount(codes, minlength=n_groups).astype(float),
+        np.bincount(codes, x, n_groups),
+        np.bincount(codes, y, n_groups),
+        np.bincount(codes, x * y, n_groups),
+        np.bincount(codes, x * x, n_groups),
+    ], axis=1)
+
+
+def fit_from_sums(sums):
+    """
+    (intercept, slope) từ thống kê đủ (mảng k x 5: n, Σx, Σy, Σxy, Σx²).
+    Chuỗi chỉ có 1 mốc thời gian -> slope = 0.
+    """
+    n, sx, sy, sxy, sxx = np.asarray(sums, dtype=float).reshape(-1, 5).T
+    denom = n * sxx - sx * sx
+    slope = np.divide(n * sxy - sx * sy, denom, out=np.zeros(len(n)), where=denom > 1e-12 * n * sxx)
+    return (sy - slope * sx) / n, slope
+
+
+def future_dates(last_dates, months=3):
+    """
+    Mốc tương lai cho từng chuỗi: tháng thứ 1..months sau ngày cuối.
+    Chuỗi theo cuối tháng (mọi ngày đều là ngày cuối tháng) giữ cuối tháng (28/02 -> 31/03).
+    Trả về ma trận datetime64 (số chuỗi x months).
+    """
+    last_dates = pd.DatetimeIndex(last_dates)
+    month_end = len(last_dates) > 0 and bool(last_dates.is_month_end.all())
+    columns = [
+        (last_dates + (pd.offsets.MonthEnd(i) if month_end else pd.DateOffset(months=i))).values
+        for i in range(1, months + 1)
+    ]
+    return np.stack(columns, axis=1) if columns else np.empty((len(last_dates), 0), dtype="datetime64[ns]")
+
+
+@traced("forecast_grouped")
+def forecast_grouped(df: pd.DataFrame, group_cols, time_col: str, value_col: str, months=3, sums=None):
+    """
+    Dự báo nhiều chuỗi cùng lúc (VD: chi phí theo tháng của từng máy / từng khu vực).
+    Input: DataFrame dạng dài (cột nhóm, thời gian, giá trị); group_cols: 1 tên cột hoặc list.
+    Output: 1 DataFrame gồm cột nhóm, time_col, value_col, 'Type' ('History' / 'Forecast'),
+            sắp theo nhóm rồi thời gian (lịch sử trước, months tháng dự báo sau).
+    Dòng thiếu thời gian / giá trị bị bỏ qua.
+    sums: {series_key: [n, Σx, Σy, Σxy, Σx²]} đã tính sẵn (core/forecast_cache.py) -> không fit lại.
+    """
+    group_cols = [group_cols] if isinstance(group_cols, str) else list(group_cols)
+
+    data = df[group_cols + [time_col, value_col]].copy()
+    data[time_col] = _to_datetime(data[time_col])
+    data[value_col] = pd.to_numeric(data[value_col], errors='coerce')
+    data = data.dropna(subset=[time_col, value_col])
+    if data.empty:
+        return pd.DataFrame(columns=group_cols + [time_col, value_col, 'Type'])
+
+    # Mã số nhóm (0..n-1) theo thứ tự nhóm, rồi sắp theo (nhóm, thời gian)
+    codes = data.groupby(group_cols, sort=True, dropna=False, observed=True).ngroup().to_numpy()
+    days = to_days(data[time_col].to_numpy())
+    order = np.lexsort((days, codes))
+    data = data.iloc[order].reset_index(drop=True)
+    codes, days = codes[order], days[order]
+    n_groups = int(codes[-1]) + 1
+
+    # Dòng cuối của mỗi nhóm (đã sắp theo thời gian) -> khóa nhóm + ngày cuối
+    last_rows = np.flatnonzero(np.r_[codes[1:] != codes[:-1], True])
+    keys = [series_key(row) for row in data[group_cols].iloc[last_rows].itertuples(index=False)]
+    if sums is not None and all(key in sums for key in keys):
+        intercept, slope = fit_from_sums([sums[key] for key in keys])
+    else:
+        intercept, slope = fit_linear_trends(codes, days, data[value_col].to_numpy(dtype=float), n_groups)
+
+    dates = future_dates(data[time_col].to_numpy()[last_rows], months)
+    future_days = to_days(dates)
+
+    history = data.assign(Type='History')
+    future = data[group_cols].iloc[np.repeat(last_rows, months)].reset_index(drop=True)
+    future[time_col] = dates.ravel()
+    future[value_col] = (intercept[:, None] + slope[:, None] * future_days).ravel()
+    future['Type'] = 'Forecast'
+
+    # Xếp xen kẽ: lịch sử rồi dự báo của từng nhóm
+    result = pd.concat([history, future], ignore_index=True)
+    group_order = np.concatenate([codes, np.repeat(np.arange(n_groups), months)])
+    result = result.iloc[np.argsort(group_order, kind='stable')].reset_index(drop=True)
+    return result[group_cols + [time_col, value_col, 'Type']]
+
+
+@traced("forecast_data")
+def forecast_data(df: pd.DataFrame, time_col: str, value_col: str, months=3, sums=None):
     """
-    Hàm dự báo đơn giản sử dụng Linear Regression.
+    Hàm dự báo đơn giản sử dụng Linear Regression (1 chuỗi).
     Input: DataFrame lịch sử (Ngày, Giá trị)
     Output: DataFrame chứa cả lịch sử + 3 tháng tương lai
+    sums: [n, Σx, Σy, Σxy, Σx²] đã tính sẵn của chuỗi (tùy chọn).
     """
-    # 1. Chuẩn bị dữ liệu
-    df = df.sort_values(by=time_col)
-    df[time_col] = pd.to_datetime(df[time_col])
-    
-    # Chuyển đổi ngày tháng sang dạng số (Ordinal) để máy tính hiểu
-    df['date_ordinal'] = df[time_col].apply(lambda x: x.toordinal())
-    
-    X = df[['date_ordinal']]
-    y = df[value_col]
-    
-    # 2. Train model (Học từ quá khứ)
-    model = LinearRegression()
-    model.fit(X, y)
-    
-    # 3. Tạo dữ liệu tương lai
-    last_date = df[time_col].max()
-    future_dates = []
-    for i in range(1, months + 1):
-        # Cộng thêm i * 30 ngày
-        future_dates.append(last_date + timedelta(days=i*30))
-        
-    future_df = pd.DataFrame({time_col: future_dates})
-    future_df['date_ordinal'] = future_df[time_col].apply(lambda x: x.toordinal())
-    
-    # 4. Dự báo
-    future_pred = model.predict(future_df[['date_ordinal']])
-    future_df[value_col] = future_pred
-    future_df['Type'] = 'Forecast' # Đánh dấu là dự báo
-    
-    # 5. Gộp kết quả
-    df['Type'] = 'History' # Đánh dấu là lịch sử
-    
-    # Chỉ lấy các cột cần thiết
-    final_df = pd.concat([df[[time_col, value_col, 'Type']], future_df[[time_col, value_col, 'Type']]])
-    
-    return final_df
\ No newline at end of file
+    single = df[[time_col, value_col]].assign(**{_SINGLE_GROUP: 0})
+    single_sums = {(0,): sums} if sums is not None else None
+    return forecast_grouped(single, _SINGLE_GROUP, time_col, value_col, months, single_sums).drop(columns=_SINGLE_GROUP)
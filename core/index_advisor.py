@@ -0,0 +1,577 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import statistics
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.optimizer.scope import traverse_scope
+from sqlalchemy import text
+from core.query_cache import BASE_DIR
+from core.result_cache import canonicalize_sql
+from core.schema_cache import get_schema_snapshot, engine_cache_key, invalidate_schema_cache
+from core.sql_validator import parse_sql
+from core.dialect import get_sqlglot_dialect
+
+# --- INDEX ADVISOR ---
+# 1. execute_sql ghi lại mọi câu SQL đã chạy (số lần, tổng thời gian) vào workload log trên đĩa.
+# 2. advise(): đọc EXPLAIN QUERY PLAN (SQLite) / SHOWPLAN_XML (SQL Server) của các câu tốn thời gian nhất,
+#    tìm bảng bị quét toàn bộ trên các cột lọc / JOIN / GROUP BY, đề xuất index (kèm cột "covering").
+# 3. apply=True: tạo index, chạy lại các câu liên quan để so sánh tốc độ ước lượng và thực tế.
+DEFAULT_WORKLOAD_PATH = os.path.join(BASE_DIR, ".cache", "query_workload.db")
+MAX_KEY_COLUMNS = 3
+MAX_INDEX_COLUMNS = 6
+SHOWPLAN_NS = {"sp": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+
+_SQLITE_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?(.*)$")
+
+
+def _env_flag(name, default=True):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def database_key(engine):
+    """
+    Định danh DB trong workload log (hash, không lưu connection string có mật khẩu xuống đĩa).
+    """
+    return hashlib.sha256(engine_cache_key(engine).encode("utf-8")).hexdigest()[:16]
+
+
+class WorkloadLog:
+    """
+    Thống kê các câu SQL đã chạy theo (DB, SQL chuẩn hóa): số lần, tổng/max thời gian, số dòng lần cuối.
+    """
+    def __init__(self, path=DEFAULT_WORKLOAD_PATH, max_queries=1000):
+        self.path = path
+        self.max_queries = max_queries
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS workload ("
+                " key TEXT PRIMARY KEY, db TEXT, sql TEXT NOT NULL, calls INTEGER DEFAULT 0,"
+                " total_seconds REAL DEFAULT 0, max_seconds REAL DEFAULT 0, last_rows INTEGER, last_seen REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_workload_db ON workload(db, total_seconds)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:  # tự commit/rollback
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, db, sql_query, seconds, rows=None):
+        sql_query = canonicalize_sql(sql_query)
+        key = hashlib.sha256(f"{db}|{sql_query}".encode("utf-8")).hexdigest()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO workload (key, db, sql, calls, total_seconds, max_seconds, last_rows, last_seen)"
+                " VALUES (?, ?, ?, 1, ?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET calls = calls + 1, total_seconds = total_seconds + excluded.total_seconds,"
+                " max_seconds = MAX(max_seconds, excluded.max_seconds), last_rows = excluded.last_rows,"
+                " last_seen = excluded.last_seen",
+                (key, db, sql_query, seconds, seconds, rows, time.time()),
+            )
+            # Giữ lại các câu tốn thời gian nhất
+            count = conn.execute("SELECT COUNT(*) FROM workload").fetchone()[0]
+            if count > self.max_queries:
+                conn.execute(
+                    "DELETE FROM workload WHERE key IN ("
+                    " SELECT key FROM workload ORDER BY total_seconds ASC LIMIT ?)",
+                    (count - self.max_queries,),
+                )
+
+    def top(self, db, limit=50):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT sql, calls, total_seconds, max_seconds, last_rows FROM workload"
+                " WHERE db = ? ORDER BY total_seconds DESC LIMIT ?",
+                (db, limit),
+            ).fetchall()
+        return [
+            {"sql": r[0], "calls": r[1], "total_seconds": r[2], "max_seconds": r[3], "last_rows": r[4]}
+            for r in rows
+        ]
+
+    def clear(self, db=None):
+        with self._lock, self._connect() as conn:
+            if db is None:
+                conn.execute("DELETE FROM workload")
+            else:
+                conn.execute("DELETE FROM workload WHERE db = ?", (db,))
+
+
+_workload = None
+_workload_lock = threading.Lock()
+
+
+def get_workload_log():
+    """
+    Workload log dùng chung. Trả về None nếu INDEX_ADVISOR_ENABLED=0.
+    Cấu hình: INDEX_ADVISOR_LOG_PATH, INDEX_ADVISOR_MAX_QUERIES.
+    """
+    global _workload
+    if not _env_flag("INDEX_ADVISOR_ENABLED"):
+        return None
+    with _workload_lock:
+        if _workload is None:
+            _workload = WorkloadLog(
+                path=os.getenv("INDEX_ADVISOR_LOG_PATH") or DEFAULT_WORKLOAD_PATH,
+                max_queries=int(os.getenv("INDEX_ADVISOR_MAX_QUERIES", "1000")),
+            )
+    return _workload
+
+
+def record_query(engine, sql_query, seconds, rows=None):
+    """
+    Gọi từ execute_sql sau mỗi lần chạy thật xuống DB. Lỗi ghi log không được làm hỏng truy vấn.
+    """
+    workload = get_workload_log()
+    if workload is None:
+        return
+    try:
+        workload.record(database_key(engine), sql_query, seconds, rows)
+    except Exception as e:
+        print(f"⚠️ Không ghi được workload: {e}")
+
+
+# --- PHÂN TÍCH CÂU SQL ---
+
+def _resolve_table(column, sources, snapshot_columns):
+    """
+    Bảng thật của 1 cột trong scope (theo alias, hoặc theo schema nếu cột không ghi rõ bảng).
+    """
+    if column.table:
+        source = sources.get(column.table)
+        return source.name if isinstance(source, exp.Table) else None
+    owners = [
+        src.name for src in sources.values()
+        if isinstance(src, exp.Table) and column.name.lower() in snapshot_columns.get(src.name.lower(), set())
+    ]
+    return owners[0] if len(owners) == 1 else None
+
+
+def _predicate_kind(node):
+    if isinstance(node, (exp.EQ, exp.In, exp.Is)):
+        return "eq"
+    if isinstance(node, (exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between, exp.Like)):
+        return "range"
+    return None
+
+
+def column_usage(sql_query, snapshot, dialect=None):
+    """
+    Cột được dùng theo từng bảng: {table: {"eq", "range", "join", "group", "order", "all"}} (tên bảng viết thường).
+    """
+    statements = parse_sql(sql_query, dialect)
+    if not statements:
+        return {}
+    snapshot_columns = {
+        name.lower(): {col.lower() for col in snapshot.column_names(name)} for name in snapshot.table_names()
+    }
+    usage = {}
+
+    def add(kind, column, sources):
+        table = _resolve_table(column, sources, snapshot_columns)
+        if table is None or table.lower() not in snapshot_columns:
+            return
+        slots = usage.setdefault(table.lower(), {k: [] for k in ("eq", "range", "join", "group", "order", "all")})
+        name = column.name.lower()
+        if name in snapshot_columns[table.lower()] and name not in slots[kind]:
+            slots[kind].append(name)
+
+    try:
+        scopes = traverse_scope(statements[0])
+    except SqlglotError:
+        return {}
+
+    for scope in scopes:
+        select = scope.expression
+        if not isinstance(select, exp.Select):
+            continue
+        sources = scope.sources
+
+        for column in scope.columns:
+            add("all", column, sources)
+
+        where = select.args.get("where")
+        if where is not None:
+            for predicate in where.find_all(exp.Predicate):
+                kind = _predicate_kind(predicate)
+                columns = [c for c in predicate.find_all(exp.Column)]
+                if kind == "eq" and len(columns) == 2 and isinstance(predicate, exp.EQ):
+                    kind = "join"  # JOIN kiểu cũ: WHERE a.id = b.a_id
+                if kind:
+                    for column in columns:
+                        add(kind, column, sources)
+
+        for join in select.args.get("joins") or []:
+            on = join.args.get("on")
+            if on is not None:
+                for column in on.find_all(exp.Column):
+                    add("join", column, sources)
+
+        group = select.args.get("group")
+        if group is not None:
+            for column in group.find_all(exp.Column):
+                add("group", column, sources)
+
+        order = select.args.get("order")
+        if order is not None:
+            for column in order.find_all(exp.Column):
+                add("order", column, sources)
+    return usage
+
+
+def _alias_map(sql_query, dialect=None):
+    statements = parse_sql(sql_query, dialect) or []
+    aliases = {}
+    for statement in statements:
+        for table in statement.find_all(exp.Table):
+            aliases[(table.alias or table.name).lower()] = table.name.lower()
+            aliases[table.name.lower()] = table.name.lower()
+    return aliases
+
+
+# --- QUERY PLAN ---
+
+def explain_sqlite(connection, sql_query):
+    """
+    Bảng bị quét toàn bộ theo EXPLAIN QUERY PLAN: {table: chi tiết plan}.
+    """
+    aliases = _alias_map(sql_query, "sqlite")
+    scans = {}
+    for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql_query}").fetchall():
+        detail = str(row[-1])
+        match = _SQLITE_SCAN_RE.match(detail)
+        if not match or "INDEX" in match.group(3).upper():
+            continue
+        name = (match.group(2) or match.group(1)).lower()
+        table = aliases.get(name, name)
+        scans[table] = detail
+    return scans, []
+
+
+def explain_mssql(connection, sql_query):
+    """
+    SHOWPLAN_XML của SQL Server: bảng bị quét (Table/Clustered Index Scan) + gợi ý Missing Index có sẵn.
+    """
+    connection.exec_driver_sql("SET SHOWPLAN_XML ON")
+    try:
+        plan_xml = connection.exec_driver_sql(sql_query).scalar()
+    finally:
+        connection.exec_driver_sql("SET SHOWPLAN_XML OFF")
+
+    root = ET.fromstring(plan_xml)
+    scans = {}
+    for relop in root.iter(f"{{{SHOWPLAN_NS['sp']}}}RelOp"):
+        op = relop.get("PhysicalOp", "")
+        if op not in ("Table Scan", "Clustered Index Scan", "Index Scan"):
+            continue
+        obj = relop.find(".//sp:Object", SHOWPLAN_NS)
+        if obj is not None and obj.get("Table"):
+            scans[obj.get("Table").strip("[]").lower()] = f"{op} (EstimateRows={relop.get('EstimateRows')})"
+
+    missing = []
+    for group in root.iter(f"{{{SHOWPLAN_NS['sp']}}}MissingIndexGroup"):
+        impact = float(group.get("Impact", 0))
+        for index in group.findall("sp:MissingIndex", SHOWPLAN_NS):
+            cols = {"EQUALITY": [], "INEQUALITY": [], "INCLUDE": []}
+            for col_group in index.findall("sp:ColumnGroup", SHOWPLAN_NS):
+                cols[col_group.get("Usage")] = [
+                    c.get("Name").strip("[]").lower() for c in col_group.findall("sp:Column", SHOWPLAN_NS)
+                ]
+            missing.append({
+                "table": index.get("Table").strip("[]").lower(),
+                "columns": cols["EQUALITY"] + cols["INEQUALITY"],
+                "include": cols["INCLUDE"],
+                "impact": impact,
+            })
+    return scans, missing
+
+
+def explain(engine, sql_query):
+    with engine.connect() as connection:
+        if engine.dialect.name == "mssql":
+            return explain_mssql(connection, sql_query)
+        if engine.dialect.name == "sqlite":
+            return explain_sqlite(connection, sql_query)
+    return {}, []
+
+
+# --- ĐỀ XUẤT INDEX ---
+
+def _existing_prefixes(snapshot, table_name):
+    """
+    Cột đầu tiên của các index / khóa chính đã có (index mới trùng cột đầu thì bỏ qua).
+    """
+    table = snapshot.tables[table_name]
+    prefixes = {tuple(c.lower() for c in idx["columns"] if c) for idx in table.get("indexes", [])}
+    if table.get("primary_key"):
+        prefixes.add(tuple(c.lower() for c in table["primary_key"]))
+    return prefixes
+
+
+def _candidate_for(table_name, slots, snapshot):
+    """
+    Index cho 1 bảng của 1 câu: cột lọc "=" trước, rồi JOIN, khoảng (<, >, BETWEEN), GROUP BY;
+    thêm các cột còn lại câu SQL cần (covering) nếu không quá MAX_INDEX_COLUMNS.
+    """
+    # Bảng nhỏ quét toàn bộ vẫn nhanh, index chỉ tốn chỗ và làm chậm ghi
+    row_estimate = snapshot.tables[table_name].get("row_estimate")
+    if row_estimate is not None and row_estimate < int(os.getenv("INDEX_ADVISOR_MIN_ROWS", "10000")):
+        return None
+
+    keys = []
+    for kind in ("eq", "join", "range", "group", "order"):
+        for col in slots[kind]:
+            if col not in keys:
+                keys.append(col)
+    pk = [c.lower() for c in snapshot.tables[table_name].get("primary_key") or []]
+    keys = [c for c in keys if c not in pk][:MAX_KEY_COLUMNS]
+    if not keys:
+        return None
+    if any(prefix[:len(keys)] == tuple(keys) for prefix in _existing_prefixes(snapshot, table_name)):
+        return None
+
+    include = [c for c in slots["all"] if c not in keys and c not in pk]
+    if len(keys) + len(include) > MAX_INDEX_COLUMNS:
+        include = []
+    return {"table": table_name, "columns": keys, "include": include, "kind": slots}
+
+
+def _distinct_ratio(connection, table_name, column, sample=100_000):
+    """
+    Tỉ lệ chọn lọc của điều kiện "=" trên cột: 1 / số giá trị khác nhau (ước lượng trên mẫu).
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    limit_sql = f"SELECT TOP {sample} {quote(column)} AS c FROM {quote(table_name)}" \
+        if connection.dialect.name == "mssql" else f"SELECT {quote(column)} AS c FROM {quote(table_name)} LIMIT {sample}"
+    distinct = connection.execute(text(f"SELECT COUNT(DISTINCT c) FROM ({limit_sql}) s")).scalar() or 1
+    return 1.0 / distinct
+
+
+def estimate_speedup(engine, snapshot, candidate):
+    """
+    Ước lượng tốc độ (lần) khi có index, theo mô hình chi phí đơn giản:
+    - Có điều kiện lọc: chỉ đọc phần dữ liệu thỏa mãn (= : 1/số giá trị khác nhau, khoảng: 1/3).
+    - Chỉ JOIN/GROUP BY: index covering đọc ít cột hơn cả bảng, tránh sắp xếp tạm.
+    """
+    table = snapshot.tables[candidate["table"]]
+    rows = table.get("row_estimate") or 1
+    slots = candidate["kind"]
+
+    selectivity = 1.0
+    with engine.connect() as connection:
+        for col in slots["eq"]:
+            if col in candidate["columns"]:
+                selectivity *= _distinct_ratio(connection, candidate["table"], col)
+    for col in slots["range"]:
+        if col in candidate["columns"]:
+            selectivity /= 3
+
+    if selectivity < 1.0:
+        return round(min(1.0 / max(selectivity, 1.0 / rows), 1000.0), 2)
+
+    width = len(table["columns"]) / max(1, len(candidate["columns"]) + len(candidate["include"]))
+    sort_bonus = 1.5 if slots["group"] and slots["group"][0] == candidate["columns"][0] else 1.0
+    covering = bool(candidate["include"]) or set(slots["all"]) <= set(candidate["columns"])
+    return round(max(1.0, (width if covering else 1.0) * sort_bonus), 2)
+
+
+def index_name(table_name, columns):
+    return f"ix_advisor_{table_name}_{'_'.join(columns)}"[:120]
+
+
+def index_ddl(engine, candidate):
+    quote = engine.dialect.identifier_preparer.quote
+    name = index_name(candidate["table"], candidate["columns"])
+    keys = ", ".join(quote(c) for c in candidate["columns"])
+    if engine.dialect.name == "mssql":
+        ddl = f"CREATE INDEX {quote(name)} ON {quote(candidate['table'])} ({keys})"
+        if candidate["include"]:
+            ddl += f" INCLUDE ({', '.join(quote(c) for c in candidate['include'])})"
+        return ddl
+    # SQLite không có INCLUDE -> thêm cột vào cuối khóa để index vẫn "covering"
+    all_cols = ", ".join(quote(c) for c in candidate["columns"] + candidate["include"])
+    return f"CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(candidate['table'])} ({all_cols})"
+
+
+def _time_query(engine, sql_query, repeats=3, max_rows=100_000):
+    """
+    Thời gian chạy (giây, trung vị của repeats lần), đọc tối đa max_rows dòng.
+    """
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        with engine.connect() as connection:
+            result = connection.exec_driver_sql(sql_query)
+            fetched = 0
+            while fetched < max_rows:
+                batch = result.fetchmany(10_000)
+                if not batch:
+                    break
+                fetched += len(batch)
+            result.close()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def _merge_prefixes(entries):
+    """
+    Gộp đề xuất có cột là tiền tố của đề xuất khác cùng bảng (index dài hơn dùng được cho cả 2).
+    """
+    entries.sort(key=lambda e: len(e["columns"]) + len(e["include"]), reverse=True)
+    merged = []
+    for entry in entries:
+        target = None
+        for other in merged:
+            other_cols = other["columns"] + other["include"]
+            if (other["table"] == entry["table"]
+                    and other_cols[:len(entry["columns"])] == entry["columns"]
+                    and set(entry["include"]) <= set(other_cols)):
+                target = other
+                break
+        if target is None:
+            merged.append(entry)
+            continue
+        for field in ("calls", "total_seconds"):
+            target[field] += entry[field]
+        for field in ("queries", "plans", "estimates"):
+            target[field].extend(entry[field])
+    return merged
+
+
+def advise(engine=None, top=5, workload_limit=50, apply=False, repeats=3):
+    """
+    Đề xuất index từ workload đã ghi của DB.
+    apply=True: tạo index và đo tốc độ thực tế (trước/sau) trên các câu SQL liên quan.
+    Output: list đề xuất {table, columns, include, ddl, calls, total_seconds, queries, plans,
+            estimated_speedup, observed_speedup, applied}, sắp xếp theo thời gian có thể tiết kiệm.
+    """
+    if engine is None:
+        from core.database import init_db
+        engine = init_db()
+
+    workload = get_workload_log()
+    if workload is None:
+        print("⚠️ INDEX_ADVISOR_ENABLED=0, không có workload để phân tích.")
+        return []
+
+    snapshot = get_schema_snapshot(engine)
+    tables = {name.lower(): name for name in snapshot.table_names()}
+    dialect = get_sqlglot_dialect(engine)
+    candidates = {}
+
+    for query in workload.top(database_key(engine), workload_limit):
+        try:
+            scans, missing = explain(engine, query["sql"])
+        except Exception as e:
+            print(f"⚠️ Không lấy được query plan: {e}")
+            continue
+
+        found = []
+        # SQL Server tự gợi ý index còn thiếu -> dùng trực tiếp
+        for item in missing:
+            if item["table"] in tables and item["columns"]:
+                found.append(({
+                    "table": tables[item["table"]], "columns": item["columns"][:MAX_KEY_COLUMNS],
+                    "include": item["include"], "kind": None,
+                }, round(100 / max(1.0, 100 - item["impact"]), 2)))
+
+        usage = column_usage(query["sql"], snapshot, dialect)
+        for table_lower, detail in scans.items():
+            if table_lower not in tables or table_lower not in usage:
+                continue
+            candidate = _candidate_for(tables[table_lower], usage[table_lower], snapshot)
+            if candidate is not None:
+                found.append((candidate, None))
+
+        for candidate, estimated in found:
+            key = (candidate["table"], tuple(candidate["columns"]), tuple(candidate["include"]))
+            if estimated is None:
+                estimated = estimate_speedup(engine, snapshot, candidate)
+            entry = candidates.setdefault(key, {
+                "table": candidate["table"],
+                "columns": candidate["columns"],
+                "include": candidate["include"],
+                "ddl": index_ddl(engine, candidate),
+                "calls": 0,
+                "total_seconds": 0.0,
+                "queries": [],
+                "plans": [],
+                "estimates": [],
+            })
+            entry["calls"] += query["calls"]
+            entry["total_seconds"] += query["total_seconds"]
+            entry["queries"].append(query["sql"])
+            entry["plans"].append(scans.get(candidate["table"].lower(), "missing index"))
+            entry["estimates"].append(estimated)
+
+    recommendations = []
+    for entry in _merge_prefixes(list(candidates.values())):
+        estimates = entry.pop("estimates")
+        entry["estimated_speedup"] = round(statistics.median(estimates), 2)
+        entry["estimated_saving_seconds"] = round(entry["total_seconds"] * (1 - 1 / entry["estimated_speedup"]), 4)
+        entry["observed_speedup"] = None
+        entry["applied"] = False
+        recommendations.append(entry)
+    recommendations.sort(key=lambda r: r["estimated_saving_seconds"], reverse=True)
+    recommendations = recommendations[:top]
+
+    if apply:
+        for rec in recommendations:
+            apply_recommendation(engine, rec, repeats)
+    return recommendations
+
+
+def apply_recommendation(engine, recommendation, repeats=3, sample_queries=3):
+    """
+    Tạo index của 1 đề xuất và đo tốc độ thực tế trên tối đa sample_queries câu SQL liên quan.
+    """
+    queries = recommendation["queries"][:sample_queries]
+    before = sum(_time_query(engine, q, repeats) for q in queries)
+
+    print(f"🛠️ Tạo index: {recommendation['ddl']}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(recommendation["ddl"])
+        if engine.dialect.name == "sqlite":
+            connection.exec_driver_sql(f"ANALYZE {engine.dialect.identifier_preparer.quote(recommendation['table'])}")
+    invalidate_schema_cache(engine)
+
+    after = sum(_time_query(engine, q, repeats) for q in queries)
+    recommendation["applied"] = True
+    recommendation["before_seconds"] = round(before, 5)
+    recommendation["after_seconds"] = round(after, 5)
+    recommendation["observed_speedup"] = round(before / after, 2) if after else None
+    return recommendation
+
+
+def format_report(recommendations):
+    """
+    Báo cáo dạng text để duyệt đề xuất.
+    """
+    if not recommendations:
+        return "✅ Không có đề xuất index nào (workload chưa có bảng bị quét toàn bộ trên cột lọc/JOIN)."
+    lines = []
+    for i, rec in enumerate(recommendations, 1):
+        observed = f"{rec['observed_speedup']}x" if rec["observed_speedup"] is not None else "chưa đo"
+        lines.append(f"{i}. {rec['ddl']}")
+        lines.append(
+            f"   {rec['calls']} lần chạy, tổng {rec['total_seconds']:.3f}s | "
+            f"ước lượng {rec['estimated_speedup']}x (tiết kiệm ~{rec['estimated_saving_seconds']:.3f}s) | "
+            f"thực tế: {observed}"
+        )
+        lines.append(f"   Plan: {rec['plans'][0]}")
+    return "\n".join(lines)
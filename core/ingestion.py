@@ -0,0 +1,524 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import shutil
+import unicodedata
+from contextlib import closing
+import pandas as pd
+from sqlalchemy import text
+from core.query_cache import BASE_DIR
+from core.database import get_engine, release_engines
+from core.forecaster import DATE_LIKE_PATTERN
+from core.duckdb_backend import duckdb, use_duckdb, get_duckdb_engine, file_view_sql
+
+# --- NẠP FILE CSV UPLOAD ---
+# Streamlit chạy lại cả app.py sau mỗi thao tác: trước đây mỗi câu hỏi lại đọc toàn bộ CSV bằng pd.read_csv
+# và to_sql vào 1 SQLite :memory: mới. Ở đây:
+# 1. Băm nội dung file (sha256) -> file đã nạp rồi thì chỉ mở lại DB trên đĩa (.cache/uploads), không đọc CSV.
+# 2. Lần đầu: đoán kiểu cột từ mẫu đầu file, đọc theo từng khúc (chunksize) -> không giữ cả file trong RAM.
+# 3. Tạo index cho các cột hay dùng để lọc (ngày, *_id, mã, trạng thái, cột chữ ít giá trị), ANALYZE.
+# Nhiều file cùng lúc -> nhiều bảng trong cùng 1 DB (JOIN được). File đã có trong DB khác thì chép bảng
+# bằng ATTACH (nhanh hơn đọc lại CSV).
+# DB_BACKEND=duckdb: chỉ lưu file gốc (.cache/uploads/files/<hash>.csv|.parquet) và tạo VIEW đọc thẳng file
+# trong 1 DB DuckDB, không nạp dữ liệu (xem core/duckdb_backend.py).
+DEFAULT_UPLOAD_DIR = os.path.join(BASE_DIR, ".cache", "uploads")
+CATALOG_TABLE = "_agent_uploads"
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Kiểu cột: kiểu SQLite khai báo + kiểu rộng hơn khi gặp giá trị không khớp ở khúc sau
+SQL_TYPES = {"boolean": "BOOLEAN", "integer": "INTEGER", "float": "REAL", "date": "DATE",
+             "datetime": "DATETIME", "text": "TEXT"}
+WIDER_TYPE = {"boolean": "text", "integer": "float", "float": "text", "date": "datetime", "datetime": "text"}
+
+_INT_RE = r"^[+-]?\d{1,18}$"
+_LEADING_ZERO_RE = r"^[+-]?0\d"  # "00123" (mã bưu chính, mã NV...) giữ nguyên dạng chữ
+_FILTER_NAME_RE = re.compile(
+    r"(^id$|_id$|^id_|code|^ma_|_ma$|status|state|type|category|loai|trang_thai|date|time|ngay|thang|nam$|year|month)",
+    re.I,
+)
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def file_digest(fileobj):
+    """
+    sha256 nội dung file (đọc từng khối 8MB, không nạp cả file vào RAM). Đưa con trỏ file về đầu.
+    """
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def table_name_for(file_name, taken=()):
+    """
+    Tên bảng từ tên file: "Báo cáo 2025 (3).csv" -> "bao_cao_2025_3". Trùng tên -> thêm _2, _3...
+    """
+    stem = os.path.splitext(os.path.basename(file_name or ""))[0].lower().replace("đ", "d")
+    stem = unicodedata.normalize("NFKD", stem).encode("ascii", "ignore").decode("ascii")  # bỏ dấu tiếng Việt
+    name = re.sub(r"[^a-z0-9_]+", "_", stem).strip("_") or "my_data"
+    if name[0].isdigit():
+        name = f"t_{name}"
+    if name.startswith("_agent_") or name.startswith("sqlite_"):
+        name = f"t{name}"
+    candidate, suffix = name, 2
+    while candidate in taken:
+        candidate, suffix = f"{name}_{suffix}", suffix + 1
+    return candidate
+
+
+def infer_column_type(values: pd.Series):
+    """
+    Đoán kiểu 1 cột từ mẫu (đọc dạng chuỗi): boolean / integer / float / date / datetime / text.
+    """
+    values = values.dropna()
+    if values.empty:
+        return "text"
+    values = values.astype(str).str.strip()
+    if values.str.lower().isin(["true", "false"]).all():
+        return "boolean"
+    if values.str.match(_LEADING_ZERO_RE).any():
+        return "text"
+    if values.str.match(_INT_RE).all():
+        return "integer"
+    if pd.to_numeric(values, errors="coerce").notna().all():
+        return "float"
+    if values.str.match(DATE_LIKE_PATTERN).all():
+        parsed = pd.to_datetime(values, errors="coerce", format="mixed")
+        if parsed.notna().all():
+            return "date" if (parsed == parsed.dt.normalize()).all() else "datetime"
+    return "text"
+
+
+def _convert(raw: pd.Series, kind):
+    """
+    Cột chuỗi -> giá trị ghi vào SQLite theo kiểu đã đoán. Không đổi được mà không mất giá trị -> None.
+    Ngày lưu dạng chuỗi ISO ('2025-01-31' / '2025-01-31 08:00:00') để strftime của SQLite đọc được.
+    """
+    if kind == "text":
+        return raw
+    present = raw.notna()
+    values = raw.str.strip()
+    if kind == "boolean":
+        lowered = values.str.lower()
+        if not lowered[present].isin(["true", "false"]).all():
+            return None
+        return lowered.map({"true": 1, "false": 0}).astype("Int64")
+    if kind == "integer":
+        if values[present].str.match(_LEADING_ZERO_RE).any() or not values[present].str.match(_INT_RE).all():
+            return None
+        return pd.to_numeric(values).astype("Int64")
+    if kind == "float":
+        if values[present].str.match(_LEADING_ZERO_RE).any():
+            return None
+        converted = pd.to_numeric(values, errors="coerce")
+        return converted if converted.notna().sum() == present.sum() else None
+    if not values[present].str.match(DATE_LIKE_PATTERN).all():
+        return None
+    parsed = pd.to_datetime(values, errors="coerce", format="mixed")
+    if parsed.notna().sum() != present.sum():
+        return None
+    if kind == "date":
+        if not (parsed[present] == parsed[present].dt.normalize()).all():
+            return None
+        return parsed.dt.strftime("%Y-%m-%d")
+    return parsed.dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _convert_chunk(chunk, column_types):
+    """
+    Đổi kiểu 1 khúc theo column_types. Cột có giá trị không khớp kiểu đã đoán -> nới thẳng tới kiểu hẹp nhất
+    chứa được cả khúc (cập nhật column_types). Trả về (khúc đã đổi, {cột: kiểu cũ} của các cột vừa nới).
+    """
+    converted, widened = {}, {}
+    for column, kind in column_types.items():
+        values, new_kind = _convert(chunk[column], kind), kind
+        while values is None:
+            new_kind = WIDER_TYPE[new_kind]
+            values = _convert(chunk[column], new_kind)
+        if new_kind != kind:
+            widened[column] = kind
+            column_types[column] = new_kind
+        converted[column] = values
+    for column, values in converted.items():
+        chunk[column] = values
+    return chunk, widened
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _create_table_sql(table_name, column_types):
+    columns = ", ".join(f"{_quote(c)} {SQL_TYPES[k]}" for c, k in column_types.items())
+    return f"CREATE TABLE {_quote(table_name)} ({columns})"
+
+
+def _read_csv(fileobj, **kwargs):
+    fileobj.seek(0)
+    # dtype=str: tự đoán kiểu (infer_column_type) thay vì để pandas đoán khác nhau giữa các khúc
+    return pd.read_csv(fileobj, dtype=str, encoding="utf-8-sig", encoding_errors="replace", **kwargs)
+
+
+def filter_columns(column_types, sample: pd.DataFrame, max_indexes=5):
+    """
+    Cột nên có index: ngày tháng, khóa (*_id, mã, trạng thái, loại...), cột chữ ít giá trị khác nhau.
+    Bỏ cột số thực (thường là số đo, ít dùng để lọc bằng) và cột chỉ có 1 giá trị.
+    """
+    scored = []
+    for position, (column, kind) in enumerate(column_types.items()):
+        values = sample[column].dropna()
+        distinct = values.nunique()
+        if kind in ("float", "boolean") or distinct <= 1:
+            continue
+        score = 0
+        if kind in ("date", "datetime"):
+            score += 3
+        if _FILTER_NAME_RE.search(str(column)):
+            score += 2
+        if kind == "text" and distinct <= max(50, len(values) // 20):
+            score += 1
+        if score > 0:
+            scored.append((-score, position, column))
+    return [column for _, _, column in sorted(scored)[:max_indexes]]
+
+
+def _widen_table(conn, table_name, fileobj, column_types, widened, rows, chunk_rows):
+    """
+    Nới kiểu các cột `widened` của bảng đang nạp dở mà không đọc lại cả file:
+    - khai báo lại bảng với kiểu mới ngay trong SQLite (INSERT ... SELECT, giữ rowid), để các khúc sau
+      không bị ép theo affinity cũ (VD: '00123' vào cột INTEGER thành 123);
+    - date -> datetime: đổi định dạng tại chỗ bằng strftime; integer -> float giữ nguyên giá trị;
+    - -> text: giá trị đã đổi kiểu không còn chuỗi gốc -> đọc lại riêng các cột đó của `rows` dòng đã nạp
+      rồi UPDATE theo rowid.
+    """
+    widening = f"{table_name}__widen"
+    columns = ", ".join(_quote(c) for c in column_types)
+    conn.execute(_create_table_sql(widening, column_types))
+    conn.execute(f"INSERT INTO {_quote(widening)} (rowid, {columns}) SELECT rowid, {columns} FROM {_quote(table_name)}")
+    conn.execute(f"DROP TABLE {_quote(table_name)}")
+    conn.execute(f"ALTER TABLE {_quote(widening)} RENAME TO {_quote(table_name)}")
+
+    for column, old in widened.items():
+        if old == "date" and column_types[column] == "datetime":
+            conn.execute(f"UPDATE {_quote(table_name)} SET {_quote(column)} = strftime('%Y-%m-%d %H:%M:%S', "
+                         f"{_quote(column)}) WHERE {_quote(column)} IS NOT NULL")
+
+    text_columns = [c for c in widened if column_types[c] == "text"]
+    if not text_columns or not rows:
+        return
+    updates = ", ".join(f"{_quote(c)} = ?" for c in text_columns)
+    update_sql = f"UPDATE {_quote(table_name)} SET {updates} WHERE rowid = ?"
+    position = fileobj.tell()  # Reader chính đang đọc dở cùng file -> trả lại vị trí sau khi đọc lại
+    try:
+        rowid = 1
+        with _read_csv(fileobj, usecols=text_columns, nrows=rows, chunksize=chunk_rows) as reader:
+            for part in reader:
+                part = part[text_columns]
+                values = part.astype(object).where(part.notna(), None).itertuples(index=False, name=None)
+                conn.executemany(update_sql, ((*row, rowid + i) for i, row in enumerate(values)))
+                rowid += len(part)
+    finally:
+        fileobj.seek(position)
+
+
+def _load_csv(conn, table_name, fileobj, chunk_rows, sample_rows, max_indexes, min_index_rows):
+    """
+    Nạp 1 file CSV vào bảng table_name (kết nối sqlite3). Trả về thông tin bảng cho catalog.
+    Khúc sau có giá trị khác kiểu đã đoán từ mẫu -> nới kiểu các cột đó trên phần đã nạp (_widen_table),
+    không nạp lại từ đầu.
+    """
+    sample = _read_csv(fileobj, nrows=sample_rows)
+    column_types = {column: infer_column_type(sample[column]) for column in sample.columns}
+
+    conn.execute(f"DROP TABLE IF EXISTS {_quote(table_name)}")
+    conn.execute(_create_table_sql(table_name, column_types))
+    placeholders = ", ".join("?" for _ in column_types)
+    insert_sql = f"INSERT INTO {_quote(table_name)} VALUES ({placeholders})"
+    rows = 0
+    # "with": đóng reader đúng cách (không đóng luôn file upload)
+    with _read_csv(fileobj, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            chunk, widened = _convert_chunk(chunk, column_types)
+            if widened:
+                changes = ", ".join(f"'{c}' {old} -> {column_types[c]}" for c, old in widened.items())
+                print(f"⚠️ Giá trị khác kiểu đã đoán: {changes}, sửa {rows:,} dòng đã nạp của '{table_name}'")
+                _widen_table(conn, table_name, fileobj, column_types, widened, rows, chunk_rows)
+            # NaN / NA -> NULL, giá trị numpy -> kiểu Python
+            records = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+            conn.executemany(insert_sql, records)
+            rows += len(chunk)
+
+    indexes = filter_columns(column_types, sample, max_indexes) if rows >= min_index_rows else []
+    return {"columns": column_types, "rows": rows, "indexes": indexes}
+
+
+def _find_loaded(store_dir, file_hash, exclude):
+    """
+    DB khác trong kho đã có file này -> (đường dẫn, bảng, thông tin). Không có -> None.
+    """
+    paths = sorted(
+        (os.path.join(store_dir, f) for f in os.listdir(store_dir) if f.endswith(".db")),
+        key=os.path.getmtime, reverse=True,
+    )
+    for path in paths:
+        if os.path.abspath(path) == os.path.abspath(exclude):
+            continue
+        try:
+            with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as conn:
+                row = conn.execute(
+                    f"SELECT table_name, info FROM {CATALOG_TABLE} WHERE file_hash = ?", (file_hash,)
+                ).fetchone()
+        except sqlite3.Error:
+            continue
+        if row:
+            return path, row[0], json.loads(row[1])
+    return None
+
+
+def _copy_table(conn, source_path, source_table, table_name, info):
+    """
+    Chép bảng đã nạp từ DB khác trong kho (ATTACH, không đọc lại CSV).
+    """
+    conn.execute("ATTACH DATABASE ? AS src", (source_path,))
+    try:
+        conn.execute(_create_table_sql(table_name, info["columns"]))
+        conn.execute(f"INSERT INTO {_quote(table_name)} SELECT * FROM src.{_quote(source_table)}")
+        conn.commit()
+    finally:
+        conn.execute("DETACH DATABASE src")
+
+
+def _create_indexes(conn, table_name, columns):
+    for column in columns:
+        index = f"ix_upload_{table_name}_{re.sub(r'[^A-Za-z0-9_]+', '_', str(column))}"[:120]
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {_quote(index)} ON {_quote(table_name)} ({_quote(column)})")
+
+
+def _build_store(path, uploads, store_dir):
+    """
+    Dựng DB cho 1 bộ file upload vào file tạm rồi đổi tên (tiến trình khác không đọc phải DB dở dang).
+    """
+    chunk_rows = _env_int("UPLOAD_CHUNK_ROWS", 100_000)
+    sample_rows = _env_int("UPLOAD_SAMPLE_ROWS", 10_000)
+    max_indexes = _env_int("UPLOAD_MAX_INDEXES", 5)
+    min_index_rows = _env_int("UPLOAD_INDEX_MIN_ROWS", 10_000)
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    conn = sqlite3.connect(tmp_path)
+    try:
+        # File tạm, lỗi giữa chừng thì bỏ -> không cần journal / fsync
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute(
+            f"CREATE TABLE {CATALOG_TABLE} (table_name TEXT PRIMARY KEY, file_hash TEXT NOT NULL,"
+            " file_name TEXT, info TEXT NOT NULL, loaded_at REAL)"
+        )
+        for upload in uploads:
+            started = time.perf_counter()
+            loaded = _find_loaded(store_dir, upload["file_hash"], exclude=path)
+            if loaded:
+                source_path, source_table, info = loaded
+                _copy_table(conn, source_path, source_table, upload["table_name"], info)
+                action = "chép lại từ kho"
+            else:
+                info = _load_csv(conn, upload["table_name"], upload["file"], chunk_rows, sample_rows,
+                                 max_indexes, min_index_rows)
+                action = "đọc CSV"
+            _create_indexes(conn, upload["table_name"], info["indexes"])
+            conn.execute(
+                f"INSERT INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?)",
+                (upload["table_name"], upload["file_hash"], upload["file_name"], json.dumps(info), time.time()),
+            )
+            conn.commit()
+            print(f"📥 Bảng '{upload['table_name']}': {info['rows']:,} dòng ({action}, "
+                  f"{time.perf_counter() - started:.1f}s, index: {', '.join(info['indexes']) or 'không'})")
+        conn.execute("ANALYZE")
+        conn.commit()
+    except BaseException:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    conn.close()
+    os.replace(tmp_path, path)
+
+
+def _read_catalog(path):
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as conn:
+        rows = conn.execute(f"SELECT table_name, file_hash, file_name, info FROM {CATALOG_TABLE}").fetchall()
+    return {
+        table_name: {"table": table_name, "file_hash": file_hash, "file_name": file_name, **json.loads(info)}
+        for table_name, file_hash, file_name, info in rows
+    }
+
+
+def evict_uploads(store_dir=None, max_bytes=None, keep=()):
+    """
+    Xóa các DB / file upload cũ nhất (theo lần dùng cuối) khi kho vượt UPLOAD_STORE_MAX_MB.
+    """
+    store_dir = store_dir or os.getenv("UPLOAD_STORE_DIR") or DEFAULT_UPLOAD_DIR
+    if max_bytes is None:
+        max_bytes = _env_int("UPLOAD_STORE_MAX_MB", 4096) * 1024 * 1024
+    keep = {os.path.abspath(p) for p in keep}
+    files = [os.path.join(store_dir, f) for f in os.listdir(store_dir) if f.endswith((".db", ".duckdb"))]
+    raw_dir = os.path.join(store_dir, "files")
+    if os.path.isdir(raw_dir):
+        files += [os.path.join(raw_dir, f) for f in os.listdir(raw_dir) if not f.endswith(".tmp")]
+    files.sort(key=os.path.getmtime)
+    total = sum(os.path.getsize(f) for f in files)
+    for path in files:
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        size = os.path.getsize(path)
+        if path.endswith((".db", ".duckdb")):
+            if not _remove_store(path):
+                continue
+        else:
+            os.remove(path)
+        total -= size
+        print(f"🧹 Xóa dữ liệu upload cũ: {os.path.basename(path)}")
+
+
+def _remove_store(path):
+    """
+    Xóa 1 DB trong kho nếu không ai đang dùng: bỏ qua khi phiên khác đang nạp/mở file (giữ khóa build)
+    hoặc đang chạy truy vấn trên nó; ngược lại đóng engine của file trong registry rồi mới xóa.
+    """
+    with _build_locks_guard:
+        lock = _build_locks.setdefault(path, threading.Lock())
+    if not lock.acquire(blocking=False):
+        return False
+    try:
+        if not release_engines(path):
+            return False
+        os.remove(path)
+        return True
+    finally:
+        lock.release()
+
+
+def _save_raw(upload, raw_dir):
+    """
+    Lưu file gốc 1 lần theo hash nội dung (DuckDB đọc thẳng file này). Trả về đường dẫn.
+    """
+    ext = ".parquet" if upload["file_name"].lower().endswith(".parquet") else ".csv"
+    path = os.path.join(raw_dir, upload["file_hash"] + ext)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    upload["file"].seek(0)
+    with open(tmp_path, "wb") as out:
+        shutil.copyfileobj(upload["file"], out, HASH_BLOCK_SIZE)
+    upload["file"].seek(0)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _build_duckdb_store(path, uploads, raw_paths):
+    """
+    DB DuckDB chỉ gồm các VIEW đọc file gốc + catalog (số dòng, kiểu cột do DuckDB tự dò).
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with closing(duckdb.connect(tmp_path)) as conn:
+            conn.execute(
+                f"CREATE TABLE {CATALOG_TABLE} (table_name VARCHAR PRIMARY KEY, file_hash VARCHAR NOT NULL,"
+                " file_name VARCHAR, info VARCHAR NOT NULL, loaded_at DOUBLE)"
+            )
+            for upload, raw_path in zip(uploads, raw_paths):
+                started = time.perf_counter()
+                conn.execute(file_view_sql(upload["table_name"], raw_path))
+                columns = {row[0]: row[1] for row in conn.execute(f"DESCRIBE {_quote(upload['table_name'])}").fetchall()}
+                rows = conn.execute(f"SELECT COUNT(*) FROM {_quote(upload['table_name'])}").fetchone()[0]
+                info = {"columns": columns, "rows": int(rows), "indexes": []}
+                conn.execute(
+                    f"INSERT INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?)",
+                    [upload["table_name"], upload["file_hash"], upload["file_name"], json.dumps(info), time.time()],
+                )
+                print(f"🦆 View '{upload['table_name']}' -> {os.path.basename(raw_path)}: {info['rows']:,} dòng "
+                      f"({time.perf_counter() - started:.1f}s, không nạp dữ liệu)")
+            conn.execute("CHECKPOINT")
+        os.replace(tmp_path, path)
+    finally:
+        for leftover in (tmp_path, f"{tmp_path}.wal"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def _load_duckdb(uploads, key, store_dir):
+    raw_dir = os.path.join(store_dir, "files")
+    os.makedirs(raw_dir, exist_ok=True)
+    path = os.path.join(store_dir, hashlib.sha256(f"duckdb|{key}".encode("utf-8")).hexdigest()[:24] + ".duckdb")
+
+    with _build_locks_guard:
+        lock = _build_locks.setdefault(path, threading.Lock())
+    with lock:
+        # File gốc bị evict thì lưu lại đúng đường dẫn cũ -> VIEW trong DB vẫn dùng được
+        raw_paths = [_save_raw(upload, raw_dir) for upload in uploads]
+        if not os.path.exists(path):
+            _build_duckdb_store(path, uploads, raw_paths)
+            evict_uploads(store_dir, keep=[path, *raw_paths])
+        else:
+            os.utime(path)
+        # Lấy engine trong khóa: evict_uploads không xóa file giữa lúc kiểm tra và lúc mở
+        engine = get_duckdb_engine(path)
+        with engine.connect() as connection:
+            rows = connection.execute(text(f"SELECT table_name, file_hash, file_name, info FROM {CATALOG_TABLE}")).fetchall()
+    tables = {
+        table_name: {"table": table_name, "file_hash": file_hash, "file_name": file_name, **json.loads(info)}
+        for table_name, file_hash, file_name, info in rows
+    }
+    return engine, tables
+
+
+def load_uploads(files, digests=None, store_dir=None, backend=None):
+    """
+    Nạp các file CSV upload (UploadedFile của Streamlit hoặc file mở dạng nhị phân, có .name).
+    Mỗi bộ file (theo nội dung + tên bảng) chỉ đọc CSV 1 lần, lần sau mở lại DB trong kho.
+    digests: sha256 đã tính sẵn của từng file (app.py giữ trong session_state để khỏi băm lại mỗi lần rerun).
+    backend: "duckdb" -> VIEW đọc thẳng file (nhận cả .parquet), mặc định theo DB_BACKEND.
+    Trả về (engine dùng chung, {tên bảng: {"file_name", "rows", "columns", "indexes", ...}}).
+    """
+    store_dir = store_dir or os.getenv("UPLOAD_STORE_DIR") or DEFAULT_UPLOAD_DIR
+    os.makedirs(store_dir, exist_ok=True)
+
+    uploads, taken = [], set()
+    for i, fileobj in enumerate(files):
+        file_name = getattr(fileobj, "name", None) or f"upload_{i + 1}.csv"
+        table_name = table_name_for(file_name, taken)
+        taken.add(table_name)
+        file_hash = digests[i] if digests else file_digest(fileobj)
+        uploads.append({"file": fileobj, "file_name": file_name, "table_name": table_name, "file_hash": file_hash})
+
+    key = "|".join(f"{u['table_name']}:{u['file_hash']}" for u in sorted(uploads, key=lambda u: u["table_name"]))
+    if use_duckdb(backend):
+        return _load_duckdb(uploads, key, store_dir)
+    parquet = [u["file_name"] for u in uploads if u["file_name"].lower().endswith(".parquet")]
+    if parquet:
+        raise ValueError(f"File Parquet ({', '.join(parquet)}) cần DB_BACKEND=duckdb.")
+    path = os.path.join(store_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()[:24] + ".db")
+
+    with _build_locks_guard:
+        lock = _build_locks.setdefault(path, threading.Lock())
+    with lock:
+        if not os.path.exists(path):
+            _build_store(path, uploads, store_dir)
+            evict_uploads(store_dir, keep=[path])
+        else:
+            os.utime(path)  # Đánh dấu vừa dùng (cho evict_uploads)
+        # Lấy engine trong khóa: evict_uploads không xóa file giữa lúc kiểm tra và lúc mở
+        return get_engine(f"sqlite:///{path}"), _read_catalog(path)
@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import random
+import threading
+from core.query_cache import normalize_question, BASE_DIR
+
+# --- LLM PROVIDER ---
+# Tách phần gọi AI ra khỏi sql_generator để thay được backend:
+# - GeminiProvider: gọi Google Gemini (chỉ cấu hình API key khi gọi lần đầu, không raise lúc import).
+# - ReplayProvider: phát lại các cặp câu hỏi -> SQL đã ghi, có độ trễ giả lập (load test / đo hiệu năng offline).
+# - RecordingProvider: bọc 1 provider thật và ghi lại mọi response để ReplayProvider dùng lại.
+# Chọn bằng biến môi trường LLM_PROVIDER (gemini | replay), LLM_MODEL, LLM_RECORD_PATH.
+DEFAULT_GEMINI_MODEL = "gemini-flash-latest"
+DEFAULT_RECORDINGS_PATH = os.path.join(BASE_DIR, ".cache", "llm_recordings.jsonl")
+
+
+class LLMRequest:
+    """
+    1 lần gọi AI.
+    kind: "generate" (viết SQL mới) hoặc "fix" (sửa SQL lỗi).
+    question: câu hỏi gốc; broken_sql: SQL cần sửa (chỉ với kind="fix").
+    """
+    def __init__(self, kind, question, system_instruction, prompt, generation_config=None, broken_sql=None):
+        self.kind = kind
+        self.question = question
+        self.system_instruction = system_instruction
+        self.prompt = prompt
+        self.generation_config = generation_config
+        self.broken_sql = broken_sql
+
+    def replay_key(self):
+        """
+        Khóa tra bản ghi: loại request + câu hỏi chuẩn hóa (+ SQL lỗi với request sửa lỗi).
+        """
+        key = f"{self.kind}|{normalize_question(self.question)}"
+        if self.kind == "fix":
+            key += f"|{' '.join((self.broken_sql or '').split())}"
+        return key
+
+
+class LLMProvider:
+    """
+    Interface chung: stream() trả về iterator các đoạn text; complete() gộp lại thành 1 chuỗi.
+    model_name được dùng trong khóa SQL cache (đổi model -> không dùng lại SQL cũ).
+    """
+    name = "base"
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def stream(self, request):
+        raise NotImplementedError
+
+    def complete(self, request):
+        return "".join(self.stream(request))
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, model_name=DEFAULT_GEMINI_MODEL, api_key=None):
+        super().__init__(model_name)
+        self.api_key = api_key
+        self._configured = False
+        self._lock = threading.Lock()
+
+    def _configure(self):
+        with self._lock:
+            if self._configured:
+                return
+            import google.generativeai as genai
+
+            api_key = self.api_key or os.getenv("GOOGLE_API_KEY")
+            if not api_key:
+                raise ValueError("❌ Chưa tìm thấy GOOGLE_API_KEY trong file .env")
+            genai.configure(api_key=api_key)
+            self._configured = True
+
+    def stream(self, request):
+        self._configure()
+        import google.generativeai as genai
+
+        model = genai.GenerativeModel(
+            model_name=self.model_name,
+            generation_config=request.generation_config,
+            system_instruction=request.system_instruction,
+        )
+        for chunk in model.generate_content(request.prompt, stream=True):
+            yield chunk.text
+
+
+class ReplayProvider(LLMProvider):
+    """
+    Phát lại response đã ghi (file JSONL: {"key", "kind", "question", "text"} mỗi dòng).
+    latency: tổng thời gian giả lập (giây) cho 1 response, chia đều cho các đoạn stream.
+    first_token_latency: thời gian chờ trước đoạn đầu tiên; jitter: dao động ngẫu nhiên (tỉ lệ, VD 0.2 = ±20%).
+    chunk_chars: số ký tự mỗi đoạn stream. Request không có bản ghi -> LookupError.
+    """
+    name = "replay"
+
+    def __init__(self, path=DEFAULT_RECORDINGS_PATH, latency=0.0, first_token_latency=0.0, jitter=0.0,
+                 chunk_chars=40, seed=None, recordings=None):
+        super().__init__("replay")
+        self.path = path
+        self.latency = latency
+        self.first_token_latency = first_token_latency
+        self.jitter = jitter
+        self.chunk_chars = max(1, chunk_chars)
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.recordings = {}
+        if recordings is None and path and os.path.exists(path):
+            recordings = load_recordings(path)
+        for item in recordings or []:
+            self.add(**item)
+
+    def add(self, question, text, kind="generate", broken_sql=None, key=None, **_):
+        key = key or LLMRequest(kind, question, None, None, broken_sql=broken_sql).replay_key()
+        self.recordings[key] = text
+
+    def _sleep(self, seconds):
+        if seconds <= 0:
+            return
+        if self.jitter:
+            with self._random_lock:
+                seconds *= 1 + self._random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, seconds))
+
+    def stream(self, request):
+        text = self.recordings.get(request.replay_key())
+        if text is None:
+            raise LookupError(f"Không có bản ghi replay cho câu hỏi: {request.question[:80]!r}")
+
+        chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or [""]
+        self._sleep(self.first_token_latency)
+        for chunk in chunks:
+            self._sleep(self.latency / len(chunks))
+            yield chunk
+
+
+class RecordingProvider(LLMProvider):
+    """
+    Bọc 1 provider: trả response như bình thường và ghi thêm vào file JSONL (kể cả khi stream bị dừng sớm).
+    """
+    def __init__(self, inner, path=DEFAULT_RECORDINGS_PATH):
+        super().__init__(inner.model_name)
+        self.name = f"{inner.name}+record"
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+
+    def stream(self, request):
+        parts = []
+        try:
+            for chunk in self.inner.stream(request):
+                parts.append(chunk)
+                yield chunk
+        finally:
+            if parts:
+                self._append(request, "".join(parts))
+
+    def _append(self, request, text):
+        item = {
+            "key": request.replay_key(),
+            "kind": request.kind,
+            "question": request.question,
+            "broken_sql": request.broken_sql,
+            "text": text,
+            "model": self.inner.model_name,
+        }
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def load_recordings(path):
+    """
+    Đọc file ghi JSONL. Bản ghi sau ghi đè bản ghi trước cùng khóa.
+    """
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def create_llm_provider(name=None):
+    """
+    Tạo provider theo tên (mặc định LLM_PROVIDER, rồi tới "gemini").
+    LLM_RECORD_PATH: nếu đặt, bọc provider để ghi lại response vào file này.
+    """
+    name = (name or os.getenv("LLM_PROVIDER") or "gemini").strip().lower()
+    if name == "gemini":
+        provider = GeminiProvider(os.getenv("LLM_MODEL") or DEFAULT_GEMINI_MODEL)
+    elif name == "replay":
+        provider = ReplayProvider(
+            path=os.getenv("LLM_REPLAY_PATH") or DEFAULT_RECORDINGS_PATH,
+            latency=_env_float("LLM_REPLAY_LATENCY", 0.0),
+            first_token_latency=_env_float("LLM_REPLAY_FIRST_TOKEN", 0.0),
+            jitter=_env_float("LLM_REPLAY_JITTER", 0.0),
+        )
+    else:
+        raise ValueError(f"❌ LLM_PROVIDER không hợp lệ: {name} (chọn 'gemini' hoặc 'replay')")
+
+    record_path = os.getenv("LLM_RECORD_PATH")
+    if record_path:
+        provider = RecordingProvider(provider, record_path)
+    return provider
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_llm_provider():
+    """
+    Provider dùng chung cho toàn tiến trình (tạo lần đầu khi cần).
+    """
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = create_llm_provider()
+    return _provider
+
+
+def set_llm_provider(provider):
+    """
+    Thay provider dùng chung (VD: benchmark dùng ReplayProvider). None = tạo lại theo biến môi trường.
+    """
+    global _provider
+    with _provider_lock:
+        _provider = provider
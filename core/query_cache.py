@@ -0,0 +1,158 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from contextlib import contextmanager
+
+# --- NL-TO-SQL CACHE ---
+# Lưu câu SQL đã chạy THÀNH CÔNG theo (câu hỏi đã chuẩn hóa + schema hash + model).
+# Lưu trên đĩa (SQLite) nên vẫn còn sau khi Streamlit khởi động lại.
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(BASE_DIR, ".cache", "sql_cache.db")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Chuẩn hóa câu hỏi: bỏ dấu tiếng Việt, chữ thường, bỏ dấu câu, gộp khoảng trắng.
+    VD: "  Máy nào   TỐN chi phí nhất? " -> "may nao ton chi phi nhat"
+    """
+    text = question.replace("đ", "d").replace("Đ", "D")
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_cache_key(question: str, schema_hash: str, model_name: str) -> str:
+    raw = f"{normalize_question(question)}|{schema_hash}|{model_name}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SqlCache:
+    """
+    Cache câu hỏi -> SQL trên đĩa, giới hạn bằng LRU (max_entries) và TTL (giây).
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=5000, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sql_cache ("
+                " key TEXT PRIMARY KEY, question TEXT, model TEXT, schema_hash TEXT,"
+                " sql TEXT NOT NULL, created_at REAL, last_used REAL, use_count INTEGER DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_sql_cache_last_used ON sql_cache(last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:  # tự commit/rollback
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, question, schema_hash, model_name):
+        key = make_cache_key(question, schema_hash, model_name)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT sql, created_at FROM sql_cache WHERE key = ?", (key,)).fetchone()
+            if row and self.ttl and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM sql_cache WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            conn.execute(
+                "UPDATE sql_cache SET last_used = ?, use_count = use_count + 1 WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, question, schema_hash, model_name, sql):
+        key = make_cache_key(question, schema_hash, model_name)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            # Câu hỏi đã có (VD: remember_sql sau 1 lần dùng cache): giữ created_at / use_count để TTL và
+            # thống kê vẫn đúng; chỉ khi SQL đổi (đã được sửa lại) mới tính là bản ghi mới
+            conn.execute(
+                "INSERT INTO sql_cache (key, question, model, schema_hash, sql, created_at, last_used, use_count)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, 0)"
+                " ON CONFLICT(key) DO UPDATE SET last_used = excluded.last_used,"
+                " created_at = CASE WHEN sql = excluded.sql THEN created_at ELSE excluded.created_at END,"
+                " use_count = CASE WHEN sql = excluded.sql THEN use_count ELSE 0 END,"
+                " sql = excluded.sql",
+                (key, normalize_question(question), model_name, schema_hash, sql, now, now),
+            )
+            self._evict(conn, now)
+
+    def delete(self, question, schema_hash, model_name):
+        key = make_cache_key(question, schema_hash, model_name)
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM sql_cache WHERE key = ?", (key,))
+
+    def _evict(self, conn, now):
+        # 1. Xóa bản ghi quá hạn TTL
+        if self.ttl:
+            conn.execute("DELETE FROM sql_cache WHERE created_at < ?", (now - self.ttl,))
+        # 2. Vượt quá số lượng -> xóa bản ghi ít dùng gần đây nhất (LRU)
+        count = conn.execute("SELECT COUNT(*) FROM sql_cache").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM sql_cache WHERE key IN ("
+                " SELECT key FROM sql_cache ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM sql_cache")
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM sql_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "path": self.path,
+        }
+
+
+_sql_cache = None
+_sql_cache_lock = threading.Lock()
+
+
+def get_sql_cache():
+    """
+    Cache dùng chung cho cả tiến trình. Trả về None nếu SQL_CACHE_ENABLED=0.
+    Cấu hình: SQL_CACHE_PATH, SQL_CACHE_MAX_ENTRIES, SQL_CACHE_TTL (giây, 0 = không hết hạn).
+    """
+    global _sql_cache
+    if os.getenv("SQL_CACHE_ENABLED", "1").strip().lower() in ("0", "false", "no", "off"):
+        return None
+
+    with _sql_cache_lock:
+        if _sql_cache is None:
+            _sql_cache = SqlCache(
+                path=os.getenv("SQL_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_entries=int(os.getenv("SQL_CACHE_MAX_ENTRIES", "5000")),
+                ttl=float(os.getenv("SQL_CACHE_TTL", str(7 * 24 * 3600))),
+            )
+    return _sql_cache
@@ -0,0 +1,194 @@
+import os
+import re
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from sqlalchemy import text
+from core.schema_cache import get_schema_snapshot, engine_cache_key
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow không bắt buộc, fallback sang pickle
+    pa = None
+
+# --- RESULT CACHE ---
+# Cache kết quả SELECT theo (SQL đã chuẩn hóa + DB + "phiên bản dữ liệu" của từng bảng liên quan).
+# Giới hạn theo dung lượng (bytes), lưu frame dạng Arrow IPC nén gọn, mỗi lần đọc trả về 1 DataFrame mới.
+_LITERAL_RE = re.compile(r"('(?:[^']|'')*')")
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+
+
+def canonicalize_sql(sql_query: str) -> str:
+    """
+    Chuẩn hóa SQL để làm khóa: bỏ comment, gộp khoảng trắng, bỏ dấu ';' cuối.
+    Không đụng vào nội dung trong chuỗi '...'.
+    """
+    parts = _LITERAL_RE.split(sql_query)
+    for i in range(0, len(parts), 2):  # phần chẵn nằm ngoài chuỗi literal
+        parts[i] = re.sub(r"\s+", " ", _COMMENT_RE.sub(" ", parts[i]))
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def referenced_tables(sql_query: str, table_names):
+    """
+    Các bảng trong schema xuất hiện trong câu SQL (so khớp theo từ, không phân biệt hoa thường).
+    """
+    code = " ".join(_LITERAL_RE.split(sql_query)[0::2]).lower()
+    tokens = set(re.findall(r"[\w$]+", code))
+    return sorted(t for t in table_names if t.lower() in tokens)
+
+
+def _serialize(df):
+    """
+    DataFrame -> (payload, định dạng). Ưu tiên Arrow IPC (gọn, đọc lại nhanh).
+    """
+    if pa is not None:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return sink.getvalue(), "arrow"
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            pass  # Cột object hỗn hợp kiểu -> fallback
+    return pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL), "pickle"
+
+
+def _deserialize(payload, fmt):
+    if fmt == "arrow":
+        return pa.ipc.open_stream(payload).read_all().to_pandas()
+    return pickle.loads(payload)
+
+
+def data_versions(connection, tables, snapshot):
+    """
+    Phiên bản dữ liệu của các bảng: (tên bảng, số dòng, MAX khóa chính) lấy bằng 1 truy vấn UNION ALL.
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    probes = []
+    versions = []
+    for table_name in tables:
+        # View DuckDB đọc thẳng file upload (tên file theo hash nội dung) -> không đổi, khỏi quét cả file để đếm
+        if snapshot.tables[table_name].get("view") and connection.dialect.name == "duckdb":
+            versions.append((table_name, None, "view"))
+            continue
+        pk = snapshot.tables[table_name].get("primary_key") or []
+        max_expr = f"MAX({quote(pk[0])})" if len(pk) == 1 else "NULL"
+        probes.append(f"SELECT '{table_name}', COUNT(*), {max_expr} FROM {quote(table_name)}")
+    if probes:
+        rows = connection.execute(text(" UNION ALL ".join(probes))).fetchall()
+        versions.extend((str(r[0]), r[1], str(r[2])) for r in rows)
+    return tuple(sorted(versions, key=lambda v: v[0]))
+
+
+class ResultCache:
+    """
+    LRU cache giới hạn theo bytes.
+    max_bytes: tổng dung lượng; max_entry_bytes: kết quả lớn hơn mức này sẽ không được cache.
+    ttl: tuổi tối đa của 1 kết quả (giây, 0 = không giới hạn).
+    probe: True = kiểm tra phiên bản dữ liệu (COUNT/MAX khóa chính) mỗi lần tra cache.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_entry_bytes=None, ttl=600, probe=True):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4
+        self.ttl = ttl
+        self.probe = probe
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (payload, fmt, nbytes, attrs, created_at)
+        self._lock = threading.Lock()
+
+    def make_key(self, sql_query, engine, extra=None):
+        """
+        Khóa cache: DB + SQL chuẩn hóa + phiên bản dữ liệu của các bảng được tham chiếu.
+        extra: tham số khác ảnh hưởng tới kết quả (VD: giới hạn số dòng).
+        """
+        snapshot = get_schema_snapshot(engine)
+        tables = referenced_tables(sql_query, snapshot.table_names())
+        versions = ()
+        if self.probe and tables:
+            with engine.connect() as connection:
+                versions = data_versions(connection, tables, snapshot)
+        raw = f"{engine_cache_key(engine)}|{snapshot.schema_hash}|{canonicalize_sql(sql_query)}|{versions}|{extra}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.time() - entry[4] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            payload, fmt, _, attrs, _ = entry
+
+        # Giải nén ngoài lock: mỗi lần trả về 1 DataFrame mới, caller sửa thoải mái không ảnh hưởng cache
+        df = _deserialize(payload, fmt)
+        df.attrs.update(pickle.loads(attrs))
+        return df
+
+    def put(self, key, df):
+        payload, fmt = _serialize(df)
+        nbytes = payload.size if fmt == "arrow" else len(payload)
+        if nbytes > self.max_entry_bytes:
+            return False
+
+        attrs = pickle.dumps(dict(df.attrs))
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (payload, fmt, nbytes, attrs, time.time())
+            self.current_bytes += nbytes
+            # Vượt ngân sách bộ nhớ -> bỏ các kết quả lâu không dùng nhất
+            while self.current_bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+        return True
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Cache kết quả dùng chung. Trả về None nếu RESULT_CACHE_ENABLED=0.
+    Cấu hình: RESULT_CACHE_MAX_MB, RESULT_CACHE_TTL (giây), RESULT_CACHE_PROBE (1/0).
+    """
+    global _result_cache
+    if os.getenv("RESULT_CACHE_ENABLED", "1").strip().lower() in ("0", "false", "no", "off"):
+        return None
+
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(
+                max_bytes=int(float(os.getenv("RESULT_CACHE_MAX_MB", "256")) * 1024 * 1024),
+                ttl=float(os.getenv("RESULT_CACHE_TTL", "600")),
+                probe=os.getenv("RESULT_CACHE_PROBE", "1").strip().lower() not in ("0", "false", "no", "off"),
+            )
+    return _result_cache
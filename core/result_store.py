@@ -0,0 +1,233 @@
+import os
+import time
+import uuid
+import shutil
+import pickle
+import threading
+from collections import OrderedDict
+from core.query_cache import BASE_DIR
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow không bắt buộc: frame tràn ra đĩa dạng pickle
+    pa = None
+
+try:
+    import plotly.io as pio
+except ImportError:
+    pio = None
+
+# --- KẾT QUẢ CỦA PHIÊN CHAT ---
+# st.session_state.messages chỉ giữ "handle" nhẹ (id, số dòng/cột, vài dòng xem trước, SQL), không giữ
+# DataFrame / biểu đồ. Kết quả đầy đủ nằm trong ResultStore của phiên:
+# - Giữ trong RAM tối đa RESULT_STORE_MEMORY_MB (LRU), vượt ngân sách -> kết quả cũ nhất tràn xuống đĩa
+#   (.cache/results/<phiên>/): frame -> Parquet, biểu đồ -> JSON của Plotly.
+# - Cần xem lại / tải xuống -> nạp lại từ đĩa (rehydrate) khi đó.
+# Thư mục của phiên quá RESULT_STORE_TTL_HOURS không dùng tới bị xóa khi tạo store mới.
+DEFAULT_RESULT_STORE_DIR = os.path.join(BASE_DIR, ".cache", "results")
+
+
+def _frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _write_frame(df, path):
+    """
+    Ghi frame xuống đĩa, trả về đường dẫn file. Ưu tiên Parquet (giữ kiểu cột, category -> dictionary).
+    """
+    if pa is not None:
+        try:
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), f"{path}.parquet", compression="zstd")
+            return f"{path}.parquet"
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            pass  # Cột object hỗn hợp kiểu -> pickle
+    with open(f"{path}.pkl", "wb") as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return f"{path}.pkl"
+
+
+def _read_frame(path):
+    if path.endswith(".parquet"):
+        return pq.read_table(path).to_pandas()
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def cleanup_sessions(base_dir, ttl_hours):
+    """
+    Xóa thư mục của các phiên không dùng tới quá ttl_hours (phiên đã đóng tab / server khởi động lại).
+    """
+    if not ttl_hours or not os.path.isdir(base_dir):
+        return
+    cutoff = time.time() - ttl_hours * 3600
+    for name in os.listdir(base_dir):
+        path = os.path.join(base_dir, name)
+        try:
+            if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+class ResultStore:
+    """
+    Kết quả (DataFrame + biểu đồ Plotly) của 1 phiên chat, giới hạn RAM theo bytes.
+    put() trả về handle (dict nhỏ) để lưu trong lịch sử chat; frame() / chart() nạp lại khi cần.
+    """
+    def __init__(self, session_dir, max_bytes=200 * 1024 * 1024, preview_rows=20):
+        self.session_dir = session_dir
+        self.max_bytes = max_bytes
+        self.preview_rows = preview_rows
+        self.current_bytes = 0
+        self.spills = 0
+        self.loads = 0
+        self._memory = OrderedDict()  # id -> {"frame", "chart", "nbytes"}
+        self._files = {}  # id -> {"frame": đường dẫn, "chart": đường dẫn}
+        self._lock = threading.Lock()
+
+    def put(self, df, chart=None):
+        """
+        Lưu 1 kết quả, trả về handle: id, rows, columns, preview (vài dòng đầu), attrs (final_sql, truncated...),
+        has_chart.
+        """
+        result_id = uuid.uuid4().hex[:12]
+        nbytes = _frame_nbytes(df)
+        handle = {
+            "id": result_id,
+            "rows": len(df),
+            "columns": [str(c) for c in df.columns],
+            "preview": df.head(self.preview_rows).copy(),
+            "attrs": dict(df.attrs),
+            "has_chart": chart is not None,
+            "nbytes": nbytes,
+        }
+        with self._lock:
+            self._memory[result_id] = {"frame": df, "chart": chart, "nbytes": nbytes}
+            self.current_bytes += nbytes
+            self._enforce_budget(keep=result_id)
+        self._touch()
+        return handle
+
+    def _enforce_budget(self, keep=None):
+        # Vượt ngân sách -> đẩy kết quả lâu không dùng nhất xuống đĩa (kết quả vừa dùng luôn ở lại RAM)
+        while self.current_bytes > self.max_bytes:
+            victim = next((rid for rid in self._memory if rid != keep), None)
+            if victim is None:
+                break
+            self._spill(victim)
+
+    def _spill(self, result_id):
+        entry = self._memory.pop(result_id)
+        self.current_bytes -= entry["nbytes"]
+        if result_id in self._files:
+            return  # Đã có trên đĩa từ lần tràn trước, chỉ cần bỏ khỏi RAM
+
+        os.makedirs(self.session_dir, exist_ok=True)
+        base = os.path.join(self.session_dir, result_id)
+        files = {"frame": _write_frame(entry["frame"], base)}
+        if entry["chart"] is not None and pio is not None:
+            with open(f"{base}.chart.json", "w", encoding="utf-8") as f:
+                f.write(pio.to_json(entry["chart"], validate=False))
+            files["chart"] = f"{base}.chart.json"
+        self._files[result_id] = files
+        self.spills += 1
+        self._touch()
+
+    def _touch(self):
+        # Đánh dấu phiên còn dùng (cleanup_sessions của phiên khác xóa thư mục theo mtime)
+        try:
+            os.utime(self.session_dir)
+        except OSError:
+            pass  # Chưa tràn lần nào -> chưa có thư mục
+
+    def _load(self, result_id):
+        """
+        Entry trong RAM của 1 kết quả; đã tràn xuống đĩa thì nạp lại (và có thể đẩy kết quả khác xuống).
+        None nếu không còn (file đã bị xóa).
+        """
+        self._touch()
+        with self._lock:
+            entry = self._memory.get(result_id)
+            if entry is not None:
+                self._memory.move_to_end(result_id)
+                return entry
+            files = self._files.get(result_id)
+        if files is None:
+            return None
+
+        # Đọc file ngoài lock
+        try:
+            df = _read_frame(files["frame"])
+            chart = None
+            if "chart" in files:
+                with open(files["chart"], encoding="utf-8") as f:
+                    chart = pio.from_json(f.read(), skip_invalid=True)
+        except FileNotFoundError:
+            # Thư mục phiên đã bị xóa (hết hạn, clear) -> bỏ kết quả, caller hiện "không còn được lưu"
+            print(f"⚠️ Kết quả {result_id} không còn trên đĩa.")
+            with self._lock:
+                self._files.pop(result_id, None)
+            return None
+        entry = {"frame": df, "chart": chart, "nbytes": _frame_nbytes(df)}
+
+        with self._lock:
+            if result_id not in self._memory:
+                self._memory[result_id] = entry
+                self.current_bytes += entry["nbytes"]
+                self.loads += 1
+                self._enforce_budget(keep=result_id)
+            return self._memory.get(result_id, entry)
+
+    def in_memory(self, result_id):
+        with self._lock:
+            return result_id in self._memory
+
+    def frame(self, handle):
+        """
+        DataFrame đầy đủ của handle (nạp lại từ đĩa nếu đã tràn); None nếu không còn.
+        """
+        entry = self._load(handle["id"])
+        if entry is None:
+            return None
+        df = entry["frame"]
+        df.attrs.update(handle["attrs"])
+        return df
+
+    def chart(self, handle):
+        if not handle.get("has_chart"):
+            return None
+        entry = self._load(handle["id"])
+        return entry["chart"] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._files.clear()
+            self.current_bytes = 0
+        shutil.rmtree(self.session_dir, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "results": len(self._memory.keys() | self._files.keys()),
+                "in_memory": len(self._memory),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "spills": self.spills,
+                "loads": self.loads,
+            }
+
+
+def create_result_store(session_id=None):
+    """
+    ResultStore mới cho 1 phiên (app.py giữ trong st.session_state).
+    Cấu hình: RESULT_STORE_DIR, RESULT_STORE_MEMORY_MB, RESULT_PREVIEW_ROWS, RESULT_STORE_TTL_HOURS.
+    """
+    base_dir = os.getenv("RESULT_STORE_DIR") or DEFAULT_RESULT_STORE_DIR
+    cleanup_sessions(base_dir, float(os.getenv("RESULT_STORE_TTL_HOURS", "24")))
+    return ResultStore(
+        os.path.join(base_dir, session_id or uuid.uuid4().hex),
+        max_bytes=int(float(os.getenv("RESULT_STORE_MEMORY_MB", "200")) * 1024 * 1024),
+        preview_rows=int(os.getenv("RESULT_PREVIEW_ROWS", "20")),
+    )
@@ -0,0 +1,589 @@
+import os
+import re
+import time
+import threading
+from sqlglot import exp
+from sqlalchemy import text
+from core.database import Base
+from core.schema_cache import get_schema_snapshot, engine_cache_key, invalidate_schema_cache
+from core.sql_validator import parse_sql
+from core.dialect import get_sqlglot_dialect
+
+# --- ROLLUP TABLES ---
+# Câu hỏi tổng hợp (tổng chi phí / số lần bảo trì theo tháng, máy, kỹ sư) phải quét toàn bộ maintenance_logs.
+# Module này duy trì bảng rollup_maintenance_monthly (gộp sẵn theo tháng x máy x kỹ sư):
+# 1. refresh_rollups(): chỉ gộp các dòng có id > watermark rồi cộng dồn (UPSERT / MERGE), dựng lại toàn bộ
+#    khi phát hiện dữ liệu cũ bị xóa / nạp lại.
+# 2. route_query(): viết lại câu SQL tổng hợp trên maintenance_logs sang bảng rollup nếu kết quả chắc chắn
+#    giống hệt (chỉ dùng cột máy / kỹ sư, ngày ở mức tháng, SUM/COUNT/AVG/MIN/MAX của cost).
+# 3. rollup_prompt_hint(): gợi ý cho AI dùng thẳng bảng rollup.
+SOURCE_TABLE = "maintenance_logs"
+ROLLUP_TABLE = "rollup_maintenance_monthly"
+STATE_TABLE = "_agent_rollup_state"
+ROLLUP_NAME = "maintenance_monthly"
+
+DIMENSION_COLUMNS = ("machine_id", "technician_id")
+# Giá trị status -> cột đếm tương ứng trong rollup
+STATUS_COLUMNS = {"Success": "success_count", "Pending": "pending_count", "Failed": "failed_count"}
+
+_MONTH_UNITS = {"YEAR", "QUARTER", "MONTH"}
+_DATE_LITERAL_RE = re.compile(r"^\d{4}-\d{2}-01$")
+# Hàm bọc cột ngày không làm đổi giá trị (CAST sang DATE, chuẩn hóa chuỗi ngày...)
+_DATE_WRAPPERS = (exp.TsOrDsToTimestamp, exp.TsOrDsToDate, exp.TsOrDsToDatetime, exp.Cast, exp.TryCast)
+
+_fresh = {}
+_refresh_lock = threading.Lock()
+
+
+def _env_flag(name, default=True):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# --- TẠO & CẬP NHẬT ---
+
+def create_rollup_tables(engine):
+    """
+    Tạo bảng rollup + bảng watermark nếu chưa có (model nằm trong core/database.py).
+    """
+    tables = [Base.metadata.tables[ROLLUP_TABLE], Base.metadata.tables[STATE_TABLE]]
+    Base.metadata.create_all(engine, tables=tables)
+    invalidate_schema_cache(engine)
+
+
+def rollups_available(engine):
+    return ROLLUP_TABLE in get_schema_snapshot(engine).tables
+
+
+def _month_expr(dialect):
+    if dialect == "mssql":
+        return "DATEFROMPARTS(YEAR(date), MONTH(date), 1)"
+    if dialect == "sqlite":
+        return "strftime('%Y-%m-01', date)"
+    return "CAST(date_trunc('month', date) AS DATE)"
+
+
+def _delta_select(dialect):
+    """
+    Gộp các dòng nguồn trong khoảng id (lo, hi]. Dòng thiếu ngày / máy / kỹ sư không gộp được (đếm riêng).
+    """
+    status_sums = ", ".join(
+        f"SUM(CASE WHEN status = '{status}' THEN 1 ELSE 0 END) AS {column}"
+        for status, column in STATUS_COLUMNS.items()
+    )
+    return (
+        f"SELECT {_month_expr(dialect)} AS month, machine_id, technician_id, COUNT(*) AS log_count, "
+        f"COUNT(cost) AS cost_count, SUM(cost) AS total_cost, MIN(cost) AS min_cost, MAX(cost) AS max_cost, "
+        f"{status_sums} "
+        f"FROM {SOURCE_TABLE} "
+        f"WHERE id > :lo AND id <= :hi "
+        f"AND date IS NOT NULL AND machine_id IS NOT NULL AND technician_id IS NOT NULL "
+        f"GROUP BY {_month_expr(dialect)}, machine_id, technician_id"
+    )
+
+
+_MEASURES = ("log_count", "cost_count", "total_cost", "min_cost", "max_cost") + tuple(STATUS_COLUMNS.values())
+
+
+def _merge_value(column, old, new):
+    """
+    Cộng dồn 1 cột của rollup (giữ đúng ngữ nghĩa NULL của SUM/MIN/MAX).
+    """
+    if column == "total_cost":
+        return f"COALESCE({old}.total_cost + {new}.total_cost, {old}.total_cost, {new}.total_cost)"
+    if column == "min_cost":
+        return f"CASE WHEN {old}.min_cost IS NULL OR {new}.min_cost < {old}.min_cost THEN {new}.min_cost ELSE {old}.min_cost END"
+    if column == "max_cost":
+        return f"CASE WHEN {old}.max_cost IS NULL OR {new}.max_cost > {old}.max_cost THEN {new}.max_cost ELSE {old}.max_cost END"
+    return f"{old}.{column} + {new}.{column}"
+
+
+def _upsert_sql(dialect):
+    keys = ("month",) + DIMENSION_COLUMNS
+    columns = keys + _MEASURES
+    if dialect == "mssql":
+        updates = ", ".join(f"t.{c} = {_merge_value(c, 't', 's')}" for c in _MEASURES)
+        on = " AND ".join(f"t.{k} = s.{k}" for k in keys)
+        return (
+            f"MERGE {ROLLUP_TABLE} AS t USING ({_delta_select(dialect)}) AS s ON {on} "
+            f"WHEN MATCHED THEN UPDATE SET {updates} "
+            f"WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) VALUES ({', '.join('s.' + c for c in columns)});"
+        )
+    # SQLite / DuckDB / PostgreSQL: INSERT ... ON CONFLICT DO UPDATE
+    updates = ", ".join(f"{c} = {_merge_value(c, ROLLUP_TABLE, 'excluded')}" for c in _MEASURES)
+    return (
+        f"INSERT INTO {ROLLUP_TABLE} ({', '.join(columns)}) {_delta_select(dialect)} "
+        f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}"
+    )
+
+
+def _read_state(connection):
+    row = connection.execute(
+        text(f"SELECT last_id, source_rows, skipped_rows, refreshed_at FROM {STATE_TABLE} WHERE name = :name"),
+        {"name": ROLLUP_NAME},
+    ).fetchone()
+    if row is None:
+        return None
+    return {"last_id": row[0], "source_rows": row[1], "skipped_rows": row[2], "refreshed_at": row[3]}
+
+
+def _write_state(connection, state):
+    params = dict(state, name=ROLLUP_NAME)
+    updated = connection.execute(text(
+        f"UPDATE {STATE_TABLE} SET last_id = :last_id, source_rows = :source_rows, "
+        f"skipped_rows = :skipped_rows, refreshed_at = :refreshed_at WHERE name = :name"
+    ), params).rowcount
+    if not updated:
+        connection.execute(text(
+            f"INSERT INTO {STATE_TABLE} (name, last_id, source_rows, skipped_rows, refreshed_at) "
+            f"VALUES (:name, :last_id, :source_rows, :skipped_rows, :refreshed_at)"
+        ), params)
+
+
+def _count_range(connection, lo, hi):
+    """
+    (số dòng, số dòng không gộp được) trong khoảng id (lo, hi] - quét theo khóa chính.
+    """
+    row = connection.execute(text(
+        f"SELECT COUNT(*), SUM(CASE WHEN date IS NULL OR machine_id IS NULL OR technician_id IS NULL "
+        f"THEN 1 ELSE 0 END) FROM {SOURCE_TABLE} WHERE id > :lo AND id <= :hi"
+    ), {"lo": lo, "hi": hi}).fetchone()
+    return int(row[0] or 0), int(row[1] or 0)
+
+
+def refresh_rollups(engine, full=False):
+    """
+    Cập nhật rollup từ watermark (id lớn nhất đã gộp). Chạy trong 1 transaction: người đọc không bao giờ
+    thấy rollup gộp dở. Dựng lại toàn bộ khi:
+    - full=True, chưa có watermark, hoặc MAX(id) nguồn nhỏ hơn watermark (bảng bị xóa / nạp lại);
+    - số dòng có id <= watermark khác lúc gộp (có dòng cũ bị xóa).
+    Sửa (UPDATE) dòng cũ không tự phát hiện được -> chạy lại với full=True.
+    Trả về dict {mode, rows, last_id, source_rows, skipped_rows, refreshed_at, seconds}.
+    """
+    started = time.perf_counter()
+    dialect = engine.dialect.name
+    with _refresh_lock, engine.begin() as connection:
+        state = _read_state(connection)
+        max_id = int(connection.execute(text(f"SELECT MAX(id) FROM {SOURCE_TABLE}")).scalar() or 0)
+
+        mode = "incremental"
+        if full or state is None or max_id < state["last_id"]:
+            mode = "full"
+        elif state["last_id"] and _count_range(connection, 0, state["last_id"])[0] != state["source_rows"]:
+            print("⚠️ Rollup: dữ liệu cũ đã thay đổi, dựng lại toàn bộ.")
+            mode = "full"
+
+        if mode == "full":
+            connection.execute(text(f"DELETE FROM {ROLLUP_TABLE}"))
+            state = {"last_id": 0, "source_rows": 0, "skipped_rows": 0}
+
+        rows = 0
+        if max_id > state["last_id"]:
+            rows, skipped = _count_range(connection, state["last_id"], max_id)
+            connection.execute(text(_upsert_sql(dialect)), {"lo": state["last_id"], "hi": max_id})
+            state = {
+                "last_id": max_id,
+                "source_rows": state["source_rows"] + rows,
+                "skipped_rows": state["skipped_rows"] + skipped,
+            }
+        elif mode == "incremental":
+            mode = "noop"
+
+        state["refreshed_at"] = time.time()
+        _write_state(connection, state)
+
+    _fresh.pop(engine_cache_key(engine), None)
+    seconds = time.perf_counter() - started
+    if mode != "noop":
+        print(f"📦 Rollup ({mode}): gộp {rows:,} dòng mới, watermark id={state['last_id']} ({seconds:.2f}s).")
+    return dict(state, mode=mode, rows=rows, seconds=seconds)
+
+
+def ensure_fresh(engine):
+    """
+    Đảm bảo rollup đã gộp tới MAX(id) hiện tại (1 truy vấn rẻ theo khóa chính, tối đa 1 lần mỗi
+    ROLLUP_CHECK_INTERVAL giây). Trả về watermark (last_id) nếu rollup dùng được, ngược lại None.
+    ROLLUP_AUTO_REFRESH=0: không tự cập nhật, rollup cũ thì không dùng.
+    """
+    key = engine_cache_key(engine)
+    now = time.time()
+    cached = _fresh.get(key)
+    if cached is not None and now - cached[0] < _env_float("ROLLUP_CHECK_INTERVAL", 5):
+        return cached[1]
+
+    version = None
+    try:
+        with engine.connect() as connection:
+            state = _read_state(connection)
+            max_id = int(connection.execute(text(f"SELECT MAX(id) FROM {SOURCE_TABLE}")).scalar() or 0)
+        if (state is None or state["last_id"] != max_id) and _env_flag("ROLLUP_AUTO_REFRESH"):
+            state = refresh_rollups(engine)
+            max_id = state["last_id"]
+        # Có dòng không gộp được (thiếu ngày / máy / kỹ sư) thì rollup không thay được bảng gốc
+        if state is not None and state["last_id"] == max_id and not state["skipped_rows"]:
+            version = state["last_id"]
+    except Exception as e:
+        print(f"⚠️ Không cập nhật được rollup: {e}")
+
+    _fresh[key] = (now, version)
+    return version
+
+
+def reset_rollups(engine):
+    """
+    Xóa watermark -> lần cập nhật sau dựng lại toàn bộ (gọi sau khi nạp lại / sửa hàng loạt bảng nguồn).
+    """
+    with engine.begin() as connection:
+        connection.execute(text(f"DELETE FROM {STATE_TABLE} WHERE name = :name"), {"name": ROLLUP_NAME})
+    _fresh.pop(engine_cache_key(engine), None)
+
+
+# --- ROUTER: VIẾT LẠI SQL SANG ROLLUP ---
+
+class _NotRoutable(Exception):
+    pass
+
+
+def _unwrap(node):
+    """
+    Đi lên khỏi các hàm bọc không đổi giá trị (CAST, chuẩn hóa ngày) của 1 cột ngày.
+    """
+    while isinstance(node.parent, _DATE_WRAPPERS):
+        if isinstance(node.parent, (exp.Cast, exp.TryCast)) and not node.parent.to.is_type(
+            exp.DataType.Type.DATE, exp.DataType.Type.DATETIME, exp.DataType.Type.TIMESTAMP,
+            exp.DataType.Type.DATETIME2,
+        ):
+            break
+        node = node.parent
+    return node
+
+
+def _is_month_granular(node):
+    """
+    Hàm chỉ phụ thuộc vào tháng / năm của ngày (strftime('%Y-%m'), YEAR, MONTH, DATE_TRUNC('month')...).
+    """
+    if isinstance(node, (exp.Year, exp.Month, exp.Quarter)):
+        return True
+    if isinstance(node, exp.TimeToStr):
+        fmt = node.args.get("format")
+        tokens = re.findall(r"%(.)", fmt.name) if isinstance(fmt, exp.Literal) else []
+        return bool(tokens) and all(t in "YymbB" for t in tokens)
+    if isinstance(node, (exp.DateTrunc, exp.TimestampTrunc)):
+        return node.text("unit").upper() in _MONTH_UNITS
+    if isinstance(node, exp.Extract):
+        return node.this.name.upper() in _MONTH_UNITS
+    return False
+
+
+def _is_month_bound(column, wrapped):
+    """
+    So sánh trực tiếp cột ngày với ngày đầu tháng: date >= '2025-01-01' / date < '2025-02-01'
+    (hoặc viết ngược: '2025-01-01' <= date / '2025-02-01' > date). date > / <= ngày đầu tháng thì không.
+    """
+    parent = wrapped.parent
+    if parent.this is wrapped:
+        if not isinstance(parent, (exp.GTE, exp.LT)):
+            return False
+        other = parent.expression
+    else:
+        if not isinstance(parent, (exp.LTE, exp.GT)):
+            return False
+        other = parent.this
+    return isinstance(other, exp.Literal) and other.is_string and bool(_DATE_LITERAL_RE.match(other.name))
+
+
+def _count_target(count):
+    """
+    COUNT(*) / COUNT(id) / COUNT(dim): đếm số dòng. Trả về None với COUNT(DISTINCT ...) (giữ nguyên).
+    """
+    arg = count.this
+    if isinstance(arg, exp.Distinct):
+        return None
+    return arg
+
+
+def _resolve_owner(column, sources, snapshot, aliases=()):
+    """
+    Bảng (viết thường) của 1 cột: theo alias, hoặc theo schema nếu cột không ghi rõ bảng.
+    Tên alias của SELECT (ORDER BY total...) -> None.
+    """
+    if column.table:
+        source = sources.get(column.table.lower())
+        if source is None:
+            raise _NotRoutable()
+        return source
+    owners = [
+        name for name in dict.fromkeys(sources.values())
+        if column.name.lower() in {c.lower() for c in snapshot.column_names(_real_name(snapshot, name))}
+    ]
+    if not owners and column.name.lower() in aliases:
+        return None
+    if len(owners) != 1:
+        raise _NotRoutable()
+    return owners[0]
+
+
+def _real_name(snapshot, lower_name):
+    for name in snapshot.tables:
+        if name.lower() == lower_name:
+            return name
+    return lower_name
+
+
+def _check_joins(select, log_table):
+    """
+    Chỉ cho JOIN mà maintenance_logs không nằm ở phía bị NULL (LEFT JOIN vào logs thì COUNT sẽ sai).
+    """
+    for join in select.args.get("joins") or []:
+        side = join.text("side").upper()
+        if side in ("RIGHT", "FULL"):
+            raise _NotRoutable()
+        if side == "LEFT" and join.this is log_table:
+            raise _NotRoutable()
+
+
+def rewrite_for_rollup(sql_query, snapshot, dialect=None):
+    """
+    Viết lại câu SELECT tổng hợp trên maintenance_logs sang rollup_maintenance_monthly.
+    Trả về SQL mới, hoặc None nếu không chắc kết quả giống hệt (khi đó chạy câu gốc).
+    Điều kiện: 1 câu SELECT, không subquery/CTE/window; chỉ JOIN thêm machines/technicians;
+    cột của logs chỉ gồm machine_id, technician_id, date (ở mức tháng), cost trong SUM/AVG/MIN/MAX,
+    status chỉ trong điều kiện WHERE status = '...' khi chỉ đếm số dòng.
+    """
+    statements = parse_sql(sql_query, dialect)
+    if not statements or len(statements) != 1 or not isinstance(statements[0], exp.Select):
+        return None
+    select = statements[0].copy()
+    if any(select.find(node) for node in (exp.Subquery, exp.CTE, exp.SetOperation, exp.Window)):
+        return None
+    if not select.args.get("group") and not select.find(exp.AggFunc):
+        return None
+
+    tables = list(select.find_all(exp.Table))
+    log_tables = [t for t in tables if t.name.lower() == SOURCE_TABLE]
+    if len(log_tables) != 1 or any(t.name.lower() not in (SOURCE_TABLE, "machines", "technicians") for t in tables):
+        return None
+    log_table = log_tables[0]
+    sources = {t.alias_or_name.lower(): t.name.lower() for t in tables}
+
+    try:
+        _check_joins(select, log_table)
+        replacements, status_predicate = _plan_rewrite(select, sources, snapshot)
+    except _NotRoutable:
+        return None
+
+    # Cột kết quả không có alias chứa phần bị thay: giữ tên cột người dùng thấy (COUNT(*), không phải
+    # SUM(maintenance_logs.log_count)) -> alias bằng chính biểu thức gốc
+    replaced = {id(node) for node, _ in replacements}
+    select.set("expressions", [
+        exp.alias_(expression, expression.sql(dialect=dialect), quoted=True, copy=False)
+        if not isinstance(expression, exp.Alias) and any(id(node) in replaced for node in expression.walk())
+        else expression
+        for expression in select.expressions
+    ])
+    for node, new in replacements:
+        node.replace(new)
+    if status_predicate is not None:
+        _drop_predicate(status_predicate)
+    if not log_table.alias:
+        # Giữ tham chiếu dạng maintenance_logs.cost hợp lệ sau khi đổi bảng
+        log_table.set("alias", exp.TableAlias(this=exp.to_identifier(log_table.name)))
+    log_table.set("this", exp.to_identifier(ROLLUP_TABLE))
+    return select.sql(dialect=dialect)
+
+
+def _plan_rewrite(select, sources, snapshot):
+    """
+    Duyệt các cột của maintenance_logs, trả về danh sách (node cũ, node mới). Raise _NotRoutable nếu có
+    cột / phép tính không suy ra được từ rollup.
+    """
+    replacements = []
+    aliases = {e.alias.lower() for e in select.expressions if e.alias}
+    status_column = None
+    count_nodes = []
+    cost_aggregates = []
+
+    # WHERE status = 'Failed' (điều kiện AND cấp cao nhất) -> đếm bằng cột failed_count, bỏ điều kiện
+    where = select.args.get("where")
+    conjuncts = list(where.this.flatten()) if where is not None and isinstance(where.this, exp.And) else (
+        [where.this] if where is not None else []
+    )
+    status_predicate = None
+    for conjunct in conjuncts:
+        if (
+            isinstance(conjunct, exp.EQ)
+            and isinstance(conjunct.this, exp.Column)
+            and conjunct.this.name.lower() == "status"
+            and isinstance(conjunct.expression, exp.Literal)
+            and conjunct.expression.name in STATUS_COLUMNS
+            and _resolve_owner(conjunct.this, sources, snapshot, aliases) == SOURCE_TABLE
+        ):
+            if status_predicate is not None:
+                raise _NotRoutable()
+            status_predicate = conjunct
+            status_column = STATUS_COLUMNS[conjunct.expression.name]
+
+    rollup_only = {c.lower() for c in snapshot.column_names(ROLLUP_TABLE)} - {
+        c.lower() for c in snapshot.column_names(_real_name(snapshot, SOURCE_TABLE))
+    }
+    for column in list(select.find_all(exp.Column)):
+        owner = _resolve_owner(column, sources, snapshot, aliases)
+        if owner is None and column.name.lower() in rollup_only and not column.find_ancestor(exp.Order):
+            # GROUP BY month (alias) sẽ bị hiểu thành cột month của rollup
+            raise _NotRoutable()
+        if owner != SOURCE_TABLE:
+            continue
+        name = column.name.lower()
+        agg = column.find_ancestor(exp.AggFunc)
+
+        if status_predicate is not None and column.find_ancestor(exp.EQ) is status_predicate:
+            continue
+        if name in DIMENSION_COLUMNS:
+            if isinstance(agg, exp.Count) and _count_target(agg) is column:
+                count_nodes.append(agg)
+            elif agg is not None and not isinstance(agg, (exp.Count, exp.Min, exp.Max)):
+                raise _NotRoutable()  # SUM/AVG(machine_id) không suy ra được
+        elif name == "id":
+            if not (isinstance(agg, exp.Count) and (agg.this is column or isinstance(agg.this, exp.Distinct))):
+                raise _NotRoutable()
+            count_nodes.append(agg)  # id duy nhất -> COUNT(DISTINCT id) cũng là số dòng
+        elif name == "cost":
+            if agg is None or agg.this is not column or not isinstance(agg, (exp.Sum, exp.Avg, exp.Min, exp.Max, exp.Count)):
+                raise _NotRoutable()
+            cost_aggregates.append(agg)
+        elif name == "date":
+            wrapped = _unwrap(column)
+            if not (_is_month_granular(wrapped.parent) or _is_month_bound(column, wrapped)):
+                raise _NotRoutable()
+            replacements.append((column, exp.column("month", table=column.table or None)))
+        else:
+            raise _NotRoutable()  # description, status ở chỗ khác...
+
+    for count in select.find_all(exp.Count):
+        if isinstance(count.this, exp.Star):
+            count_nodes.append(count)
+
+    # Hàm gộp không dùng cột nào của maintenance_logs (COUNT(1), SUM(1), COUNT(m.name)...) sẽ đếm / cộng theo
+    # dòng rollup thay vì dòng nhật ký: COUNT(<hằng số>) = số dòng, MIN/MAX không phụ thuộc số lần lặp, còn lại bỏ
+    checked = {id(node) for node in count_nodes + cost_aggregates}
+    for agg in select.find_all(exp.AggFunc):
+        if id(agg) in checked or any(
+            _resolve_owner(column, sources, snapshot, aliases) == SOURCE_TABLE for column in agg.find_all(exp.Column)
+        ):
+            continue  # Đã kiểm tra ở vòng duyệt cột bên trên
+        if isinstance(agg, exp.Count) and isinstance(agg.this, exp.Literal):
+            count_nodes.append(agg)
+        elif not isinstance(agg, (exp.Min, exp.Max)):
+            raise _NotRoutable()
+    if status_predicate is not None and cost_aggregates:
+        raise _NotRoutable()  # rollup chỉ có số lần theo status, không có chi phí theo status
+
+    qualifier = _log_qualifier(select)
+    count_column = status_column or "log_count"
+    # Bỏ trùng theo đối tượng (không theo nội dung): COUNT(*) ở SELECT và ở HAVING / ORDER BY là 2 node
+    # bằng nhau về cấu trúc nhưng đều phải được thay
+    for count in {id(node): node for node in count_nodes}.values():
+        if count.find_ancestor(exp.AggFunc):
+            raise _NotRoutable()
+        replacements.append((count, exp.Sum(this=exp.column(count_column, table=qualifier))))
+    for agg in cost_aggregates:
+        replacements.append((agg, _rollup_cost_aggregate(agg, qualifier)))
+
+    return replacements, status_predicate
+
+
+def _drop_predicate(predicate):
+    """
+    Bỏ 1 điều kiện AND khỏi WHERE (bỏ luôn WHERE nếu chỉ còn điều kiện đó).
+    """
+    parent = predicate.parent
+    if isinstance(parent, exp.And):
+        other = parent.expression if parent.this is predicate else parent.this
+        parent.replace(other)
+    elif isinstance(parent, exp.Where):
+        parent.pop()
+
+
+def _log_qualifier(select):
+    for table in select.find_all(exp.Table):
+        if table.name.lower() == SOURCE_TABLE:
+            return table.alias_or_name
+    return None
+
+
+def _rollup_cost_aggregate(agg, qualifier):
+    col = lambda name: exp.column(name, table=qualifier)
+    if isinstance(agg, exp.Sum):
+        return exp.Sum(this=col("total_cost"))
+    if isinstance(agg, exp.Min):
+        return exp.Min(this=col("min_cost"))
+    if isinstance(agg, exp.Max):
+        return exp.Max(this=col("max_cost"))
+    if isinstance(agg, exp.Count):
+        return exp.Sum(this=col("cost_count"))
+    # AVG(cost) = tổng chi phí / số dòng có cost
+    return exp.Div(
+        this=exp.Sum(this=col("total_cost")),
+        expression=exp.Nullif(this=exp.Sum(this=col("cost_count")), expression=exp.Literal.number(0)),
+    )
+
+
+def route_query(sql_query, engine):
+    """
+    Gọi từ execute_sql trước khi chạy. Trả về (SQL sẽ chạy, watermark rollup) nếu dùng rollup
+    (câu được viết lại, hoặc AI đã dùng thẳng bảng rollup), ngược lại None.
+    Watermark đưa vào khóa cache kết quả để cache tự hết hiệu lực khi rollup được cập nhật.
+    Tắt bằng ROLLUPS_ENABLED=0. ROLLUPS_AUTO_CREATE=1: tự tạo bảng rollup nếu DB chưa có.
+    """
+    if not _env_flag("ROLLUPS_ENABLED"):
+        return None
+    lowered = sql_query.lower()
+    if SOURCE_TABLE not in lowered and ROLLUP_TABLE not in lowered:
+        return None
+
+    try:
+        if not rollups_available(engine):
+            if not _env_flag("ROLLUPS_AUTO_CREATE", False):
+                return None
+            create_rollup_tables(engine)
+
+        if ROLLUP_TABLE in lowered:
+            version = ensure_fresh(engine)
+            return (sql_query, version) if version is not None else None
+
+        dialect = get_sqlglot_dialect(engine)
+        rewritten = rewrite_for_rollup(sql_query, get_schema_snapshot(engine), dialect)
+        if rewritten is None:
+            return None
+        version = ensure_fresh(engine)
+        if version is None:
+            return None
+    except Exception as e:
+        print(f"⚠️ Bỏ qua rollup: {e}")
+        return None
+
+    print(f"📦 Dùng bảng tổng hợp {ROLLUP_TABLE} thay vì quét {SOURCE_TABLE}.")
+    return rewritten, version
+
+
+def rollup_prompt_hint(schema_text):
+    """
+    Quy tắc thêm vào prompt khi schema gửi cho AI có bảng rollup.
+    """
+    if f"Table: {ROLLUP_TABLE}" not in schema_text:
+        return []
+    return [
+        f"Bảng {ROLLUP_TABLE} là {SOURCE_TABLE} đã gộp sẵn theo (month, machine_id, technician_id), "
+        "month là ngày đầu tháng. Câu hỏi tổng hợp theo tháng / máy / kỹ sư hãy ưu tiên bảng này: "
+        "COUNT(*) -> SUM(log_count), SUM(cost) -> SUM(total_cost), "
+        "AVG(cost) -> SUM(total_cost) / NULLIF(SUM(cost_count), 0), số lần theo trạng thái -> "
+        "SUM(success_count) / SUM(pending_count) / SUM(failed_count).",
+        f"Chỉ dùng {SOURCE_TABLE} khi cần ngày cụ thể, mô tả hoặc từng lần bảo trì.",
+    ]
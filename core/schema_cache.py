@@ -0,0 +1,284 @@
+import os
+import time
+import hashlib
+import threading
+from sqlalchemy import inspect, text
+
+# --- SCHEMA CACHE ---
+# Lưu snapshot schema (bảng, cột, khóa ngoại, index, ước lượng số dòng) dùng chung cho mọi engine/session.
+# Chỉ quét lại bằng inspect() khi "dấu vân tay" schema thay đổi (hoặc hết TTL nếu DB không hỗ trợ).
+# Bảng nội bộ của agent (VD: watermark của rollup) không đưa vào schema
+INTERNAL_TABLE_PREFIX = "_agent_"
+
+_snapshots = {}
+_last_checked = {}
+_cache_lock = threading.Lock()
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class SchemaSnapshot:
+    """
+    Ảnh chụp schema tại 1 thời điểm.
+    tables: {table_name: {"columns", "foreign_keys", "indexes", "row_estimate"}} (+ "view" với DuckDB)
+    """
+    def __init__(self, tables, fingerprint):
+        self.tables = tables
+        self.fingerprint = fingerprint
+        self.loaded_at = time.time()
+        self.schema_text = self.to_schema_string()
+        # Hash theo nội dung (ổn định giữa các lần khởi động) để làm khóa cache ở các tầng trên
+        self.schema_hash = hashlib.sha256(self.schema_text.encode("utf-8")).hexdigest()[:16]
+
+    def table_names(self):
+        return list(self.tables.keys())
+
+    def column_names(self, table_name):
+        table = self.tables.get(table_name)
+        if table is None:
+            return []
+        return [col["name"] for col in table["columns"]]
+
+    def to_schema_string(self, table_names=None):
+        """
+        Render schema dạng text cho prompt (cùng định dạng với get_schema_string cũ).
+        table_names: chỉ render các bảng này (None = tất cả).
+        """
+        schema_lines = []
+        for table_name, table in self.tables.items():
+            if table_names is not None and table_name not in table_names:
+                continue
+            # Lấy tên cột và kiểu dữ liệu (VD: id (INTEGER), name (VARCHAR))
+            col_desc = [f"{col['name']} ({col['type']})" for col in table["columns"]]
+            schema_lines.append(f"Table: {table_name}")
+            schema_lines.append(f"Columns: {', '.join(col_desc)}")
+            schema_lines.append("")
+        return "\n".join(schema_lines)
+
+
+def engine_cache_key(engine):
+    """
+    Khóa cache theo URL của DB: các engine cùng trỏ tới 1 DB dùng chung snapshot.
+    SQLite in-memory thì mỗi engine là 1 DB riêng nên phải thêm id(engine).
+    """
+    url = engine.url
+    key = url.render_as_string(hide_password=False)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        key = f"{key}#{id(engine)}"
+    return key
+
+
+def get_schema_fingerprint(connection):
+    """
+    Dấu vân tay schema rẻ (1 truy vấn nhỏ). Trả về None nếu DB không hỗ trợ -> dùng TTL.
+    """
+    dialect = connection.dialect.name
+    try:
+        if dialect == "sqlite":
+            return ("sqlite", connection.execute(text("PRAGMA schema_version")).scalar())
+        if dialect == "mssql":
+            row = connection.execute(text(
+                "SELECT COUNT(*), MAX(modify_date) FROM sys.objects WHERE type IN ('U', 'V')"
+            )).fetchone()
+            return ("mssql", row[0], str(row[1]))
+        if dialect == "duckdb":
+            # Không có số phiên bản schema -> băm danh sách (bảng/view, cột, kiểu) và định nghĩa view
+            row = connection.execute(text(
+                "SELECT md5(string_agg(table_name || '.' || column_name || ':' || data_type, ','"
+                " ORDER BY table_name, column_index)), (SELECT md5(string_agg(sql, ';' ORDER BY view_name))"
+                " FROM duckdb_views() WHERE NOT internal) FROM duckdb_columns() WHERE NOT internal"
+            )).fetchone()
+            return ("duckdb", row[0], row[1])
+    except Exception as e:
+        print(f"⚠️ Không lấy được schema fingerprint: {e}")
+    return None
+
+
+def _estimate_row_counts(connection, table_names):
+    """
+    Ước lượng số dòng mỗi bảng (không COUNT(*) toàn bảng).
+    """
+    dialect = connection.dialect.name
+    estimates = {}
+    try:
+        if dialect == "mssql":
+            rows = connection.execute(text(
+                "SELECT t.name, SUM(p.rows) FROM sys.tables t "
+                "JOIN sys.partitions p ON p.object_id = t.object_id AND p.index_id IN (0, 1) "
+                "GROUP BY t.name"
+            )).fetchall()
+            estimates = {name: int(count) for name, count in rows}
+        elif dialect == "sqlite":
+            # Ưu tiên thống kê của ANALYZE (sqlite_stat1), nếu không có thì dùng MAX(rowid)
+            stat_rows = []
+            if connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+            )).fetchone():
+                stat_rows = connection.execute(text(
+                    "SELECT tbl, stat FROM sqlite_stat1 WHERE idx IS NULL OR idx = tbl"
+                )).fetchall()
+            for tbl, stat in stat_rows:
+                estimates[tbl] = int(str(stat).split()[0])
+
+            quote = connection.dialect.identifier_preparer.quote
+            for table_name in table_names:
+                if table_name in estimates:
+                    continue
+                try:
+                    value = connection.execute(text(f"SELECT MAX(rowid) FROM {quote(table_name)}")).scalar()
+                    estimates[table_name] = int(value or 0)
+                except Exception:
+                    estimates[table_name] = None
+    except Exception as e:
+        print(f"⚠️ Không ước lượng được số dòng: {e}")
+    return estimates
+
+
+def _table_comment(inspector, table_name):
+    try:
+        return (inspector.get_table_comment(table_name) or {}).get("text")
+    except NotImplementedError:
+        return None
+
+
+def _introspect_duckdb(connection, fingerprint):
+    """
+    DuckDB: đọc thẳng catalog (duckdb_columns / duckdb_constraints...), không qua inspect() của
+    duckdb-engine (dựa trên pg_catalog giả lập, lỗi với một số bản SQLAlchemy).
+    View (VD: file CSV/Parquet upload) được coi như bảng, đánh dấu "view": True.
+    """
+    tables = {}
+    for table_name, is_view, estimate, comment in connection.execute(text(
+        "SELECT table_name, FALSE, estimated_size, comment FROM duckdb_tables() WHERE NOT internal"
+        " UNION ALL SELECT view_name, TRUE, NULL, comment FROM duckdb_views() WHERE NOT internal"
+        " ORDER BY 1"
+    )).fetchall():
+        if table_name.startswith(INTERNAL_TABLE_PREFIX):
+            continue
+        tables[table_name] = {
+            "columns": [], "primary_key": [], "foreign_keys": [], "indexes": [],
+            "row_estimate": int(estimate) if estimate is not None else None,
+            "comment": comment, "view": bool(is_view),
+        }
+
+    for table_name, name, col_type, nullable, comment in connection.execute(text(
+        "SELECT table_name, column_name, data_type, is_nullable, comment FROM duckdb_columns()"
+        " WHERE NOT internal ORDER BY table_name, column_index"
+    )).fetchall():
+        if table_name in tables:
+            tables[table_name]["columns"].append(
+                {"name": name, "type": col_type, "nullable": bool(nullable), "comment": comment}
+            )
+
+    for table_name, kind, columns, referred_table, referred_columns in connection.execute(text(
+        "SELECT table_name, constraint_type, constraint_column_names, referenced_table, referenced_column_names"
+        " FROM duckdb_constraints() WHERE constraint_type IN ('PRIMARY KEY', 'FOREIGN KEY')"
+    )).fetchall():
+        if table_name not in tables:
+            continue
+        if kind == "PRIMARY KEY":
+            tables[table_name]["primary_key"] = list(columns)
+            tables[table_name]["indexes"].append({"name": f"pk_{table_name}", "columns": list(columns), "unique": True})
+        else:
+            tables[table_name]["foreign_keys"].append({
+                "columns": list(columns), "referred_table": referred_table, "referred_columns": list(referred_columns),
+            })
+    return SchemaSnapshot(tables, fingerprint)
+
+
+def _introspect(connection, fingerprint):
+    """
+    Quét đầy đủ schema bằng SQLAlchemy inspect() (chậm, chỉ chạy khi schema đổi).
+    """
+    if connection.dialect.name == "duckdb":
+        return _introspect_duckdb(connection, fingerprint)
+    inspector = inspect(connection)
+    table_names = [t for t in inspector.get_table_names() if not t.startswith(INTERNAL_TABLE_PREFIX)]
+    row_estimates = _estimate_row_counts(connection, table_names)
+
+    tables = {}
+    for table_name in table_names:
+        columns = inspector.get_columns(table_name)
+        pk = inspector.get_pk_constraint(table_name) or {}
+        tables[table_name] = {
+            "columns": [
+                {
+                    "name": col["name"],
+                    "type": str(col["type"]),
+                    "nullable": col.get("nullable", True),
+                    "comment": col.get("comment"),
+                }
+                for col in columns
+            ],
+            "primary_key": pk.get("constrained_columns") or [],
+            "foreign_keys": [
+                {
+                    "columns": fk["constrained_columns"],
+                    "referred_table": fk["referred_table"],
+                    "referred_columns": fk["referred_columns"],
+                }
+                for fk in inspector.get_foreign_keys(table_name)
+            ],
+            "indexes": [
+                {"name": idx["name"], "columns": idx["column_names"], "unique": bool(idx.get("unique"))}
+                for idx in inspector.get_indexes(table_name)
+            ],
+            "row_estimate": row_estimates.get(table_name),
+            "comment": _table_comment(inspector, table_name),
+        }
+    return SchemaSnapshot(tables, fingerprint)
+
+
+def get_schema_snapshot(engine, force_refresh=False):
+    """
+    Lấy snapshot schema từ cache, chỉ quét lại khi:
+    - fingerprint thay đổi (SQLite PRAGMA schema_version, SQL Server sys.objects.modify_date,
+      DuckDB: hash danh sách cột), hoặc
+    - hết TTL (SCHEMA_CACHE_TTL, giây) với DB không có fingerprint.
+    SCHEMA_CHECK_INTERVAL: khoảng thời gian (giây) bỏ qua cả bước kiểm tra fingerprint.
+    """
+    key = engine_cache_key(engine)
+    ttl = _env_float("SCHEMA_CACHE_TTL", 300)
+    check_interval = _env_float("SCHEMA_CHECK_INTERVAL", 5)
+    now = time.time()
+
+    snapshot = _snapshots.get(key)
+    if snapshot is not None and not force_refresh and now - _last_checked.get(key, 0) < check_interval:
+        return snapshot
+
+    with _cache_lock:
+        snapshot = _snapshots.get(key)
+        with engine.connect() as connection:
+            fingerprint = get_schema_fingerprint(connection)
+
+            if snapshot is not None and not force_refresh:
+                if fingerprint is not None and fingerprint == snapshot.fingerprint:
+                    _last_checked[key] = now
+                    return snapshot
+                if fingerprint is None and now - snapshot.loaded_at < ttl:
+                    _last_checked[key] = now
+                    return snapshot
+
+            print("🔍 Đang quét schema Database...")
+            snapshot = _introspect(connection, fingerprint)
+
+        _snapshots[key] = snapshot
+        _last_checked[key] = now
+        return snapshot
+
+
+def invalidate_schema_cache(engine=None):
+    """
+    Xóa snapshot của 1 engine (hoặc toàn bộ nếu engine=None).
+    """
+    with _cache_lock:
+        if engine is None:
+            _snapshots.clear()
+            _last_checked.clear()
+        else:
+            key = engine_cache_key(engine)
+            _snapshots.pop(key, None)
+            _last_checked.pop(key, None)
@@ -0,0 +1,268 @@
+import os
+import re
+import math
+import threading
+from collections import deque
+from core.query_cache import normalize_question
+
+# --- SCHEMA LINKING ---
+# Với DB lớn (hàng trăm bảng), dán toàn bộ schema vào prompt tốn hàng chục nghìn token mỗi lần gọi AI.
+# Module này dựng index local trên tên bảng/cột, comment và khóa ngoại, chọn ra các bảng liên quan
+# tới câu hỏi + các bảng trung gian để JOIN, rồi chỉ đưa phần schema đó vào prompt.
+
+# Từ khóa tiếng Việt (đã bỏ dấu) -> từ tiếng Anh thường gặp trong tên bảng/cột
+SYNONYMS = {
+    "may": ["machine"],
+    "may moc": ["machine"],
+    "thiet bi": ["machine", "device", "equipment"],
+    "model": ["model"],
+    "ky su": ["technician", "engineer"],
+    "ky thuat vien": ["technician"],
+    "tho": ["technician"],
+    "nhan vien": ["technician", "employee", "staff"],
+    "bao tri": ["maintenance", "log"],
+    "bao duong": ["maintenance", "log"],
+    "sua": ["maintenance", "log"],
+    "sua chua": ["maintenance", "log"],
+    "nhat ky": ["log"],
+    "lich su": ["log", "history"],
+    "chi phi": ["cost"],
+    "tien": ["cost", "amount", "price"],
+    "ton": ["cost"],
+    "gia": ["price", "cost"],
+    "trang thai": ["status"],
+    "tinh trang": ["status"],
+    "ngay": ["date"],
+    "thang": ["date", "month"],
+    "nam": ["date", "year"],
+    "thoi gian": ["date", "time"],
+    "gan day": ["date"],
+    "vi tri": ["location"],
+    "khu vuc": ["location", "area", "region"],
+    "xuong": ["location"],
+    "lap dat": ["install"],
+    "kinh nghiem": ["experience"],
+    "chuyen mon": ["specialty"],
+    "mo ta": ["description"],
+    "loi": ["description", "error"],
+    "hong": ["description", "status"],
+    "ten": ["name"],
+    "khach hang": ["customer"],
+    "don hang": ["order"],
+    "san pham": ["product"],
+    "doanh thu": ["revenue", "amount", "sales"],
+}
+
+# Trọng số khi 1 từ khớp với tên bảng / tên cột / comment
+TABLE_WEIGHT = 3.0
+COLUMN_WEIGHT = 1.0
+COMMENT_WEIGHT = 0.5
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Ước lượng số token (~4 ký tự / token), đủ để so sánh trước/sau khi cắt schema.
+    """
+    return max(1, len(text) // 4) if text else 0
+
+
+def _singular(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def split_identifier(name: str):
+    """
+    Tách tên bảng/cột thành các từ: "MaintenanceLogs" / "maintenance_logs" -> ["maintenance", "log"].
+    """
+    name = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", name)
+    return [_singular(w) for w in re.split(r"[^0-9a-zA-Z]+", name.lower()) if w and not w.isdigit()]
+
+
+def question_terms(question: str):
+    """
+    Các từ khóa của câu hỏi: từ gốc (bỏ dấu) + từ tiếng Anh suy ra từ SYNONYMS (khớp cụm 1-3 từ).
+    """
+    words = normalize_question(question).split()
+    terms = {_singular(w) for w in words if not w.isdigit()}
+    for size in (1, 2, 3):
+        for i in range(len(words) - size + 1):
+            terms.update(_singular(w) for w in SYNONYMS.get(" ".join(words[i:i + size]), []))
+    return terms
+
+
+class SchemaIndex:
+    """
+    Index ngược: từ -> {bảng: trọng số}, kèm đồ thị khóa ngoại (vô hướng) để tìm đường JOIN.
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.postings = {}
+        self.graph = {name: set() for name in snapshot.table_names()}
+
+        for table_name, table in snapshot.tables.items():
+            self._add(split_identifier(table_name), table_name, TABLE_WEIGHT)
+            self._add(_comment_words(table.get("comment")), table_name, COMMENT_WEIGHT)
+            for col in table["columns"]:
+                self._add(split_identifier(col["name"]), table_name, COLUMN_WEIGHT)
+                self._add(_comment_words(col.get("comment")), table_name, COMMENT_WEIGHT)
+            for fk in table.get("foreign_keys", []):
+                referred = fk["referred_table"]
+                if referred in self.graph and referred != table_name:
+                    self.graph[table_name].add(referred)
+                    self.graph[referred].add(table_name)
+
+    def _add(self, words, table_name, weight):
+        for word in words:
+            tables = self.postings.setdefault(word, {})
+            tables[table_name] = max(tables.get(table_name, 0.0), weight)
+
+    def score_tables(self, terms):
+        """
+        Điểm liên quan của từng bảng. Từ xuất hiện ở nhiều bảng (id, name...) được tính ít điểm hơn.
+        """
+        total = len(self.graph) or 1
+        scores = {}
+        for term in terms:
+            tables = self.postings.get(term)
+            if not tables:
+                continue
+            idf = math.log(1 + total / len(tables))
+            for table_name, weight in tables.items():
+                scores[table_name] = scores.get(table_name, 0.0) + weight * idf
+        return scores
+
+    def join_path(self, connected, target):
+        """
+        Đường ngắn nhất (BFS theo khóa ngoại) từ nhóm bảng đã chọn tới bảng target.
+        """
+        queue = deque((table, [table]) for table in connected)
+        seen = set(connected)
+        while queue:
+            table, path = queue.popleft()
+            if table == target:
+                return path
+            for neighbor in self.graph.get(table, ()):
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    queue.append((neighbor, path + [neighbor]))
+        return [target]
+
+
+def _comment_words(comment):
+    if not comment:
+        return []
+    return [_singular(w) for w in normalize_question(comment).split()]
+
+
+def get_schema_index(snapshot):
+    """
+    Index dùng chung theo schema_hash (chỉ dựng lại khi schema thay đổi).
+    """
+    index = _indexes.get(snapshot.schema_hash)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(snapshot.schema_hash)
+            if index is None:
+                index = SchemaIndex(snapshot)
+                _indexes[snapshot.schema_hash] = index
+    return index
+
+
+def select_tables(question: str, snapshot, extra_tables=None, max_tables=None):
+    """
+    Chọn các bảng liên quan tới câu hỏi + bảng trung gian để JOIN.
+    extra_tables: bảng bắt buộc giữ (VD: bảng có trong câu SQL lỗi cần sửa).
+    Trả về [] nếu không khớp được bảng nào (caller dùng toàn bộ schema).
+    """
+    max_tables = max_tables or _env_int("SCHEMA_LINK_MAX_TABLES", 12)
+    index = get_schema_index(snapshot)
+    scores = index.score_tables(question_terms(question))
+
+    ranked = sorted(scores, key=lambda t: (-scores[t], t))
+    if ranked:
+        # Bỏ các bảng điểm quá thấp so với bảng khớp nhất
+        best = scores[ranked[0]]
+        ranked = [t for t in ranked if scores[t] >= best * 0.3][:max_tables]
+
+    seeds = list(dict.fromkeys([t for t in (extra_tables or []) if t in index.graph] + ranked))
+    if not seeds:
+        return []
+
+    selected = [seeds[0]]
+    for table in seeds[1:]:
+        if table in selected:
+            continue
+        for step in index.join_path(selected, table):
+            if step not in selected:
+                selected.append(step)
+    return selected
+
+
+def render_schema(snapshot, table_names):
+    """
+    Schema text của các bảng đã chọn + danh sách quan hệ khóa ngoại giữa chúng (gợi ý JOIN cho AI).
+    """
+    schema_text = snapshot.to_schema_string(set(table_names))
+    relations = []
+    for table_name in table_names:
+        for fk in snapshot.tables[table_name].get("foreign_keys", []):
+            if fk["referred_table"] in table_names:
+                for col, ref_col in zip(fk["columns"], fk["referred_columns"]):
+                    relations.append(f"{table_name}.{col} -> {fk['referred_table']}.{ref_col}")
+    if relations:
+        schema_text += "\nRelationships:\n" + "\n".join(relations) + "\n"
+    return schema_text
+
+
+def link_schema(question: str, snapshot, extra_tables=None):
+    """
+    Input: câu hỏi + schema snapshot.
+    Output: dict {schema_text, tables, pruned, full_tokens, prompt_tokens, saved_tokens}.
+    Chỉ cắt schema khi DB có nhiều hơn SCHEMA_LINK_MIN_TABLES bảng (mặc định 8), DB nhỏ dùng nguyên schema.
+    """
+    full_text = snapshot.schema_text
+    full_tokens = estimate_tokens(full_text)
+    report = {
+        "schema_text": full_text,
+        "tables": snapshot.table_names(),
+        "pruned": False,
+        "full_tokens": full_tokens,
+        "prompt_tokens": full_tokens,
+        "saved_tokens": 0,
+    }
+
+    if len(snapshot.tables) <= _env_int("SCHEMA_LINK_MIN_TABLES", 8):
+        return report
+
+    tables = select_tables(question, snapshot, extra_tables)
+    if not tables:
+        print("✂️ Schema linking: không khớp được bảng nào, dùng toàn bộ schema.")
+        return report
+
+    schema_text = render_schema(snapshot, tables)
+    prompt_tokens = estimate_tokens(schema_text)
+    report.update({
+        "schema_text": schema_text,
+        "tables": tables,
+        "pruned": True,
+        "prompt_tokens": prompt_tokens,
+        "saved_tokens": max(0, full_tokens - prompt_tokens),
+    })
+    saved_pct = 100 * report["saved_tokens"] / full_tokens if full_tokens else 0
+    print(
+        f"✂️ Schema linking: {len(tables)}/{len(snapshot.tables)} bảng ({', '.join(tables)}), "
+        f"~{full_tokens} -> ~{prompt_tokens} tokens (tiết kiệm {saved_pct:.0f}%)."
+    )
+    return report
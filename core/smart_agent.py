@@ -1,67 +1,118 @@
+import time
 import pandas as pd
-from core.sql_generator import generate_sql, fix_sql_query
-from core.sql_executor import execute_sql
-from core.forecaster import forecast_data # Import mới
-
-def process_question_with_retry(question: str, engine=None, max_retries=3):
-    
-    # --- LOGIC ROUTER: PHÁT HIỆN DỰ BÁO ---
-    is_forecasting = False
-    keywords = ["dự báo", "tương lai", "forecast", "xu hướng", "sắp tới"]
-    if any(k in question.lower() for k in keywords):
-        is_forecasting = True
-        print("🔮 Phát hiện yêu cầu DỰ BÁO. Đang chuyển mode...")
-        
-        # PROMPT ENGINEERING KỸ THUẬT CAO:
-        # Biến câu hỏi dự báo thành câu lệnh lấy dữ liệu lịch sử để train
-        # VD: "Dự báo chi phí tháng sau" -> "Lấy tổng chi phí theo từng tháng trong quá khứ"
-        question = f"""
+from core.sql_generator import generate_sql, fix_sql_query, remember_sql, forget_sql
+from core.sql_executor import execute_sql, QueryTimeout, QueryCancelled
+from core.forecast_cache import fetch_forecast_history
+from core.forecaster import forecast_data, forecast_grouped, find_date_columns, find_forecast_columns
+from core.database import init_db
+from core.schema_cache import get_schema_snapshot
+from core.sql_validator import validate_sql, format_validation_errors
+from core.dialect import get_sqlglot_dialect
+from core.tracing import span
+
+FORECAST_KEYWORDS = ["dự báo", "tương lai", "forecast", "xu hướng", "sắp tới"]
+
+
+def prepare_question(question: str):
+    """
+    LOGIC ROUTER: phát hiện câu hỏi dự báo.
+    Output: (câu hỏi gửi cho AI, is_forecasting)
+    """
+    if not any(k in question.lower() for k in FORECAST_KEYWORDS):
+        return question, False
+
+    print("🔮 Phát hiện yêu cầu DỰ BÁO. Đang chuyển mode...")
+
+    # PROMPT ENGINEERING KỸ THUẬT CAO:
+    # Biến câu hỏi dự báo thành câu lệnh lấy dữ liệu lịch sử để train
+    # VD: "Dự báo chi phí tháng sau" -> "Lấy tổng chi phí theo từng tháng trong quá khứ"
+    question = f"""
         User muốn: "{question}".
         Để dự báo được, tôi cần dữ liệu lịch sử.
-        Hãy viết SQL Server query để lấy dữ liệu lịch sử theo thời gian (Group by Month hoặc Day).
+        Hãy viết SQL query (đúng cú pháp của Database hiện tại) để lấy dữ liệu lịch sử theo thời gian (Group by Month hoặc Day).
         Cần 2 cột: Time (Date) và Value (Number).
+        Nếu User muốn dự báo theo từng nhóm (từng máy, khu vực, kỹ sư...), thêm cột tên nhóm và Group by cả nhóm.
         Sắp xếp theo thời gian tăng dần.
         """
+    return question, True
 
-    # --- LOGIC CŨ (VÒNG LẶP SỬA LỖI) ---
-    current_sql = ""
-    last_error = ""
-    result_df = None
-    
-    for attempt in range(1, max_retries + 1):
-        # ... (Code vòng lặp cũ giữ nguyên) ...
-        # ... (Copy đoạn code sinh SQL và Execute ở Level 2 vào đây) ...
-        
-        # Tạm viết lại đoạn ngắn gọn để bạn dễ hình dung vị trí chèn:
-        if attempt == 1:
-            current_sql = generate_sql(question, engine)
-        else:
-            current_sql = fix_sql_query(question, current_sql, last_error, engine)
-            
-        if not current_sql: return "Không thể tạo SQL."
-        
-        res = execute_sql(current_sql, engine)
-        
-        if isinstance(res, pd.DataFrame):
-            result_df = res
-            result_df.attrs['final_sql'] = current_sql
-            break # Thoát vòng lặp nếu thành công
-        else:
-            last_error = res
-            
-    # --- LOGIC XỬ LÝ KẾT QUẢ ---
+
+def describe_failure(res):
+    """
+    Chuyển kết quả lỗi của execute_sql thành thông tin gửi cho fix_sql_query.
+    """
+    if isinstance(res, QueryTimeout):
+        # Query quá nặng (VD: cross join, quét toàn bảng) -> yêu cầu AI viết bản tổng hợp nhẹ hơn
+        return (
+            f"{res} Câu lệnh quá nặng. Hãy viết lại theo hướng tổng hợp (GROUP BY với SUM/COUNT/AVG), "
+            "tránh JOIN không có điều kiện, thêm điều kiện lọc thời gian và giới hạn số dòng trả về."
+        )
+    return res
+
+
+def validate_against_schema(sql_query, engine):
+    """
+    Kiểm tra SQL tại local (AST + schema cache). Trả về thông báo lỗi cho AI, hoặc None nếu hợp lệ.
+    """
+    with span("validate_sql") as sp:
+        errors = validate_sql(sql_query, get_schema_snapshot(engine), get_sqlglot_dialect(engine))
+        if not errors:
+            return None
+        print(f"🧪 SQL không hợp lệ ({len(errors)} lỗi), bỏ qua bước chạy DB.")
+        message = format_validation_errors(errors)
+        sp.fail(message)
+        return message
+
+
+def record_stage(stats, stage, started, on_progress=None):
+    """
+    Cộng dồn thời gian (giây) của 1 bước vào stats['timings'] (bỏ qua nếu stats=None).
+    on_progress: callback(kind, data), nhận ("stage", {"stage", "seconds"}) khi 1 bước xong.
+    """
+    elapsed = time.perf_counter() - started
+    if on_progress is not None:
+        on_progress("stage", {"stage": stage, "seconds": round(elapsed, 4)})
+    if stats is None:
+        return
+    timings = stats.setdefault("timings", {})
+    timings[stage] = round(timings.get(stage, 0.0) + elapsed, 4)
+
+
+def finalize_result(result_df, is_forecasting, last_error, max_retries, stats=None, on_progress=None):
+    """
+    LOGIC XỬ LÝ KẾT QUẢ: chạy dự báo nếu cần, hoặc trả về thông báo lỗi cuối cùng.
+    """
+    started = time.perf_counter()
+    try:
+        return _finalize_result(result_df, is_forecasting, last_error, max_retries)
+    finally:
+        if is_forecasting:
+            record_stage(stats, "forecast", started, on_progress)
+
+
+def _finalize_result(result_df, is_forecasting, last_error, max_retries):
     if isinstance(result_df, pd.DataFrame) and not result_df.empty:
         # Nếu là Mode Dự báo, ta chạy thêm thuật toán Python
         if is_forecasting:
             try:
                 # Tự động tìm cột ngày và cột số
-                date_cols = result_df.select_dtypes(include=['datetime']).columns
-                num_cols = result_df.select_dtypes(include=['number']).columns
+                date_cols = find_date_columns(result_df)
+                group_cols, num_cols = find_forecast_columns(result_df, date_cols)
                 
                 if len(date_cols) > 0 and len(num_cols) > 0:
+                    # Lịch sử lấy từ forecast cache -> dùng luôn thống kê đủ đã lưu, không fit lại
+                    cached = result_df.attrs.get('forecast_sums') or {}
+                    sums = None
+                    if cached.get("roles") == (tuple(group_cols), date_cols[0], num_cols[0]):
+                        sums = cached["sums"]
+
+                    # Gọi module forecaster (có cột nhóm -> dự báo tất cả các chuỗi cùng lúc)
+                    if group_cols:
+                        print(f"📈 Đang chạy Linear Regression cho từng nhóm ({', '.join(group_cols)})...")
+                        return forecast_grouped(result_df, group_cols, date_cols[0], num_cols[0], sums=sums)
                     print("📈 Đang chạy thuật toán Linear Regression...")
-                    # Gọi module forecaster
-                    forecast_df = forecast_data(result_df, date_cols[0], num_cols[0])
+                    forecast_df = forecast_data(result_df, date_cols[0], num_cols[0],
+                                                sums=(sums or {}).get(()))
                     return forecast_df
                 else:
                     return "Không tìm thấy cột Ngày/Tháng để dự báo. SQL trả về chưa đúng định dạng time-series."
@@ -70,4 +121,133 @@ def process_question_with_retry(question: str, engine=None, max_retries=3):
         
         return result_df
 
-    return f"Thất bại sau {max_retries} lần thử. Lỗi: {last_error}"
\ No newline at end of file
+    return f"Thất bại sau {max_retries} lần thử. Lỗi: {last_error}"
+
+
+def question_steps(question: str, engine=None, max_retries=3, timeout=None, cancel_event=None, stats=None,
+                   on_progress=None, mode="sync"):
+    """
+    Vòng lặp sinh SQL -> kiểm tra -> chạy -> sửa lỗi, dùng chung cho process_question_with_retry và
+    aprocess_question (core/async_agent.py) để 2 bản không lệch nhau.
+    Generator: mỗi bước tốn thời gian (gọi AI, DB, dự báo) được yield ra dạng (tên bước, args, kwargs), bên gọi
+    tự chạy bằng hàm tương ứng (xem SYNC_STEPS) rồi send() kết quả trở lại. Kết quả cuối là giá trị return.
+    """
+    with span("process_question", mode=mode) as question_span:
+        # Lấy engine dùng chung 1 lần cho cả vòng lặp (generate/fix/execute dùng chung pool)
+        if engine is None:
+            engine = init_db()
+
+        # Nạp schema 1 lần (cache) trước khi sinh SQL, đo riêng thời gian bước này
+        started = time.perf_counter()
+        yield "schema", (engine,), {}
+        record_stage(stats, "schema", started, on_progress)
+
+        # --- LOGIC ROUTER: PHÁT HIỆN DỰ BÁO ---
+        question, is_forecasting = prepare_question(question)
+        question_span.set(forecasting=is_forecasting)
+
+        # --- LOGIC CŨ (VÒNG LẶP SỬA LỖI) ---
+        current_sql = ""
+        last_error = ""
+        result_df = None
+        progress = {"stats": stats, "on_progress": on_progress}
+        limits = {"timeout": timeout, "cancel_event": cancel_event}
+
+        for attempt in range(1, max_retries + 1):
+            with span("attempt", attempt=attempt) as attempt_span:
+                question_span.set(attempts=attempt)
+                if stats is not None:
+                    stats["attempts"] = attempt
+                if on_progress is not None:
+                    on_progress("attempt", attempt)
+
+                started = time.perf_counter()
+                if attempt == 1:
+                    current_sql = yield "generate", (question, engine), progress
+                    record_stage(stats, "generate", started, on_progress)
+                else:
+                    current_sql = yield "fix", (question, current_sql, last_error, engine), progress
+                    record_stage(stats, "fix", started, on_progress)
+
+                if not current_sql: return "Không thể tạo SQL."
+                if stats is not None:
+                    stats["final_sql"] = current_sql
+
+                # Kiểm tra local trước: SQL sai bảng/cột thì sửa luôn, không tốn 1 vòng DB
+                started = time.perf_counter()
+                validation_error = yield "validate", (current_sql, engine), {}
+                record_stage(stats, "validate", started, on_progress)
+
+                if validation_error:
+                    res = validation_error
+                else:
+                    started = time.perf_counter()
+                    # Dự báo: dùng lại lịch sử đã lưu, chỉ đọc các dòng mới (None = câu SQL không cộng dồn được)
+                    res = None
+                    if is_forecasting:
+                        res = yield "forecast_history", (current_sql, engine), limits
+                    if res is None:
+                        res = yield "execute", (current_sql, engine), limits
+                    record_stage(stats, "execute", started, on_progress)
+
+                if isinstance(res, pd.DataFrame):
+                    result_df = res
+                    result_df.attrs['final_sql'] = current_sql
+                    # Chỉ cache SQL đã chạy thành công (kể cả SQL do fix_sql_query sửa lại)
+                    yield "remember", (question, current_sql, engine), {}
+                    break # Thoát vòng lặp nếu thành công
+                elif isinstance(res, QueryCancelled):
+                    return "Đã hủy truy vấn theo yêu cầu."
+                else:
+                    last_error = describe_failure(res)
+                    attempt_span.fail(last_error)
+                    if attempt == 1:
+                        # SQL lần đầu có thể đến từ cache -> xóa để lần sau không dùng lại SQL lỗi
+                        yield "forget", (question, engine), {}
+
+        result = yield "finalize", (result_df, is_forecasting, last_error, max_retries, stats, on_progress), {}
+        question_span.record_result(result, failed=not isinstance(result, pd.DataFrame))
+        return result
+
+
+# Hàm chạy từng bước của question_steps (bản đồng bộ). core/async_agent.py có bảng tương ứng chạy qua thread pool.
+SYNC_STEPS = {
+    "schema": get_schema_snapshot,
+    "generate": generate_sql,
+    "fix": fix_sql_query,
+    "validate": validate_against_schema,
+    "forecast_history": fetch_forecast_history,
+    "execute": execute_sql,
+    "remember": remember_sql,
+    "forget": forget_sql,
+    "finalize": finalize_result,
+}
+
+
+def run_steps(steps, handlers=SYNC_STEPS):
+    """
+    Chạy generator question_steps với bảng hàm handlers. Lỗi của 1 bước được ném lại vào generator
+    (span của câu hỏi / lần thử ghi nhận lỗi và đóng đúng thứ tự).
+    """
+    send, value = steps.send, None
+    while True:
+        try:
+            name, args, kwargs = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            send, value = steps.send, handlers[name](*args, **kwargs)
+        except BaseException as e:
+            send, value = steps.throw, e
+
+
+def process_question_with_retry(question: str, engine=None, max_retries=3, timeout=None, cancel_event=None,
+                                stats=None, on_progress=None):
+    """
+    timeout: giới hạn thời gian (giây) cho mỗi lần chạy SQL (mặc định QUERY_TIMEOUT).
+    cancel_event: threading.Event để hủy truy vấn đang chạy.
+    stats: dict (tùy chọn) để nhận số lần thử, SQL cuối cùng và thời gian từng bước.
+    on_progress: callback(kind, data) cho UI: ("attempt", số lần thử), ("sql", SQL đang viết dở),
+                 ("stage", {"stage", "seconds"}) khi mỗi bước kết thúc.
+    """
+    return run_steps(question_steps(question, engine, max_retries, timeout, cancel_event, stats, on_progress))
@@ -1,86 +1,364 @@
+import os
+import time
+import threading
+import numpy as np
 import pandas as pd
 import re
+from contextlib import contextmanager
 from sqlalchemy import text
 from core.database import init_db
+from core.result_cache import get_result_cache
+from core.sql_validator import validate_sql, is_blocking
+from core.dialect import get_sqlglot_dialect
+from core.index_advisor import record_query
+from core.rollups import route_query
+from core.forecaster import DATE_LIKE_PATTERN
+from core.tracing import traced, current_span
 
-def is_safe_sql(sql_query: str) -> bool:
+try:
+    import pyarrow as pa
+except ImportError:  # Không có pyarrow -> DuckDB cũng đọc qua pd.read_sql, chuỗi giữ dạng object
+    pa = None
+
+# Cột chuỗi của kết quả lưu bằng Arrow (1 buffer liền, không phải mỗi ô 1 object Python).
+# Giữ NaN làm giá trị thiếu như dtype "str" mặc định của pandas 3.
+STRING_DTYPE = None
+if pa is not None:
+    try:
+        STRING_DTYPE = pd.StringDtype("pyarrow", na_value=np.nan)
+    except TypeError:  # pandas < 2.3
+        STRING_DTYPE = pd.StringDtype("pyarrow")
+
+EMPTY_RESULT_MESSAGE = "Query chạy thành công nhưng không tìm thấy dữ liệu nào."
+
+
+def is_safe_sql(sql_query: str, dialect=None) -> bool:
     """
-    Hàm kiểm tra bảo mật đơn giản (Rule-based).
-    Chỉ cho phép câu lệnh SELECT. Chặn DROP, DELETE, INSERT, UPDATE.
+    Kiểm tra bảo mật dựa trên cây cú pháp (AST) thay vì so khớp chuỗi.
+    Chỉ cho phép đúng 1 câu SELECT/CTE; chặn DROP, DELETE, INSERT, UPDATE, SELECT INTO, EXEC,
+    nhiều câu lệnh nối bằng ';'...
     """
-    # Chuyển về chữ hoa để check cho dễ
-    sql_upper = sql_query.upper()
-    
-    # Các từ khóa cấm (Forbidden keywords)
-    forbidden_keywords = [
-        "DROP TABLE", "DELETE FROM", "INSERT INTO", 
-        "UPDATE ", "ALTER TABLE", "TRUNCATE"
-    ]
-    
-    for keyword in forbidden_keywords:
-        if keyword in sql_upper:
-            print(f"⚠️ CẢNH BÁO: Phát hiện từ khóa nguy hiểm '{keyword}'")
-            return False
-            
+    errors = validate_sql(sql_query, dialect=dialect)
+    if is_blocking(errors):
+        print(f"⚠️ CẢNH BÁO: {errors[0]['message']}")
+        return False
     return True
 
-def execute_sql(sql_query: str, engine=None):
+
+class QueryTimeout(str):
+    """
+    Lỗi truy vấn chạy quá thời gian cho phép.
+    Vẫn là chuỗi (tương thích code cũ kiểm tra isinstance(res, str)) nhưng có kiểu riêng
+    để vòng lặp retry nhận biết và xử lý khác.
+    """
+
+
+class QueryCancelled(str):
+    """
+    Truy vấn bị người dùng/caller hủy giữa chừng (qua cancel_event).
+    """
+
+
+class _Interrupted(Exception):
+    pass
+
+
+def _env_number(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _should_stop(deadline, cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        return True
+    return deadline is not None and time.monotonic() >= deadline
+
+
+@contextmanager
+def _query_deadline(connection, deadline, cancel_event):
+    """
+    Gắn cơ chế hủy truy vấn theo từng loại DB:
+    - SQLite: progress handler, trả về 1 để SQLite ngắt câu lệnh đang chạy.
+    - SQL Server: query timeout của ODBC + luồng giám sát gửi KILL <spid> khi quá hạn/bị hủy.
+    - DuckDB: luồng giám sát gọi connection.interrupt().
+    """
+    if deadline is None and cancel_event is None:
+        yield
+        return
+
+    dbapi_conn = connection.connection.dbapi_connection
+    dialect = connection.dialect.name
+
+    if dialect == "sqlite":
+        dbapi_conn.set_progress_handler(lambda: 1 if _should_stop(deadline, cancel_event) else 0, 10_000)
+        try:
+            yield
+        finally:
+            dbapi_conn.set_progress_handler(None, 0)  # Trả connection sạch về pool
+        return
+
+    if dialect == "mssql":
+        spid = connection.exec_driver_sql("SELECT @@SPID").scalar()
+        if deadline is not None:
+            dbapi_conn.timeout = max(1, int(deadline - time.monotonic() + 0.999))
+        done = threading.Event()
+        killed = threading.Event()
+
+        def watchdog():
+            while not done.wait(0.2):
+                if _should_stop(deadline, cancel_event):
+                    try:
+                        with connection.engine.connect() as killer:
+                            killer.exec_driver_sql(f"KILL {int(spid)}")
+                        killed.set()
+                        print(f"🛑 Đã KILL phiên SQL Server {spid} (quá hạn/bị hủy).")
+                    except Exception as e:
+                        print(f"⚠️ Không KILL được phiên {spid}: {e}")
+                    return
+
+        watcher = threading.Thread(target=watchdog, daemon=True)
+        watcher.start()
+        try:
+            yield
+        finally:
+            done.set()
+            if killed.is_set():
+                connection.invalidate()  # Phiên đã bị KILL, không trả lại pool
+            else:
+                dbapi_conn.timeout = 0
+        return
+
+    if dialect == "duckdb":
+        # DuckDB: luồng giám sát gọi interrupt() để ngắt câu đang chạy (kể cả khi đang tổng hợp song song)
+        done = threading.Event()
+
+        def watchdog():
+            while not done.wait(0.1):
+                if _should_stop(deadline, cancel_event):
+                    dbapi_conn.interrupt()
+                    return
+
+        watcher = threading.Thread(target=watchdog, daemon=True)
+        watcher.start()
+        try:
+            yield
+        finally:
+            done.set()
+        return
+
+    # DB khác: chỉ kiểm tra giữa các chunk (cooperative)
+    yield
+
+
+def _arrow_strings(df):
+    """
+    Cột object toàn chuỗi -> STRING_DTYPE (làm ngay trên từng chunk để không giữ cả kết quả dạng object).
+    """
+    if STRING_DTYPE is None:
+        return df
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) == "string":
+            df[col] = df[col].astype(STRING_DTYPE)
+    return df
+
+
+def compact_frame(df, min_rows=None, max_ratio=None):
+    """
+    Thu gọn kết quả: cột chuỗi lặp nhiều (trạng thái, khu vực, tên máy...) -> category (mã số + bảng giá trị),
+    cột chuỗi còn lại -> chuỗi Arrow. Cột số / ngày giữ NumPy (forecaster, plotly đọc thẳng không phải đổi).
+    Cột trông như ngày ('2025-01') giữ dạng chuỗi để find_date_columns còn nhận ra.
+    Cấu hình: RESULT_CATEGORY_MIN_ROWS (1000), RESULT_CATEGORY_MAX_RATIO (0.5 = số giá trị khác nhau / số dòng).
+    """
+    if min_rows is None:
+        min_rows = int(_env_number("RESULT_CATEGORY_MIN_ROWS", 1000))
+    if max_ratio is None:
+        max_ratio = _env_number("RESULT_CATEGORY_MAX_RATIO", 0.5)
+    df = _arrow_strings(df)
+    if len(df) < min_rows:
+        return df
+    for col in df.select_dtypes(include=['object', 'string']).columns:
+        values = df[col]
+        if pd.api.types.infer_dtype(values, skipna=True) != "string":
+            continue  # object lẫn kiểu (bytes, Decimal...) -> giữ nguyên
+        if values.dropna().head(100).astype(str).str.match(DATE_LIKE_PATTERN).all():
+            continue
+        if values.nunique(dropna=True) <= max_ratio * len(values):
+            df[col] = values.astype("category")
+    return df
+
+
+def _read_limited(connection, sql_query, max_rows, max_bytes, chunksize, deadline=None, cancel_event=None):
+    """
+    Gom chunk cho tới khi chạm giới hạn dòng/bytes. Dừng sớm thì cursor được đóng luôn,
+    phần còn lại của kết quả không bị kéo về.
+    """
+    chunks = []
+    total_rows = 0
+    total_bytes = 0
+    truncated = False
+
+    for chunk in pd.read_sql(text(sql_query), connection, chunksize=chunksize):
+        if _should_stop(deadline, cancel_event):
+            raise _Interrupted()
+        if max_rows and total_rows + len(chunk) > max_rows:
+            chunk = chunk.iloc[:max_rows - total_rows]
+            truncated = True
+        chunk = _arrow_strings(chunk)
+        chunks.append(chunk)
+        total_rows += len(chunk)
+        total_bytes += int(chunk.memory_usage(index=False, deep=True).sum())
+        if truncated or (max_bytes and total_bytes >= max_bytes):
+            truncated = True
+            break
+
+    if not chunks:
+        return pd.DataFrame()
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+    df.attrs['truncated'] = truncated
+    df.attrs['row_limit'] = max_rows
+    return df
+
+
+def _arrow_types_mapper(arrow_type):
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return STRING_DTYPE
+    return None
+
+
+def _read_arrow(connection, sql_query, max_rows, max_bytes, chunksize, deadline=None, cancel_event=None):
+    """
+    DuckDB: lấy kết quả dạng Arrow (RecordBatch) rồi đổi sang DataFrame 1 lần, không qua từng dòng Python
+    như cursor DB-API. Giới hạn dòng/bytes giống _read_limited.
+    """
+    # dbapi_connection của duckdb-engine chuyển tiếp execute() sang DuckDBPyConnection
+    reader = connection.connection.dbapi_connection.execute(sql_query).fetch_record_batch(chunksize)
+    batches = []
+    total_rows = 0
+    total_bytes = 0
+    truncated = False
+
+    for batch in reader:
+        if _should_stop(deadline, cancel_event):
+            raise _Interrupted()
+        if max_rows and total_rows + batch.num_rows > max_rows:
+            batch = batch.slice(0, max_rows - total_rows)
+            truncated = True
+        batches.append(batch)
+        total_rows += batch.num_rows
+        total_bytes += batch.nbytes
+        if truncated or (max_bytes and total_bytes >= max_bytes):
+            truncated = True
+            break
+
+    if total_rows == 0:
+        return pd.DataFrame()
+    # self_destruct: giải phóng từng cột Arrow ngay khi đã đổi xong -> không giữ 2 bản đầy đủ cùng lúc
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+    del batches
+    df = table.to_pandas(types_mapper=_arrow_types_mapper, split_blocks=True, self_destruct=True)
+    df.attrs['truncated'] = truncated
+    df.attrs['row_limit'] = max_rows
+    return df
+
+
+@traced("execute_sql")
+def execute_sql(sql_query: str, engine=None, use_cache=True, max_rows=None, max_bytes=None,
+                timeout=None, cancel_event=None):
     """
     Input: Câu lệnh SQL (String)
     Output: 
         - Nếu thành công: Trả về Pandas DataFrame
         - Nếu thất bại: Trả về chuỗi thông báo lỗi (String)
+    use_cache: dùng lại kết quả cũ nếu dữ liệu các bảng liên quan chưa thay đổi.
+    Câu tổng hợp trên maintenance_logs được chạy trên bảng rollup nếu có (SQL thực tế: df.attrs['executed_sql']).
+    max_rows / max_bytes: giới hạn kết quả (mặc định RESULT_MAX_ROWS / RESULT_MAX_MB).
+        Bị cắt bớt thì df.attrs['truncated'] = True.
+    timeout: số giây tối đa (mặc định QUERY_TIMEOUT, 0 = không giới hạn) -> trả về QueryTimeout.
+    cancel_event: threading.Event, set() để hủy truy vấn đang chạy -> trả về QueryCancelled.
     """
-    # 1. Check an toàn trước khi kết nối DB
-    if not is_safe_sql(sql_query):
-        return "ERROR: Câu lệnh SQL bị từ chối vì lý do bảo mật."
-    
-    # 2. Kết nối DB
-    is_local_engine = False
+    # 1. Kết nối DB (engine dùng chung từ registry, pool tự quản lý kết nối)
     if engine is None:
         engine = init_db()
-        is_local_engine = True
-    
+
+    # 2. Check an toàn trước khi chạy
+    if not is_safe_sql(sql_query, get_sqlglot_dialect(engine)):
+        return "ERROR: Câu lệnh SQL bị từ chối vì lý do bảo mật."
+
+    # Câu tổng hợp trả lời được từ bảng rollup -> chạy trên rollup (tra index thay vì quét bảng gốc)
+    rollup_version = None
+    routed = route_query(sql_query, engine)
+    if routed is not None:
+        sql_query, rollup_version = routed
+    current_span().set(dialect=engine.dialect.name, rollup=rollup_version is not None)
+
+    if max_rows is None:
+        max_rows = int(_env_number("RESULT_MAX_ROWS", 100_000))
+    if max_bytes is None:
+        max_bytes = int(_env_number("RESULT_MAX_MB", 200) * 1024 * 1024)
+    chunksize = int(_env_number("RESULT_CHUNK_SIZE", 10_000))
+    if timeout is None:
+        timeout = _env_number("QUERY_TIMEOUT", 60)
+
+    # 3. Tra cache kết quả (khóa gồm phiên bản dữ liệu nên tự hết hiệu lực khi bảng thay đổi)
+    cache = get_result_cache() if use_cache else None
+    cache_key = None
+    if cache is not None:
+        try:
+            cache_key = cache.make_key(sql_query, engine, extra=(max_rows, max_bytes, rollup_version))
+        except Exception:
+            cache_key = None  # Không probe được (VD: bảng không tồn tại) -> chạy thẳng, để lỗi thật hiện ra
+        if cache_key is not None:
+            cached_df = cache.get(cache_key)
+            if cached_df is not None:
+                print("⚡ Dùng kết quả từ cache.")
+                current_span().set(cache_hit=True)
+                return cached_df
+
+    # Deadline tính từ lúc bắt đầu chạy truy vấn
+    deadline = time.monotonic() + timeout if timeout else None
+
     try:
-        #Kết nối và thực thi
+        #Kết nối và thực thi (đọc theo chunk, dừng khi chạm giới hạn dòng/bytes hoặc quá hạn)
+        started = time.perf_counter()
         with engine.connect() as connection:
-            df = pd.read_sql(text(sql_query), connection)
+            connection = connection.execution_options(stream_results=True)
+            with _query_deadline(connection, deadline, cancel_event):
+                read = _read_arrow if connection.dialect.name == "duckdb" and pa is not None else _read_limited
+                df = read(connection, sql_query, max_rows, max_bytes, chunksize, deadline, cancel_event)
+            # Ghi workload cho index advisor (chỉ các lần chạy thật, không tính cache hit)
+            record_query(engine, sql_query, time.perf_counter() - started, len(df))
+            current_span().set(truncated=bool(df.attrs.get('truncated')))
+            if df.attrs.get('truncated'):
+                print(f"✂️ Kết quả quá lớn, chỉ lấy {len(df)} dòng đầu.")
+            if rollup_version is not None:
+                df.attrs['executed_sql'] = sql_query
+            if _env_number("RESULT_COMPACT", 1):
+                df = compact_frame(df)
 
             # Kiểm tra kết quả
             if df.empty:
-                return "Query chạy thành công nhưng không tìm thấy dữ liệu nào."    
+                return EMPTY_RESULT_MESSAGE
+            if cache_key is not None:
+                cache.put(cache_key, df)
             return df
     except Exception as e:
+        # Hết giờ / bị hủy: trả về kiểu lỗi riêng để smart_agent xử lý
+        if cancel_event is not None and cancel_event.is_set():
+            return QueryCancelled("Cancelled: Truy vấn đã bị hủy.")
+        if deadline is not None and time.monotonic() >= deadline:
+            print(f"⏱️ Truy vấn vượt quá {timeout:g} giây, đã hủy.")
+            return QueryTimeout(f"Timeout Error: Truy vấn chạy quá {timeout:g} giây và đã bị hủy.")
+
         # Bắt lỗi cú pháp SQL (Ví dụ: AI bịa ra tên cột không tồn tại)
         error_msg = str(e)
         # Rút gọn lỗi cho dễ đọc (Lấy phần gốc từ SQLite)
         if "(sqlite3.OperationalError)" in error_msg:
             return f"SQL Error: {error_msg.split('(sqlite3.OperationalError)')[1].strip()}"
+        # Lỗi của DuckDB (đọc qua Arrow nên không bị SQLAlchemy bọc lại): "Binder Error: ..."
+        if type(e).__module__.startswith(("duckdb", "_duckdb")):
+            return f"SQL Error: {error_msg}"
         return f"System Error: {error_msg}"
-    finally:
-        if is_local_engine:
-            engine.dispose()
-            print("🔒 Đóng kết nối Database sau khi thực thi SQL.")
-    
-    try:
-        # Sử dụng pandas để đọc SQL. Đây là cách clean nhất cho Data Project.
-        # Dùng connection context để tự động đóng kết nối
-        with engine.connect() as connection:
-            df = pd.read_sql(text(sql_query), connection)
-            
-        # Kiểm tra nếu kết quả rỗng
-        if df.empty:
-            return "Query chạy thành công nhưng không tìm thấy dữ liệu nào."
-            
-        return df
-        
-    except Exception as e:
-        # Bắt lỗi cú pháp SQL (Ví dụ: AI bịa ra tên cột không tồn tại)
-        error_msg = str(e)
-        # Rút gọn lỗi cho dễ đọc (Lấy phần gốc từ SQLite)
-        if "(sqlite3.OperationalError)" in error_msg:
-            return f"SQL Error: {error_msg.split('(sqlite3.OperationalError)')[1].strip()}"
-        return f"System Error: {error_msg}"
+
 
 # --- Test Unit ---
 if __name__ == "__main__":
@@ -1,58 +1,220 @@
-import os
-import google.generativeai as genai
+import time
 from dotenv import load_dotenv
-from sqlalchemy import inspect
 from core.database import init_db
+from core.schema_cache import get_schema_snapshot
+from core.query_cache import get_sql_cache
+from core.dialect import get_sqlglot_dialect, get_dialect_rules, transpile_sql
+from core.schema_linker import link_schema, estimate_tokens
+from core.result_cache import referenced_tables
+from core.llm_provider import LLMRequest, get_llm_provider
+from core.rollups import rollup_prompt_hint
+from core.tracing import traced, span, current_span
 
-# 1. Load biến môi trường & Cấu hình Google AI
+# 1. Load biến môi trường (Backend AI chọn qua LLM_PROVIDER / LLM_MODEL, xem core/llm_provider.py)
 load_dotenv()
 
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    raise ValueError("❌ Chưa tìm thấy GOOGLE_API_KEY trong file .env")
 
-genai.configure(api_key=api_key)
+class SqlStreamExtractor:
+    """
+    Tách SQL dần dần từ các đoạn text AI stream về: bỏ ```sql ... ``` ngay khi nhận,
+    và báo "done" khi câu lệnh đã hoàn chỉnh (gặp fence đóng hoặc dấu ';' ngoài chuỗi)
+    để không phải chờ AI trả nốt phần thừa.
+    """
+    def __init__(self):
+        self.raw = ""
+        self.sql = ""
+        self.done = False
+
+    def feed(self, chunk: str):
+        self.raw += chunk
+        self.sql, self.done = self._extract(self.raw)
+        return self.sql
+
+    @staticmethod
+    def _extract(raw):
+        body = raw.lstrip()
+        fenced = body.startswith("```")
+        if fenced:
+            newline = body.find("\n")
+            if newline == -1:
+                return "", False  # Mới nhận "```sql", chưa có nội dung
+            body = body[newline + 1:]
+
+        done = False
+        end = body.find("```")
+        if end != -1:
+            body, done = body[:end], True
+        else:
+            body = body.rstrip("`")  # Fence đóng mới về được 1 phần
+
+        # Dấu ';' đầu tiên nằm ngoài chuỗi '...' / "..." / [...] => câu lệnh đã đủ (chỉ cho phép 1 câu)
+        quote = None
+        for i, ch in enumerate(body):
+            if quote:
+                if ch == quote:
+                    quote = None
+            elif ch in "'\"":
+                quote = ch
+            elif ch == "[":
+                quote = "]"
+            elif ch == ";":
+                body, done = body[:i], True
+                break
+        return body.strip(), done
+
+
+def extract_sql(text: str) -> str:
+    """
+    Lấy SQL sạch từ response đầy đủ (không stream).
+    """
+    extractor = SqlStreamExtractor()
+    extractor.feed(text or "")
+    return extractor.sql
+
+
+def stream_sql(chunks, on_progress=None, stats=None):
+    """
+    Đọc các đoạn text stream từ AI, đẩy SQL đang viết dở qua on_progress("sql", partial_sql)
+    và dừng ngay khi câu lệnh hoàn chỉnh.
+    stats['first_token_s']: thời gian (giây) tới khi nhận được đoạn text đầu tiên.
+    """
+    started = time.perf_counter()
+    extractor = SqlStreamExtractor()
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if stats is not None and "first_token_s" not in stats:
+                stats["first_token_s"] = round(time.perf_counter() - started, 4)
+            previous = extractor.sql
+            extractor.feed(chunk)
+            if on_progress is not None and extractor.sql and extractor.sql != previous:
+                on_progress("sql", extractor.sql)
+            if extractor.done:
+                break
+    finally:
+        # Dừng sớm -> đóng luồng stream để provider giải phóng kết nối / ghi bản ghi
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    return extractor.sql
 
 
+@traced("get_schema_string", attributes=lambda text: {"schema_tokens": estimate_tokens(text)})
 def get_schema_string(engine):
     """
     Hàm tự động quét Database để lấy tên bảng và tên cột.
+    Dùng snapshot trong schema cache, chỉ quét lại khi schema thay đổi.
     """
-    inspector = inspect(engine)
-    schema_lines = []
-    
-    for table_name in inspector.get_table_names():
-        columns = inspector.get_columns(table_name)
-        # Lấy tên cột và kiểu dữ liệu (VD: id (INTEGER), name (VARCHAR))
-        col_desc = [f"{col['name']} ({str(col['type'])})" for col in columns]
-        schema_lines.append(f"Table: {table_name}")
-        schema_lines.append(f"Columns: {', '.join(col_desc)}")
-        schema_lines.append("") 
-        
-    return "\n".join(schema_lines)
+    return get_schema_snapshot(engine).schema_text
+
+
+def get_relevant_schema(question: str, engine, stats=None, extra_tables=None):
+    """
+    Schema đưa vào prompt: chỉ các bảng liên quan tới câu hỏi (schema linking) khi DB lớn.
+    stats: dict (tùy chọn) nhận báo cáo token tiết kiệm ở stats['schema_linking'].
+    """
+    report = link_schema(question, get_schema_snapshot(engine), extra_tables)
+    if stats is not None:
+        stats["schema_linking"] = {k: v for k, v in report.items() if k != "schema_text"}
+    return report["schema_text"]
+
+def get_model_name():
+    """
+    Tên model của provider hiện tại (1 phần của khóa SQL cache).
+    """
+    return get_llm_provider().model_name
+
+
+def _cache_scope(engine):
+    """
+    Phần "schema" của khóa SQL cache: schema hash + dialect (cùng schema nhưng chạy trên SQLite hay DuckDB
+    thì SQL khác nhau, VD: date('now', '-3 months') chỉ chạy trên SQLite).
+    """
+    return f"{get_schema_snapshot(engine).schema_hash}:{get_sqlglot_dialect(engine)}"
+
+
+def remember_sql(question: str, sql_query: str, engine=None):
+    """
+    Lưu SQL vào cache. Chỉ gọi sau khi SQL đã thực thi thành công.
+    """
+    cache = get_sql_cache()
+    if cache is None or not sql_query:
+        return
+    if engine is None:
+        engine = init_db()
+    cache.put(question, _cache_scope(engine), get_model_name(), sql_query)
+
+
+def forget_sql(question: str, engine=None):
+    """
+    Xóa SQL đã cache của câu hỏi (VD: SQL cache không còn chạy được).
+    """
+    cache = get_sql_cache()
+    if cache is None:
+        return
+    if engine is None:
+        engine = init_db()
+    cache.delete(question, _cache_scope(engine), get_model_name())
+
+
+def lookup_cached_sql(question: str, engine=None):
+    """
+    Tra SQL đã cache cho câu hỏi (không gọi AI). Trả về None nếu chưa có.
+    """
+    cache = get_sql_cache()
+    if cache is None:
+        return None
+    if engine is None:
+        engine = init_db()
+    return cache.get(question, _cache_scope(engine), get_model_name())
+
 
-def generate_sql(question: str, engine=None):
+def _sql_attributes(sql_query):
+    return {"sql_chars": len(sql_query or "")}
+
+
+def call_llm(request, on_progress=None, stats=None):
+    """
+    Gọi AI (stream) và tách SQL. Ghi span "llm" kèm số token prompt / response (ước lượng ~4 ký tự / token).
+    """
+    provider = get_llm_provider()
+    with span("llm", kind=request.kind, provider=provider.name, model=provider.model_name) as sp:
+        sql_query = stream_sql(provider.stream(request), on_progress, stats)
+        sp.set(prompt_tokens=estimate_tokens(request.system_instruction + request.prompt),
+               response_tokens=estimate_tokens(sql_query))
+        return sql_query
+
+
+@traced("generate_sql", attributes=_sql_attributes)
+def generate_sql(question: str, engine=None, use_cache=True, stats=None, on_progress=None):
     """
     Input: Câu hỏi tiếng Việt
     Output: Câu lệnh SQL sạch
+    use_cache: tra cache (câu hỏi chuẩn hóa + schema hash + model) trước khi gọi AI.
+    stats: dict (tùy chọn) nhận báo cáo schema linking và thời gian tới token đầu tiên.
+    on_progress: callback(kind, data), nhận ("sql", SQL đang viết dở) trong lúc AI stream về.
     """
-    is_local_engine = False
-
-    # Bước A: Lấy Schema thực tế
+    # Bước A: Lấy Schema thực tế (engine dùng chung từ registry, không dispose)
     if engine is None:
         engine = init_db()
-        is_local_engine = True
-        
-    try: 
-        schema_text = get_schema_string(engine)
-    
-    finally:
-        if is_local_engine:
-            engine.dispose()
-            print("🔒 Đóng kết nối Database sau khi lấy schema.")
+
+    if use_cache:
+        cached_sql = lookup_cached_sql(question, engine)
+        if cached_sql:
+            print("⚡ Dùng SQL từ cache (không gọi AI).")
+            current_span().set(cache_hit=True)
+            if on_progress is not None:
+                on_progress("sql", cached_sql)
+            return cached_sql
+
+    schema_text = get_relevant_schema(question, engine, stats)
+    dialect = get_sqlglot_dialect(engine)
+    dialect_name, dialect_rules = get_dialect_rules(dialect)
+    # Schema có bảng rollup -> thêm quy tắc ưu tiên dùng bảng tổng hợp sẵn
+    rules_text = "\n".join(f"        - {rule}" for rule in dialect_rules + rollup_prompt_hint(schema_text))
     
     # Bước B: Tạo cấu hình cho Model
-    # Chúng ta dùng 'gemini-1.5-flash' vì nó nhanh và rẻ (free), code tốt.
     generation_config = {
         "temperature": 0.1,  # Thấp để AI ít "chém gió", tập trung vào code chính xác
         "top_p": 0.95,
@@ -61,7 +223,7 @@ def generate_sql(question: str, engine=None):
 
     # Bước C: Thiết lập Prompt (Chỉ dẫn hệ thống)
     system_instruction = f"""
-    Bạn là một chuyên gia SQL Server (T-SQL).
+    Bạn là một chuyên gia {dialect_name}.
     Nhiệm vụ: Chuyển câu hỏi tự nhiên thành câu lệnh SQL để truy vấn dữ liệu.
 
     Database Schema hiện tại:
@@ -69,51 +231,47 @@ def generate_sql(question: str, engine=None):
 
     Quy tắc TUYỆT ĐỐI:
     1. Chỉ trả về duy nhất mã SQL. KHÔNG giải thích.
-    2. Sử dụng cú pháp **MS SQL Server (T-SQL)** chuẩn.
-        - Dùng `TOP n` thay vì `LIMIT n`. (Ví dụ: `SELECT TOP 5 * FROM...`)
-        - Dùng `GETDATE()` thay vì `now()`.
-        - Dùng `FORMAT(date_col, 'yyyy-MM-dd')` nếu cần format ngày.
+    2. Sử dụng cú pháp **{dialect_name}** chuẩn.
+{rules_text}
     3. Luôn sử dụng Alias cho bảng.
     4. Chỉ tạo câu lệnh `SELECT`.
     5. Không dùng Markdown (```sql).
     """
 
-    model = genai.GenerativeModel(
-        model_name="gemini-flash-latest",
-        generation_config=generation_config,
-        system_instruction=system_instruction
-    )
+    request = LLMRequest("generate", question, system_instruction, question, generation_config)
 
-    # Bước D: Gọi AI
+    # Bước D: Gọi AI (stream: tách SQL dần dần, dừng đọc ngay khi câu lệnh hoàn chỉnh)
     try:
-        chat_session = model.start_chat(history=[])
-        response = chat_session.send_message(question)
-        
-        sql_query = response.text.strip()
+        # Clean code (Phòng hờ AI vẫn thêm markdown) được làm ngay trong lúc stream
+        sql_query = call_llm(request, on_progress, stats)
         
-        # Clean code (Phòng hờ Gemini vẫn thêm markdown)
-        sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
-        
-        return sql_query
+        # Dịch tại local nếu AI vẫn viết theo T-SQL trong khi DB là SQLite/DuckDB
+        return transpile_sql(sql_query, dialect=dialect)
 
     except Exception as e:
-        print(f"❌ Lỗi khi gọi Google AI: {e}")
+        print(f"❌ Lỗi khi gọi AI ({get_llm_provider().name}): {e}")
+        current_span().fail(e)
         return ""
     
-def fix_sql_query(original_question: str, broken_sql: str, error_message: str, engine=None):
+@traced("fix_sql_query", attributes=_sql_attributes)
+def fix_sql_query(original_question: str, broken_sql: str, error_message: str, engine=None, stats=None,
+                  on_progress=None):
     """
     Hàm này dùng để yêu cầu AI sửa lại câu lệnh SQL bị lỗi.
     """
     if engine is None:
         engine = init_db()
-        # Lưu ý: ở hàm fix này ta tạm thời không dispose engine ở đây 
-        # vì schema thường đã được cache hoặc lấy lại nhanh.
-        # Nhưng để đúng chuẩn stateless, bạn có thể áp dụng logic dispose như hàm generate_sql.
 
-    schema_text = get_schema_string(engine)
+    # Giữ lại các bảng câu SQL lỗi đang dùng, cộng thêm bảng liên quan tới câu hỏi
+    used_tables = referenced_tables(broken_sql or "", get_schema_snapshot(engine).table_names())
+    schema_text = get_relevant_schema(original_question, engine, stats, used_tables)
+    dialect = get_sqlglot_dialect(engine)
+    dialect_name, dialect_rules = get_dialect_rules(dialect)
+    # Schema có bảng rollup -> thêm quy tắc ưu tiên dùng bảng tổng hợp sẵn
+    rules_text = "\n".join(f"        - {rule}" for rule in dialect_rules + rollup_prompt_hint(schema_text))
 
     system_instruction = f"""
-    Bạn là chuyên gia SQL Server. Hãy sửa câu lệnh SQL bị lỗi sau đây.
+    Bạn là chuyên gia {dialect_name}. Hãy sửa câu lệnh SQL bị lỗi sau đây.
     
     Database Schema:
     {schema_text}
@@ -124,18 +282,20 @@ def fix_sql_query(original_question: str, broken_sql: str, error_message: str, e
     - Error Message: {error_message}
     
     Yêu cầu:
-    1. Chỉ trả về mã SQL đã sửa (T-SQL).
+    1. Chỉ trả về mã SQL đã sửa (cú pháp {dialect_name}).
+{rules_text}
     2. Không giải thích.
     3. Không dùng Markdown.
     """
     
-    model = genai.GenerativeModel(model_name="gemini-flash-latest", system_instruction=system_instruction)
+    request = LLMRequest("fix", original_question, system_instruction, "Hãy sửa lỗi này giúp tôi.",
+                         broken_sql=broken_sql)
     
     try:
-        response = model.generate_content("Hãy sửa lỗi này giúp tôi.")
-        sql = response.text.replace("```sql", "").replace("```", "").strip()
-        return sql
+        sql = call_llm(request, on_progress)
+        return transpile_sql(sql, dialect=dialect)
     except Exception as e:
+        current_span().fail(e)
         return ""
 
 # --- Phần test chạy thử ---
@@ -146,10 +306,10 @@ if __name__ == "__main__":
         "Kỹ sư nào sửa chữa tốn nhiều tiền nhất?"
     ]
 
-    print("🚀 Đang khởi động Google Gemini...\n")
+    print(f"🚀 Đang khởi động AI ({get_llm_provider().name})...\n")
     
     for q in test_questions:
         print(f"User: {q}")
         sql = generate_sql(q)
-        print(f"Gemini SQL: {sql}")
+        print(f"AI SQL: {sql}")
         print("-" * 50)
\ No newline at end of file
@@ -0,0 +1,189 @@
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.optimizer.scope import traverse_scope
+
+# --- SQL VALIDATOR (AST) ---
+# Kiểm tra SQL ngay tại local trước khi gửi xuống DB:
+# 1. Chỉ cho phép 1 câu SELECT/CTE (chặn nhiều câu lệnh, SELECT INTO, EXEC, comment trick...).
+# 2. Mọi bảng/cột phải tồn tại trong schema cache.
+# Kết quả là danh sách lỗi có cấu trúc để gửi thẳng cho fix_sql_query (không tốn 1 vòng DB).
+
+# Mã lỗi liên quan bảo mật (luôn chặn); các mã còn lại là lỗi schema
+SAFETY_ERRORS = {"forbidden_statement", "multiple_statements", "empty"}
+
+_FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Drop, exp.Create, exp.Alter,
+    exp.TruncateTable, exp.Command, exp.Into, exp.Set, exp.Transaction, exp.Commit, exp.Rollback,
+)
+
+
+def _error(code, message):
+    return {"code": code, "message": message}
+
+
+def parse_sql(sql_query: str, dialect=None):
+    """
+    Parse SQL thành danh sách statement. Thử dialect của DB trước, sau đó T-SQL
+    (vì prompt mặc định sinh T-SQL). Trả về None nếu không parse được.
+    """
+    for read in dict.fromkeys([dialect or "tsql", "tsql"]):
+        try:
+            return [s for s in sqlglot.parse(sql_query, read=read) if s is not None]
+        except SqlglotError:
+            continue
+    return None
+
+
+def check_statement_safety(statements):
+    """
+    Chỉ cho phép đúng 1 câu truy vấn đọc (SELECT / UNION / WITH ... SELECT).
+    """
+    if not statements:
+        return [_error("empty", "Không có câu lệnh SQL nào.")]
+    if len(statements) > 1:
+        return [_error("multiple_statements", f"Chỉ được phép 1 câu lệnh, nhận được {len(statements)}.")]
+
+    statement = statements[0]
+    if not isinstance(statement, exp.Query):
+        keyword = statement.sql().split(" ", 1)[0].upper()
+        return [_error("forbidden_statement", f"Chỉ cho phép câu lệnh SELECT (nhận được {keyword}).")]
+
+    for node in statement.walk():
+        if isinstance(node, _FORBIDDEN_NODES):
+            return [_error("forbidden_statement", f"Câu lệnh chứa thao tác không được phép: {node.key.upper()}.")]
+    return []
+
+
+def _lookup_source(scope, name):
+    """
+    Tìm alias/bảng trong scope hiện tại rồi tới các scope cha (subquery tương quan).
+    """
+    while scope is not None:
+        if name in scope.sources:
+            return scope.sources[name]
+        scope = scope.parent
+    return None
+
+
+def check_schema_references(statement, snapshot):
+    """
+    Đối chiếu mọi bảng/cột trong câu lệnh với schema snapshot.
+    Chỉ báo lỗi khi chắc chắn (cột thuộc subquery/CTE thì bỏ qua).
+    """
+    errors = []
+    tables = {name.lower(): name for name in snapshot.table_names()}
+    columns = {
+        name.lower(): {col.lower() for col in snapshot.column_names(name)}
+        for name in snapshot.table_names()
+    }
+    cte_names = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+
+    # 1. Bảng
+    for table in statement.find_all(exp.Table):
+        name = table.name.lower()
+        if not name or name in cte_names:
+            continue
+        if name not in tables:
+            errors.append(_error(
+                "unknown_table",
+                f"Bảng '{table.name}' không tồn tại. Các bảng hợp lệ: {', '.join(snapshot.table_names())}.",
+            ))
+    if errors:
+        return errors
+
+    # 2. Cột (theo từng scope: SELECT chính, subquery, CTE)
+    try:
+        scopes = traverse_scope(statement)
+    except SqlglotError:
+        return errors
+
+    for scope in scopes:
+        select_aliases = {
+            s.alias.lower() for s in getattr(scope.expression, "selects", []) if isinstance(s, exp.Alias)
+        }
+        for column in scope.columns:
+            col_name = column.name.lower()
+            # Bỏ qua cột của subquery tương quan được sqlglot "đẩy" lên scope cha
+            if not col_name or column.find_ancestor(exp.Select) is not scope.expression:
+                continue
+
+            if column.table:
+                source = _lookup_source(scope, column.table)
+                if source is None:
+                    errors.append(_error("unknown_alias", f"Alias/bảng '{column.table}' trong '{column.sql()}' không được khai báo trong FROM/JOIN."))
+                    continue
+                if isinstance(source, exp.Table) and source.name.lower() in columns:
+                    if col_name not in columns[source.name.lower()]:
+                        errors.append(_error(
+                            "unknown_column",
+                            f"Cột '{column.name}' không có trong bảng '{source.name}'. "
+                            f"Các cột hợp lệ: {', '.join(snapshot.column_names(tables[source.name.lower()]))}.",
+                        ))
+                continue
+
+            # Cột không ghi rõ bảng: chỉ kiểm tra khi mọi nguồn đều là bảng thật
+            if col_name in select_aliases:
+                continue
+            sources = list(scope.sources.values())
+            if not sources or any(not isinstance(src, exp.Table) for src in sources):
+                continue
+            known = [src.name for src in sources if col_name in columns.get(src.name.lower(), set())]
+            if not known and not _lookup_outer_column(scope.parent, col_name, columns):
+                table_list = ", ".join(src.name for src in sources)
+                errors.append(_error("unknown_column", f"Cột '{column.name}' không có trong bảng nào ({table_list})."))
+
+    return errors
+
+
+def _lookup_outer_column(scope, col_name, columns):
+    while scope is not None:
+        for src in scope.sources.values():
+            if not isinstance(src, exp.Table) or col_name in columns.get(src.name.lower(), set()):
+                return True
+        scope = scope.parent
+    return False
+
+
+def validate_sql(sql_query: str, snapshot=None, dialect=None):
+    """
+    Input: câu SQL, schema snapshot (tùy chọn), dialect sqlglot.
+    Output: danh sách lỗi [{code, message}], rỗng nghĩa là hợp lệ.
+    """
+    statements = parse_sql(sql_query, dialect)
+    if statements is None:
+        # sqlglot không parse được: không kết luận được về schema, nhưng vẫn phải đảm bảo an toàn
+        if _legacy_is_safe(sql_query):
+            return []
+        return [_error("forbidden_statement", "Không phân tích được câu lệnh và câu lệnh chứa từ khóa bị cấm.")]
+
+    errors = check_statement_safety(statements)
+    if errors or snapshot is None:
+        return errors
+    return check_schema_references(statements[0], snapshot)
+
+
+def is_blocking(errors):
+    return any(e["code"] in SAFETY_ERRORS for e in errors)
+
+
+def format_validation_errors(errors):
+    """
+    Gộp lỗi thành đoạn text gửi cho AI sửa.
+    """
+    lines = [f"- [{e['code']}] {e['message']}" for e in errors]
+    return "Validation Error (kiểm tra trước khi chạy):\n" + "\n".join(lines)
+
+
+def _legacy_is_safe(sql_query: str) -> bool:
+    """
+    Kiểm tra theo từ khóa (dùng khi không parse được câu lệnh).
+    """
+    sql_upper = sql_query.upper()
+    if not sql_upper.lstrip().startswith(("SELECT", "WITH", "(")):
+        return False
+    forbidden_keywords = [
+        "DROP ", "DELETE ", "INSERT ", "UPDATE ", "ALTER ", "TRUNCATE", "MERGE ", "EXEC", "CREATE ", " INTO ", ";",
+    ]
+    stripped = sql_upper.strip().rstrip(";")
+    return not any(keyword in stripped for keyword in forbidden_keywords)
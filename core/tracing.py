@@ -0,0 +1,379 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import threading
+import functools
+import contextvars
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dotenv import load_dotenv
+from core.query_cache import BASE_DIR
+
+load_dotenv()
+
+# --- TRACING & METRICS ---
+# Đo thời gian từng bước của pipeline (init_db, schema, sinh / sửa SQL, gọi AI, chạy SQL, dự báo, vẽ biểu đồ)
+# dưới dạng span có cấu trúc: tên, thời gian, span cha, thuộc tính (token prompt / response, lần thử,
+# số dòng, số bytes, lỗi).
+# Bật bằng TRACE_EXPORTERS (phân tách bằng dấu phẩy):
+# - json: ghi mỗi span 1 dòng JSON (TRACE_LOG_PATH, mặc định .cache/traces.jsonl).
+# - prometheus: gộp thành metrics dạng text OpenMetrics, phục vụ tại http://<host>:TRACE_PROMETHEUS_PORT/metrics.
+# - otel: chuyển span sang OpenTelemetry (cần cài opentelemetry-api/sdk và cấu hình TracerProvider).
+# Không bật exporter nào (mặc định): span() trả về 1 span rỗng dùng chung, decorator chỉ kiểm tra 1 biến -> gần như
+# không tốn gì.
+DEFAULT_TRACE_LOG_PATH = os.path.join(BASE_DIR, ".cache", "traces.jsonl")
+# Thuộc tính số được cộng dồn thành counter Prometheus
+METRIC_ATTRIBUTES = ("prompt_tokens", "response_tokens", "rows", "bytes", "attempts")
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_exporters = []
+_enabled = False
+_current = contextvars.ContextVar("agent_trace_span", default=None)
+
+
+class Span:
+    """
+    1 bước của pipeline. Dùng qua span(...) / @traced(...), không tạo trực tiếp.
+    """
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start_time", "duration",
+                 "status", "error", "_parent", "_started", "_token", "_otel")
+
+    def __init__(self, name, attributes):
+        parent = _current.get()
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start_time = None
+        self.duration = None
+        self.status = "ok"
+        self.error = None
+        self._parent = parent
+        self._otel = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def fail(self, error):
+        """
+        Đánh dấu span lỗi (kết quả là thông báo lỗi, không phải exception).
+        """
+        self.status = "error"
+        self.error = str(error)[:500]
+        return self
+
+    def record_result(self, result, failed=None):
+        """
+        Ghi kết quả của bước: DataFrame -> rows, bytes. failed=None: kết quả là chuỗi bắt đầu bằng "...Error:" /
+        "ERROR:" (cách execute_sql báo lỗi) -> span lỗi.
+        """
+        self.attributes.update(result_attributes(result))
+        if failed is None:
+            failed = isinstance(result, str) and result.split(":", 1)[0].endswith(("Error", "ERROR"))
+        if failed:
+            self.fail(result)
+        return self
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self._token = _current.set(self)
+        for exporter in _exporters:
+            exporter.on_start(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._started
+        _current.reset(self._token)
+        if exc is not None:
+            self.fail(f"{exc_type.__name__}: {exc}")
+        for exporter in _exporters:
+            try:
+                exporter.on_end(self)
+            except Exception as e:
+                print(f"⚠️ Tracing exporter {type(exporter).__name__} lỗi: {e}")
+        return False
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": round(self.start_time, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """
+    Span rỗng khi tắt tracing: mọi thao tác đều bỏ qua.
+    """
+    __slots__ = ()
+
+    def set(self, **attributes):
+        return self
+
+    def fail(self, error):
+        return self
+
+    def record_result(self, result, failed=None):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def tracing_enabled():
+    return _enabled
+
+
+def span(name, **attributes):
+    """
+    with span("execute_sql", dialect="sqlite") as sp: ...; sp.set(rows=10)
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def current_span():
+    """
+    Span đang chạy (để thêm thuộc tính từ bên trong hàm), span rỗng nếu không có.
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return _current.get() or _NOOP_SPAN
+
+
+def result_attributes(result):
+    """
+    Thuộc tính của kết quả 1 bước: DataFrame -> rows, bytes (dung lượng trong RAM).
+    """
+    if hasattr(result, "memory_usage") and hasattr(result, "columns"):
+        return {"rows": len(result), "bytes": int(result.memory_usage(index=True, deep=True).sum())}
+    return {}
+
+
+def traced(name, attributes=None):
+    """
+    Decorator: mỗi lần gọi hàm là 1 span, kết quả ghi bằng Span.record_result.
+    attributes: hàm (kết quả) -> dict thuộc tính thêm vào span.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(name, {}) as sp:
+                result = func(*args, **kwargs)
+                sp.record_result(result)
+                if attributes is not None:
+                    sp.set(**attributes(result))
+                return result
+        return wrapper
+    return decorator
+
+
+# --- EXPORTERS ---
+class SpanExporter:
+    """
+    Interface: on_start(span) khi span bắt đầu, on_end(span) khi span kết thúc (đã có duration / status).
+    """
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        pass
+
+
+class JsonLogExporter(SpanExporter):
+    """
+    Ghi mỗi span 1 dòng JSON (JSONL), đọc bằng pandas.read_json(path, lines=True) hoặc jq.
+    """
+    def __init__(self, path=DEFAULT_TRACE_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def on_end(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class PrometheusExporter(SpanExporter):
+    """
+    Gộp span thành metrics (histogram thời gian theo tên span + trạng thái, counter cho token / dòng / bytes /
+    lần thử). render() trả về text OpenMetrics; serve(port) mở endpoint /metrics (thread nền).
+    """
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._durations = {}  # (span, status) -> [đếm theo bucket..., count, sum]
+        self._counters = {}  # (attribute, span) -> tổng
+        self._lock = threading.Lock()
+        self._server = None
+
+    def on_end(self, span):
+        key = (span.name, span.status)
+        with self._lock:
+            stats = self._durations.setdefault(key, [0] * len(self.buckets) + [0, 0.0])
+            index = bisect.bisect_left(self.buckets, span.duration)
+            if index < len(self.buckets):
+                stats[index] += 1
+            stats[-2] += 1
+            stats[-1] += span.duration
+            for attribute in METRIC_ATTRIBUTES:
+                value = span.attributes.get(attribute)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    counter = (attribute, span.name)
+                    self._counters[counter] = self._counters.get(counter, 0) + value
+
+    def render(self):
+        lines = [
+            "# TYPE agent_span_duration_seconds histogram",
+            "# HELP agent_span_duration_seconds Thời gian chạy của từng bước pipeline.",
+        ]
+        with self._lock:
+            durations = {key: list(stats) for key, stats in sorted(self._durations.items())}
+            counters = dict(sorted(self._counters.items()))
+        for (name, status), stats in durations.items():
+            labels = f'span="{name}",status="{status}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, stats):
+                cumulative += count
+                lines.append(f'agent_span_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'agent_span_duration_seconds_bucket{{{labels},le="+Inf"}} {stats[-2]}')
+            lines.append(f"agent_span_duration_seconds_count{{{labels}}} {stats[-2]}")
+            lines.append(f"agent_span_duration_seconds_sum{{{labels}}} {stats[-1]:.6f}")
+        for attribute in METRIC_ATTRIBUTES:
+            values = [(name, value) for (attr, name), value in counters.items() if attr == attribute]
+            if not values:
+                continue
+            lines.append(f"# TYPE agent_{attribute} counter")
+            lines.extend(f'agent_{attribute}_total{{span="{name}"}} {value:g}' for name, value in values)
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="0.0.0.0"):
+        """
+        Mở endpoint /metrics (1 lần cho mỗi exporter). Cổng đã bị chiếm (VD: tiến trình khác) -> chỉ cảnh báo.
+        """
+        if self._server is not None:
+            return self._server
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # Không in log mỗi lần Prometheus scrape
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            print(f"⚠️ Không mở được endpoint metrics ở cổng {port}: {e}")
+            return None
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"📊 Metrics: http://{host}:{self._server.server_port}/metrics")
+        return self._server
+
+
+class OpenTelemetryExporter(SpanExporter):
+    """
+    Cầu nối sang OpenTelemetry: mỗi span tạo 1 span OTel (giữ quan hệ cha-con). Nơi gửi (OTLP, console...)
+    do TracerProvider của ứng dụng quyết định.
+    """
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = tracer or trace.get_tracer("sql-data-agent")
+
+    def on_start(self, span):
+        parent = span._parent._otel if span._parent is not None else None
+        context = self._trace.set_span_in_context(parent) if parent is not None else None
+        span._otel = self._tracer.start_span(span.name, context=context, start_time=int(span.start_time * 1e9))
+
+    def on_end(self, span):
+        otel_span = span._otel
+        if otel_span is None:
+            return
+        for key, value in span.attributes.items():
+            if isinstance(value, (str, bool, int, float)):
+                otel_span.set_attribute(f"agent.{key}", value)
+        if span.status == "error":
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=int((span.start_time + span.duration) * 1e9))
+
+
+_prometheus = None
+
+
+def get_prometheus_exporter():
+    """
+    PrometheusExporter đang dùng (None nếu không bật), VD: để render() ra trang khác.
+    """
+    return _prometheus
+
+
+def configure(exporters=None):
+    """
+    Chọn exporter. exporters: list SpanExporter / tên ("json", "prometheus", "otel");
+    None = đọc TRACE_EXPORTERS. Danh sách rỗng = tắt tracing.
+    Cấu hình: TRACE_LOG_PATH, TRACE_PROMETHEUS_PORT (0 = không mở endpoint).
+    """
+    global _enabled, _prometheus
+    if exporters is None:
+        exporters = [name.strip().lower() for name in os.getenv("TRACE_EXPORTERS", "").split(",") if name.strip()]
+
+    active = []
+    prometheus = None
+    for exporter in exporters:
+        if exporter == "json":
+            exporter = JsonLogExporter(os.getenv("TRACE_LOG_PATH") or DEFAULT_TRACE_LOG_PATH)
+        elif exporter == "prometheus":
+            exporter = _prometheus or PrometheusExporter()
+            port = int(os.getenv("TRACE_PROMETHEUS_PORT", "9464"))
+            if port:
+                exporter.serve(port)
+        elif exporter == "otel":
+            try:
+                exporter = OpenTelemetryExporter()
+            except ImportError:
+                print("⚠️ TRACE_EXPORTERS có otel nhưng chưa cài opentelemetry-api (pip install opentelemetry-sdk), bỏ qua.")
+                continue
+        elif isinstance(exporter, str):
+            print(f"⚠️ Không có tracing exporter '{exporter}' (chọn: json, prometheus, otel).")
+            continue
+        if isinstance(exporter, PrometheusExporter):
+            prometheus = exporter
+        active.append(exporter)
+
+    _exporters[:] = active
+    _prometheus = prometheus
+    _enabled = bool(active)
+    return list(active)
+
+
+configure()
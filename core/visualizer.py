@@ -0,0 +1,147 @@
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from core.forecaster import DATE_LIKE_PATTERN, find_forecast_columns
+from core.tracing import traced
+from core.downsample import chart_budgets, downsample_line, top_n_with_other, pushdown_bar, pushdown_line
+
+# --- HÀM VẼ BIỂU ĐỒ ---
+# Tách khỏi app.py để dùng lại ngoài Streamlit (benchmark, script).
+# Dữ liệu lớn được rút gọn trước khi vẽ (core/downsample.py), tiêu đề biểu đồ ghi rõ khi đang vẽ dữ liệu rút gọn.
+MAX_FORECAST_SERIES = 10  # Số chuỗi tối đa trên biểu đồ dự báo theo nhóm
+
+
+def _mark_reduced(chart, note):
+    """
+    Ghi chú dưới tiêu đề: biểu đồ đang vẽ dữ liệu rút gọn.
+    """
+    title = chart.layout.title.text or ""
+    chart.update_layout(title_text=f"{title}<br><sup>⚠️ Dữ liệu rút gọn: {note}</sup>")
+    return chart
+
+
+def _needs_pushdown(df, engine, pushdown_rows):
+    # Kết quả bị cắt (chưa đọc hết) hoặc quá lớn -> tính gộp trong DB trên câu SQL gốc
+    return engine is not None and 'final_sql' in df.attrs and (df.attrs.get('truncated') or len(df) > pushdown_rows)
+
+
+def _forecast_chart(df, max_points, method):
+    # Tìm cột ngày và số
+    date_cols = df.select_dtypes(include=['datetime']).columns
+    # Cột nhóm / giá trị chọn giống lúc dự báo (smart_agent): cột id (machine_id...) là nhóm, không phải giá trị
+    group_cols, value_cols = find_forecast_columns(df.drop(columns=['Type']), list(date_cols))
+    val_col = value_cols[0]
+
+    # Dự báo nhiều chuỗi: mỗi nhóm 1 màu, chỉ vẽ các nhóm có tổng giá trị lớn nhất
+    if group_cols:
+        series = df[group_cols].astype(str).agg(' / '.join, axis=1)
+        top = df.assign(_series=series).groupby('_series')[val_col].sum().nlargest(MAX_FORECAST_SERIES).index
+        plot_df = df.assign(Series=series)[series.isin(top)]
+        title = f"Forecast Analysis: {val_col} ({len(top)}/{series.nunique()} nhóm)"
+        color = 'Series'
+    else:
+        plot_df = df
+        title = f"Forecast Analysis: {val_col}"
+        color = 'Type' # Chia màu theo Lịch sử/Dự báo
+
+    # Lịch sử dài: rút gọn phần History của từng chuỗi, giữ nguyên các điểm Forecast
+    history = plot_df['Type'] == 'History'
+    keys = [color] if color == 'Series' else []
+    n_series = plot_df[color].nunique() if keys else 1
+    per_series = max(max_points // n_series, 3)
+    reduced = False
+    if history.sum() > per_series * n_series:
+        parts = [downsample_line(part, date_cols[0], val_col, per_series, method)
+                 for _, part in (plot_df[history].groupby(keys, sort=False, observed=True) if keys else [(None, plot_df[history])])]
+        reduced_history = pd.concat(parts)
+        note = f"{len(reduced_history):,}/{int(history.sum()):,} điểm lịch sử ({method.upper()})"
+        plot_df = pd.concat([reduced_history, plot_df[~history]]).sort_values([*keys, date_cols[0]], kind='stable')
+        reduced = True
+
+    chart = px.line(plot_df, x=date_cols[0], y=val_col, color=color, line_dash='Type', # Nét đứt cho dự báo
+                    title=title, markers=not reduced)
+    return _mark_reduced(chart, note) if reduced else chart
+
+
+def _line_chart(df, x_col, y_col, engine, max_points, pushdown_rows, method):
+    if _needs_pushdown(df, engine, pushdown_rows):
+        buckets = pushdown_line(df.attrs['final_sql'], engine, x_col, y_col, max_points)
+        if buckets is not None:
+            buckets[x_col] = pd.to_datetime(buckets[x_col], format='mixed')
+            chart = go.Figure([
+                go.Scatter(x=buckets[x_col], y=buckets['y_max'], mode='lines', line_width=0, showlegend=False,
+                           hoverinfo='skip'),
+                go.Scatter(x=buckets[x_col], y=buckets['y_min'], mode='lines', line_width=0, fill='tonexty',
+                           name='min–max', hoverinfo='skip'),
+                go.Scatter(x=buckets[x_col], y=buckets[y_col], mode='lines', name=f"{y_col} (trung bình)"),
+            ])
+            chart.update_layout(title_text="Trend over Time", xaxis_title=x_col, yaxis_title=y_col)
+            return _mark_reduced(chart, f"gộp trong DB thành {len(buckets):,} khoảng (trung bình, vùng mờ = min–max)")
+
+    plot_df = downsample_line(df, x_col, y_col, max_points, method)
+    chart = px.line(plot_df, x=x_col, y=y_col, title="Trend over Time")
+    if len(plot_df) < len(df):
+        return _mark_reduced(chart, f"{len(plot_df):,}/{len(df):,} điểm ({method.upper()})")
+    if df.attrs.get('truncated'):
+        return _mark_reduced(chart, f"chỉ {len(df):,} dòng đầu của kết quả")
+    return chart
+
+
+def _bar_chart(df, cat_col, num_col, engine, max_points, max_bars, pushdown_rows):
+    title = f"{num_col} by {cat_col}"
+    pushed = pushdown_bar(df.attrs['final_sql'], engine, cat_col, num_col) \
+        if _needs_pushdown(df, engine, pushdown_rows) else None
+    source = pushed if pushed is not None else df
+
+    # Ít dòng, ít nhóm -> vẽ nguyên như cũ
+    if pushed is None and len(df) <= max_points and df[cat_col].nunique() <= max_bars:
+        return px.bar(df, x=cat_col, y=num_col, title=title)
+
+    plot_df, n_groups = top_n_with_other(source, cat_col, num_col, max_bars)
+    chart = px.bar(plot_df, x=cat_col, y=num_col, title=title)
+    notes = []
+    if pushed is not None:
+        notes.append("tổng theo nhóm tính trong DB")
+    elif df.attrs.get('truncated'):
+        notes.append(f"chỉ {len(df):,} dòng đầu của kết quả")
+    notes.append(f"tổng {num_col} theo {cat_col}" + (f", {max_bars}/{n_groups:,} nhóm lớn nhất + Khác" if n_groups > max_bars else ""))
+    return _mark_reduced(chart, "; ".join(notes))
+
+
+def _chart_points(chart):
+    return {"points": sum(len(trace.x) for trace in chart.data if trace.x is not None) if chart is not None else 0}
+
+
+@traced("auto_visualize", attributes=_chart_points)
+def auto_visualize(df, engine=None):
+    """
+    Tự chọn biểu đồ cho kết quả. engine: DB của kết quả (để tính gộp trong DB khi kết quả quá lớn / bị cắt).
+    """
+    if df.empty or len(df) < 2: return None
+    max_points, max_bars, pushdown_rows, method = chart_budgets()
+
+    # 1. Logic vẽ biểu đồ Dự báo (Nếu có cột 'Type')
+    if 'Type' in df.columns and 'Forecast' in df['Type'].values:
+        return _forecast_chart(df, max_points, method)
+
+    # 2. Logic vẽ biểu đồ thường (Cũ)
+    num_cols = df.select_dtypes(include=['float', 'int']).columns.tolist()
+    cat_cols = df.select_dtypes(include=['object', 'string', 'category']).columns.tolist()
+    date_cols = df.select_dtypes(include=['datetime']).columns.tolist()
+
+    # Chuỗi thời gian dài mà ngày ở dạng chữ (SQLite: '2025-01-31') -> vẽ đường thay vì hàng nghìn cột
+    if cat_cols and num_cols and not date_cols and len(df) > max_bars \
+            and df[cat_cols[0]].astype(str).str.match(DATE_LIKE_PATTERN).all():
+        parsed = pd.to_datetime(df[cat_cols[0]].astype(str), errors='coerce', format='mixed')
+        if parsed.notna().all():
+            x_col = cat_cols[0]
+            plot_df = df.assign(**{x_col: parsed})
+            plot_df.attrs = dict(df.attrs)
+            return _line_chart(plot_df, x_col, num_cols[0], engine, max_points, pushdown_rows, method)
+
+    if len(cat_cols) >= 1 and len(num_cols) >= 1:
+        return _bar_chart(df, cat_cols[0], num_cols[0], engine, max_points, max_bars, pushdown_rows)
+    elif len(date_cols) >= 1 and len(num_cols) >= 1:
+        return _line_chart(df, date_cols[0], num_cols[0], engine, max_points, pushdown_rows, method)
+
+    return None
@@ -1,6 +1,13 @@
+import os
+import sys
+import json
+import time
+import argparse
 import pandas as pd
-from core.sql_generator import generate_sql
+from core.sql_generator import generate_sql, remember_sql
 from core.sql_executor import execute_sql
+from core.async_agent import process_questions_batch
+from core.database import init_db
 
 def chat_with_data(user_question):
     print(f"User: {user_question}")
@@ -21,6 +28,7 @@ def chat_with_data(user_question):
     
     # Bước 3: Hiển thị kết quả
     if isinstance(result, pd.DataFrame):
+        remember_sql(user_question, sql_query)
         print("\n✅ KẾT QUẢ TÌM ĐƯỢC:")
         # In đẹp hơn với to_markdown (nếu cài tabulate) hoặc to_string
         print(result.to_string(index=False))
@@ -28,7 +36,193 @@ def chat_with_data(user_question):
     else:
         print(f"\n❌ LỖI THỰC THI: {result}")
 
+# --- BATCH MODE (chạy không tương tác) ---
+def read_questions(path):
+    """
+    Đọc câu hỏi từ file (hoặc '-' = stdin).
+    - File .jsonl: mỗi dòng {"id": ..., "question": ...}
+    - File text: mỗi dòng 1 câu hỏi (bỏ dòng trống và dòng bắt đầu bằng '#'), id = số dòng.
+    """
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    is_jsonl = path.endswith(".jsonl")
+    items = []
+    with stream:
+        for line_no, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if is_jsonl:
+                data = json.loads(line)
+                items.append((str(data.get("id", line_no)), data["question"]))
+            else:
+                items.append((str(line_no), line))
+    return items
+
+
+def to_record(question_id, item):
+    """
+    Đổi 1 kết quả của process_questions_batch thành record (dict) để ghi ra file.
+    """
+    stats = item["stats"]
+    result = item["result"]
+    record = {
+        "id": question_id,
+        "question": item["question"],
+        "status": "ok" if result is not None else "error",
+        "final_sql": stats.get("final_sql"),
+        "rows": None,
+        "columns": None,
+        "truncated": None,
+        "error": None,
+        "attempts": stats.get("attempts", 0),
+        "retries": max(stats.get("attempts", 1) - 1, 0),
+        "timings": stats.get("timings", {}),
+        "elapsed": item["elapsed"],
+    }
+    if result is not None:
+        record["rows"] = len(result)
+        record["columns"] = [str(c) for c in result.columns]
+        record["truncated"] = bool(result.attrs.get("truncated", False))
+    else:
+        record["error"] = str(item["error"])
+    return record
+
+
+class ResultWriter:
+    """
+    Ghi kết quả ngay khi có:
+    - .jsonl: mỗi record 1 dòng.
+    - .parquet: thư mục chứa các file part-*.parquet (mỗi lần flush 1 file).
+    File checkpoint (<output>.ckpt) lưu id đã xong để chạy tiếp (--resume).
+    """
+    def __init__(self, output, resume=False, flush_every=50):
+        self.output = output
+        self.is_parquet = output.endswith(".parquet")
+        self.checkpoint_path = output + ".ckpt"
+        self.flush_every = flush_every
+        self.buffer = []
+        self.done_ids = set()
+
+        if resume and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                self.done_ids = {line.strip() for line in f if line.strip()}
+        mode = "a" if resume else "w"
+
+        if self.is_parquet:
+            os.makedirs(output, exist_ok=True)
+            if not resume:
+                for name in os.listdir(output):
+                    if name.startswith("part-"):
+                        os.remove(os.path.join(output, name))
+            self.part_no = len([n for n in os.listdir(output) if n.startswith("part-")])
+        else:
+            self.out_file = open(output, mode, encoding="utf-8")
+        self.ckpt_file = open(self.checkpoint_path, mode, encoding="utf-8")
+
+    def write(self, record):
+        if self.is_parquet:
+            self.buffer.append(record)
+            if len(self.buffer) >= self.flush_every:
+                self.flush()
+        else:
+            self.out_file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self.out_file.flush()
+            self._mark_done([record])
+
+    def flush(self):
+        if not self.buffer:
+            return
+        frame = pd.DataFrame(self.buffer)
+        # Cột dạng dict/list lưu dưới dạng chuỗi JSON cho gọn schema parquet
+        for col in ("timings", "columns"):
+            frame[col] = frame[col].map(lambda v: json.dumps(v, ensure_ascii=False) if v is not None else None)
+        # Ép kiểu cố định để mọi file part có cùng schema (cột toàn None không bị suy ra kiểu null)
+        frame = frame.astype({
+            "id": "string", "question": "string", "status": "string", "final_sql": "string",
+            "columns": "string", "error": "string", "timings": "string",
+            "rows": "Int64", "truncated": "boolean", "attempts": "Int64", "retries": "Int64", "elapsed": "float64",
+        })
+        frame.to_parquet(os.path.join(self.output, f"part-{self.part_no:05d}.parquet"), index=False)
+        self.part_no += 1
+        self._mark_done(self.buffer)
+        self.buffer = []
+
+    def _mark_done(self, records):
+        for record in records:
+            self.ckpt_file.write(f"{record['id']}\n")
+            self.done_ids.add(record["id"])
+        self.ckpt_file.flush()
+
+    def close(self):
+        self.flush()
+        if not self.is_parquet:
+            self.out_file.close()
+        self.ckpt_file.close()
+
+
+def run_batch(input_path, output, workers=4, max_retries=3, resume=False, ordered=False, llm_rate_per_minute=60):
+    """
+    Chạy toàn bộ câu hỏi trong file qua process_questions_batch (giới hạn song song AI/DB + quota AI),
+    ghi kết quả ra JSONL/Parquet ngay khi từng câu xong.
+    ordered=True: ghi theo đúng thứ tự input; False: ghi ngay khi câu nào xong trước.
+    """
+    questions = read_questions(input_path)
+    writer = ResultWriter(output, resume=resume)
+    pending = [(qid, q) for qid, q in questions if qid not in writer.done_ids]
+    print(f"📋 {len(questions)} câu hỏi, đã xong {len(questions) - len(pending)}, cần chạy {len(pending)}.")
+
+    finished = {}
+    next_pos = 0
+    ok_count = 0
+    started = time.perf_counter()
+
+    def on_result(item):
+        # Gọi trên event loop của batch (1 luồng) nên không cần khóa khi ghi
+        nonlocal next_pos, ok_count
+        record = to_record(pending[item["index"]][0], item)
+        ok_count += record["status"] == "ok"
+        if not ordered:
+            writer.write(record)
+            return
+        # Giữ kết quả xong sớm lại cho tới khi các câu phía trước xong
+        finished[item["index"]] = record
+        while next_pos in finished:
+            writer.write(finished.pop(next_pos))
+            next_pos += 1
+
+    try:
+        if pending:
+            process_questions_batch([q for _, q in pending], init_db(), max_retries=max_retries,
+                                    llm_concurrency=workers, db_concurrency=workers,
+                                    llm_rate_per_minute=llm_rate_per_minute, on_result=on_result)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Hoàn tất {len(pending)} câu hỏi ({ok_count} thành công) trong {elapsed:.1f}s -> {output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Hệ thống truy vấn dữ liệu kỹ thuật")
+    parser.add_argument("--batch", metavar="FILE", help="Chạy batch: file câu hỏi (.txt/.jsonl) hoặc '-' để đọc stdin")
+    parser.add_argument("--output", default="results.jsonl", help="File kết quả (.jsonl hoặc thư mục .parquet)")
+    parser.add_argument("--workers", type=int, default=4, help="Số lời gọi AI / truy vấn DB chạy song song")
+    parser.add_argument("--llm-rate", type=float, default=60, help="Quota gọi AI mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--max-retries", type=int, default=3, help="Số lần thử tối đa mỗi câu")
+    parser.add_argument("--resume", action="store_true", help="Bỏ qua các câu đã có trong checkpoint")
+    parser.add_argument("--order", choices=["completion", "ordered"], default="completion",
+                        help="Thứ tự ghi kết quả: theo lúc xong (completion) hoặc theo input (ordered)")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+
+    if args.batch:
+        run_batch(args.batch, args.output, workers=args.workers, max_retries=args.max_retries,
+                  resume=args.resume, ordered=args.order == "ordered", llm_rate_per_minute=args.llm_rate)
+        sys.exit(0)
+
     # Vòng lặp chat liên tục
     print("=== HỆ THỐNG TRUY VẤN DỮ LIỆU KỸ THUẬT (Gõ 'exit' để thoát) ===")
     
@@ -0,0 +1,324 @@
+# benchmark.py
+# Đo hiệu năng end-to-end: câu hỏi -> SQL -> DataFrame -> dự báo -> biểu đồ, với AI giả lập (ReplayProvider).
+# Chạy: python -m scripts.benchmark --scales 1 5 20 --clients 1 4 --iterations 3 --output bench.json
+# So sánh với lần chạy trước: python -m scripts.benchmark --compare bench_old.json
+# Chạy trên DuckDB:          python -m scripts.benchmark --backend duckdb
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import platform
+import argparse
+import tempfile
+import contextlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from core.database import build_connection_string, get_engine
+from core.duckdb_backend import duckdb_available, mirror_sqlite, get_duckdb_engine
+from core.llm_provider import ReplayProvider, set_llm_provider
+from core.smart_agent import process_question_with_retry, prepare_question, record_stage
+from core.visualizer import auto_visualize
+
+STAGES = ["schema", "generate", "fix", "validate", "execute", "forecast", "visualize", "total"]
+
+# Bộ câu hỏi cố định + câu trả lời của AI giả lập (SQL viết cho factory.db).
+# fix: SQL trả về khi được yêu cầu sửa (mô phỏng vòng retry).
+CORPUS = [
+    {
+        "question": "Top 5 máy tốn chi phí bảo trì nhiều nhất",
+        # Viết kiểu T-SQL để đo cả bước dịch dialect tại local
+        "sql": "SELECT TOP 5 m.name, SUM(l.cost) AS total_cost FROM maintenance_logs l "
+               "JOIN machines m ON l.machine_id = m.id GROUP BY m.name ORDER BY total_cost DESC",
+    },
+    {
+        "question": "Chi phí bảo trì theo từng kỹ sư",
+        "sql": "SELECT t.name, COUNT(l.id) AS repairs, SUM(l.cost) AS total_cost FROM maintenance_logs l "
+               "JOIN technicians t ON l.technician_id = t.id GROUP BY t.name ORDER BY total_cost DESC",
+    },
+    {
+        "question": "Số lần bảo trì theo trạng thái",
+        "sql": "SELECT l.status, COUNT(*) AS total FROM maintenance_logs l GROUP BY l.status",
+    },
+    {
+        "question": "Chi phí bảo trì theo khu vực và tháng",
+        "sql": "SELECT m.location, strftime('%Y-%m', l.date) AS month, SUM(l.cost) AS total_cost "
+               "FROM maintenance_logs l JOIN machines m ON l.machine_id = m.id GROUP BY m.location, month",
+    },
+    {
+        "question": "Liệt kê toàn bộ nhật ký bảo trì",
+        "sql": "SELECT l.id, l.machine_id, l.technician_id, l.date, l.description, l.cost, l.status "
+               "FROM maintenance_logs l",
+    },
+    {
+        "question": "Máy nào hỏng nhiều nhất",
+        "sql": "SELECT m.name, COUNT(*) AS failures FROM maintenance_logs l JOIN machines m ON l.machine_id = m.id "
+               "WHERE l.result = 'Failed' GROUP BY m.name ORDER BY failures DESC",
+        "fix": "SELECT m.name, COUNT(*) AS failures FROM maintenance_logs l JOIN machines m ON l.machine_id = m.id "
+               "WHERE l.status = 'Failed' GROUP BY m.name ORDER BY failures DESC",
+    },
+    {
+        "question": "Dự báo chi phí bảo trì 3 tháng tới",
+        "sql": "SELECT strftime('%Y-%m-01', l.date) AS month, SUM(l.cost) AS total_cost "
+               "FROM maintenance_logs l GROUP BY month ORDER BY month",
+    },
+]
+
+
+def build_recordings(corpus):
+    """
+    Bản ghi cho ReplayProvider. Câu hỏi dự báo được viết lại bởi prepare_question nên khóa phải theo câu đã viết lại.
+    """
+    recordings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for item in corpus:
+            question, _ = prepare_question(item["question"])
+            recordings.append({"question": question, "text": item["sql"]})
+            if item.get("fix"):
+                recordings.append({"question": question, "kind": "fix", "broken_sql": item["sql"], "text": item["fix"]})
+    return recordings
+
+
+def prepare_scaled_db(source_path, scale, work_dir):
+    """
+    Copy factory.db và nhân bản bảng maintenance_logs lên `scale` lần.
+    """
+    target = os.path.join(work_dir, f"factory_sf{scale}.db")
+    shutil.copyfile(source_path, target)
+    if scale > 1:
+        conn = sqlite3.connect(target)
+        try:
+            base_max = conn.execute("SELECT MAX(id) FROM maintenance_logs").fetchone()[0] or 0
+            for _ in range(scale - 1):
+                conn.execute(
+                    "INSERT INTO maintenance_logs (machine_id, technician_id, date, description, cost, status) "
+                    "SELECT machine_id, technician_id, date, description, cost, status "
+                    "FROM maintenance_logs WHERE id <= ?",
+                    (base_max,),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+    return target
+
+
+def peak_rss_mb():
+    """
+    Bộ nhớ RSS cao nhất của tiến trình (MB), None nếu hệ điều hành không hỗ trợ.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux trả về KB, macOS trả về bytes
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except (ImportError, AttributeError):
+        return None
+
+
+def run_one(question, engine, max_retries):
+    stats = {}
+    started = time.perf_counter()
+    try:
+        result = process_question_with_retry(question, engine=engine, max_retries=max_retries, stats=stats)
+    except Exception as e:
+        result = f"System Error: {e}"
+
+    rows = None
+    if isinstance(result, pd.DataFrame):
+        rows = len(result)
+        viz_started = time.perf_counter()
+        auto_visualize(result, engine=engine)
+        record_stage(stats, "visualize", viz_started)
+
+    timings = dict(stats.get("timings", {}))
+    timings["total"] = time.perf_counter() - started
+    return {
+        "question": question,
+        "ok": isinstance(result, pd.DataFrame),
+        "error": None if isinstance(result, pd.DataFrame) else str(result)[:200],
+        "rows": rows,
+        "attempts": stats.get("attempts", 0),
+        "timings": timings,
+    }
+
+
+def summarize(records, wall_seconds):
+    """
+    p50/p95/p99 (ms) cho từng bước + thông lượng, số lần retry, lỗi.
+    """
+    stages = {}
+    for stage in STAGES:
+        values = np.array([r["timings"][stage] for r in records if stage in r["timings"]]) * 1000
+        if len(values) == 0:
+            continue
+        stages[stage] = {
+            "count": int(len(values)),
+            "mean_ms": round(float(values.mean()), 3),
+            "p50_ms": round(float(np.percentile(values, 50)), 3),
+            "p95_ms": round(float(np.percentile(values, 95)), 3),
+            "p99_ms": round(float(np.percentile(values, 99)), 3),
+            "max_ms": round(float(values.max()), 3),
+        }
+    retries = [max(0, r["attempts"] - 1) for r in records]
+    return {
+        "questions": len(records),
+        "errors": sum(1 for r in records if not r["ok"]),
+        "retries": int(sum(retries)),
+        "questions_with_retry": sum(1 for n in retries if n),
+        "wall_seconds": round(wall_seconds, 4),
+        "throughput_qps": round(len(records) / wall_seconds, 3) if wall_seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages,
+    }
+
+
+def run_benchmark(engine, corpus, clients, iterations, max_retries, warmup):
+    questions = [item["question"] for item in corpus]
+    for _ in range(warmup):
+        for question in questions:
+            run_one(question, engine, max_retries)
+
+    jobs = questions * iterations
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        records = list(pool.map(lambda q: run_one(q, engine, max_retries), jobs))
+    return records, time.perf_counter() - started
+
+
+def compare(report, baseline_path):
+    """
+    In chênh lệch p50/p95 và thông lượng so với 1 file kết quả cũ.
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["scale"], r["clients"]): r for r in json.load(f)["runs"]}
+
+    for run in report["runs"]:
+        old = baseline.get((run["scale"], run["clients"]))
+        if old is None:
+            continue
+        print(f"\n📊 So sánh scale={run['scale']} clients={run['clients']} (mới vs cũ):", file=sys.stderr)
+        for stage, new_stats in run["stages"].items():
+            old_stats = old["stages"].get(stage)
+            if not old_stats:
+                continue
+            delta = (new_stats["p50_ms"] / old_stats["p50_ms"] - 1) * 100 if old_stats["p50_ms"] else 0.0
+            print(
+                f"   {stage:<10} p50 {old_stats['p50_ms']:>9.2f} -> {new_stats['p50_ms']:>9.2f} ms ({delta:+.1f}%)"
+                f"   p95 {old_stats['p95_ms']:>9.2f} -> {new_stats['p95_ms']:>9.2f} ms",
+                file=sys.stderr,
+            )
+        print(f"   throughput {old['throughput_qps']} -> {run['throughput_qps']} q/s", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline câu hỏi -> SQL -> DataFrame -> dự báo.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 5], help="Hệ số nhân dữ liệu maintenance_logs")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4], help="Số client chạy đồng thời")
+    parser.add_argument("--iterations", type=int, default=3, help="Số lần lặp bộ câu hỏi mỗi cấu hình")
+    parser.add_argument("--warmup", type=int, default=1, help="Số lần chạy nóng (không tính) trước khi đo")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Độ trễ giả lập của AI (giây/response)")
+    parser.add_argument("--llm-first-token", type=float, default=0.0, help="Độ trễ tới token đầu tiên (giây)")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="Dao động độ trễ (VD 0.2 = ±20%%)")
+    parser.add_argument("--cache", action="store_true", help="Bật SQL cache / result cache (mặc định tắt)")
+    parser.add_argument("--db", default=None, help="File SQLite gốc (mặc định factory.db)")
+    parser.add_argument("--backend", choices=["sqlite", "duckdb"], default="sqlite",
+                        help="Engine chạy truy vấn (duckdb: chép DB sang DuckDB trước khi đo)")
+    parser.add_argument("--output", default=None, help="Ghi kết quả JSON ra file (mặc định in ra stdout)")
+    parser.add_argument("--compare", default=None, help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--verbose", action="store_true", help="Hiện log của pipeline")
+    args = parser.parse_args()
+
+    if not args.cache:
+        os.environ["SQL_CACHE_ENABLED"] = "0"
+        os.environ["RESULT_CACHE_ENABLED"] = "0"
+        os.environ["FORECAST_CACHE_ENABLED"] = "0"
+
+    source_path = args.db
+    if source_path is None:
+        source_path = build_connection_string("factory.db")[0].replace("sqlite:///", "", 1)
+    if not os.path.exists(source_path):
+        sys.exit(f"❌ Không tìm thấy {source_path}. Hãy chạy `python -m scripts.seed_data` trước.")
+    if args.backend == "duckdb" and not duckdb_available():
+        sys.exit("❌ Chưa cài duckdb / duckdb-engine (pip install duckdb duckdb-engine).")
+
+    set_llm_provider(ReplayProvider(
+        path=None,
+        recordings=build_recordings(CORPUS),
+        latency=args.llm_latency,
+        first_token_latency=args.llm_first_token,
+        jitter=args.llm_jitter,
+        seed=42,
+    ))
+
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "corpus_size": len(CORPUS),
+            "iterations": args.iterations,
+            "llm_latency": args.llm_latency,
+            "llm_first_token": args.llm_first_token,
+            "cache": args.cache,
+            "backend": args.backend,
+        },
+        "runs": [],
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="agent_bench_")
+    try:
+        for scale in args.scales:
+            db_path = prepare_scaled_db(source_path, scale, work_dir)
+            if args.backend == "duckdb":
+                engine = get_duckdb_engine(mirror_sqlite(db_path, mirror_dir=work_dir))
+            else:
+                engine = get_engine(f"sqlite:///{db_path}")
+            for clients in args.clients:
+                print(f"⏱️ scale={scale} clients={clients} ...", file=sys.stderr)
+                log_target = sys.stderr if args.verbose else io.StringIO()
+                with contextlib.redirect_stdout(log_target):
+                    records, wall = run_benchmark(
+                        engine, CORPUS, clients, args.iterations, args.max_retries, args.warmup
+                    )
+                summary = summarize(records, wall)
+                failed = sorted({r["question"] for r in records if not r["ok"]})
+                report["runs"].append({"scale": scale, "clients": clients, **summary, "failed_questions": failed})
+                total = summary["stages"]["total"]
+                print(
+                    f"   ✅ {summary['throughput_qps']} q/s | total p50 {total['p50_ms']:.1f} ms, "
+                    f"p95 {total['p95_ms']:.1f} ms | retries {summary['retries']} | lỗi {summary['errors']} | "
+                    f"RSS {summary['peak_rss_mb']} MB",
+                    file=sys.stderr,
+                )
+            engine.dispose()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"💾 Đã ghi kết quả vào {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
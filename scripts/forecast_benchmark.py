@@ -0,0 +1,135 @@
+# forecast_benchmark.py
+# So sánh dự báo nhiều chuỗi: forecast_grouped (NumPy, 1 lần cho mọi chuỗi)
+# với cách cũ (mỗi chuỗi 1 model LinearRegression, ngày đổi bằng .apply(toordinal)).
+# Chạy: python -m scripts.forecast_benchmark --series 100 1000 5000 --months 36
+import json
+import time
+import argparse
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from core.forecaster import forecast_grouped
+
+try:
+    from sklearn.linear_model import LinearRegression
+except ImportError:  # Không cài scikit-learn -> cách cũ dùng np.polyfit cho từng chuỗi
+    LinearRegression = None
+
+
+def make_series(n_series, n_months, seed=42):
+    """
+    Dữ liệu dạng dài: mỗi máy 1 chuỗi chi phí theo tháng (xu hướng + nhiễu), độ dài lệch nhau.
+    """
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(max(2, n_months // 2), n_months + 1, size=n_series)
+    group = np.repeat(np.arange(n_series), lengths)
+    # Vị trí của dòng trong chuỗi của nó (0..length-1)
+    step = np.arange(len(group)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    start = pd.Timestamp("2020-01-01")
+    months = pd.DatetimeIndex(start + pd.DateOffset(months=int(m)) for m in range(n_months))
+    base = rng.uniform(1_000, 5_000, n_series)
+    trend = rng.normal(20, 10, n_series)
+    return pd.DataFrame({
+        "machine": np.char.add("M", group.astype(str)),
+        "month": months[n_months - lengths[group] + step],
+        "cost": base[group] + trend[group] * step + rng.normal(0, 100, len(group)),
+    })
+
+
+def forecast_series_legacy(df, time_col, value_col, months=3):
+    """
+    Cách làm cũ cho 1 chuỗi (giữ nguyên để làm mốc so sánh).
+    """
+    df = df.sort_values(by=time_col)
+    df['date_ordinal'] = df[time_col].apply(lambda x: x.toordinal())
+    future = pd.DataFrame({time_col: [df[time_col].max() + timedelta(days=i * 30) for i in range(1, months + 1)]})
+    future['date_ordinal'] = future[time_col].apply(lambda x: x.toordinal())
+    if LinearRegression is not None:
+        model = LinearRegression().fit(df[['date_ordinal']], df[value_col])
+        future[value_col] = model.predict(future[['date_ordinal']])
+    else:
+        slope, intercept = np.polyfit(df['date_ordinal'], df[value_col], 1)
+        future[value_col] = intercept + slope * future['date_ordinal']
+    future['Type'] = 'Forecast'
+    df['Type'] = 'History'
+    return pd.concat([df[[time_col, value_col, 'Type']], future[[time_col, value_col, 'Type']]])
+
+
+def per_series(df, months):
+    parts = []
+    for name, series in df.groupby("machine", sort=True):
+        part = forecast_series_legacy(series[["month", "cost"]], "month", "cost", months)
+        part.insert(0, "machine", name)
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+
+def max_fit_error(df, grouped, sample=50):
+    """
+    Sai lệch lớn nhất giữa forecast_grouped và np.polyfit trên 1 mẫu chuỗi (kiểm tra kết quả đúng).
+    """
+    names = grouped["machine"].drop_duplicates().iloc[:sample]
+    worst = 0.0
+    for name in names:
+        history = df[df["machine"] == name]
+        forecast = grouped[(grouped["machine"] == name) & (grouped["Type"] == "Forecast")]
+        x = history["month"].to_numpy().astype("datetime64[D]").astype(np.int64)
+        slope, intercept = np.polyfit(x, history["cost"], 1)
+        fx = forecast["month"].to_numpy().astype("datetime64[D]").astype(np.int64)
+        worst = max(worst, float(np.abs(intercept + slope * fx - forecast["cost"].to_numpy()).max()))
+    return worst
+
+
+def timed(fn, repeats):
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dự báo nhiều chuỗi (NumPy theo lô vs từng chuỗi).")
+    parser.add_argument("--series", type=int, nargs="+", default=[100, 1000, 5000], help="Số chuỗi")
+    parser.add_argument("--months", type=int, default=36, help="Số tháng lịch sử tối đa mỗi chuỗi")
+    parser.add_argument("--horizon", type=int, default=3, help="Số tháng dự báo")
+    parser.add_argument("--repeats", type=int, default=3, help="Số lần chạy, lấy lần nhanh nhất")
+    parser.add_argument("--max-legacy", type=int, default=1000,
+                        help="Bỏ qua cách cũ khi số chuỗi lớn hơn mức này (quá chậm)")
+    parser.add_argument("--json", action="store_true", help="In kết quả dạng JSON")
+    args = parser.parse_args()
+
+    results = []
+    for n_series in args.series:
+        df = make_series(n_series, args.months)
+        grouped_s, grouped = timed(lambda: forecast_grouped(df, "machine", "month", "cost", args.horizon), args.repeats)
+        row = {
+            "series": n_series,
+            "rows": len(df),
+            "grouped_s": round(grouped_s, 4),
+            "legacy_s": None,
+            "speedup": None,
+            "max_abs_error": max_fit_error(df, grouped),
+        }
+        if n_series <= args.max_legacy:
+            legacy_s, _ = timed(lambda: per_series(df, args.horizon), 1)
+            row["legacy_s"] = round(legacy_s, 4)
+            row["speedup"] = round(legacy_s / grouped_s, 1) if grouped_s else None
+        results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'Chuỗi':>8} {'Dòng':>10} {'NumPy (s)':>10} {'Từng chuỗi (s)':>15} {'Nhanh hơn':>10} {'Sai số':>10}")
+    for row in results:
+        legacy = f"{row['legacy_s']:.3f}" if row["legacy_s"] is not None else "-"
+        speedup = f"{row['speedup']}x" if row["speedup"] is not None else "-"
+        print(f"{row['series']:>8} {row['rows']:>10,} {row['grouped_s']:>10.4f} {legacy:>15} {speedup:>10} "
+              f"{row['max_abs_error']:>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
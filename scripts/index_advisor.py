@@ -0,0 +1,23 @@
+# index_advisor.py
+# Đề xuất index từ các câu SQL đã chạy (workload do execute_sql ghi lại).
+# Xem đề xuất:           python -m scripts.index_advisor
+# Tạo index + đo tốc độ: python -m scripts.index_advisor --apply
+import json
+import argparse
+from core.database import init_db
+from core.index_advisor import advise, format_report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đề xuất index dựa trên workload truy vấn.")
+    parser.add_argument("--db", default=None, help="Tên file SQLite (mặc định factory.db, bỏ qua nếu dùng SQL Server)")
+    parser.add_argument("--top", type=int, default=5, help="Số đề xuất tối đa")
+    parser.add_argument("--apply", action="store_true", help="Tạo index và đo tốc độ trước/sau")
+    parser.add_argument("--repeats", type=int, default=3, help="Số lần chạy lại mỗi câu khi đo")
+    parser.add_argument("--json", action="store_true", help="In kết quả dạng JSON")
+    args = parser.parse_args()
+
+    recommendations = advise(init_db(args.db, backend="sqlite"), top=args.top, apply=args.apply, repeats=args.repeats)
+    if args.json:
+        print(json.dumps(recommendations, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(recommendations))
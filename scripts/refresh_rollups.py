@@ -0,0 +1,21 @@
+# refresh_rollups.py
+# Tạo / cập nhật bảng tổng hợp rollup_maintenance_monthly (chạy định kỳ, VD: cron mỗi 5 phút).
+# Cập nhật tăng dần:  python -m scripts.refresh_rollups
+# Dựng lại toàn bộ:   python -m scripts.refresh_rollups --full   (sau khi sửa / xóa hàng loạt maintenance_logs)
+import argparse
+from core.database import init_db
+from core.rollups import create_rollup_tables, refresh_rollups
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cập nhật bảng rollup từ maintenance_logs.")
+    parser.add_argument("--db", default=None, help="Tên file SQLite (mặc định factory.db, bỏ qua nếu dùng SQL Server)")
+    parser.add_argument("--full", action="store_true", help="Xóa và gộp lại toàn bộ thay vì chỉ các dòng mới")
+    args = parser.parse_args()
+
+    engine = init_db(args.db, backend="sqlite")
+    create_rollup_tables(engine)
+    state = refresh_rollups(engine, full=args.full)
+    print(
+        f"✅ Rollup: watermark id={state['last_id']}, đã gộp {state['source_rows']:,} dòng "
+        f"({state['skipped_rows']:,} dòng thiếu ngày/máy/kỹ sư không gộp được)."
+    )
@@ -1,75 +1,250 @@
 # seed_data.py
-import random
+# Tạo dữ liệu giả cho factory.db / SQL Server.
+# Mặc định (scale 1): 50 máy, 10 kỹ sư, 1.000 nhật ký bảo trì.
+# Dữ liệu lớn: python -m scripts.seed_data --scale 10000 --reset --workers 4   (~10 triệu nhật ký)
+import time
+import argparse
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from faker import Faker
-from sqlalchemy.orm import sessionmaker
-from core.database import init_db, Machine, Technician, MaintenanceLog
-from datetime import date, timedelta
+from sqlalchemy import text
+from core.database import init_db, build_connection_string, Base, Machine, Technician, MaintenanceLog
+from core.schema_cache import invalidate_schema_cache
+from core.rollups import refresh_rollups
 
-# Cấu hình
-fake = Faker()
+# Cấu hình (scale 1)
 NUM_MACHINES = 50
 NUM_TECHS = 10
 NUM_LOGS = 1000
 
-def seed():
+MACHINE_TYPES = ['CNC Lathe', 'Hydraulic Press', 'Robotic Arm', 'Conveyor Belt', '3D Printer']
+LOCATIONS = ['Zone A', 'Zone B', 'Warehouse', 'Assembly Line']
+SPECIALTIES = ['Electrical', 'Mechanical', 'Software', 'Hydraulics']
+ISSUES = np.array(['Oil leak', 'Overheating', 'Sensor failure', 'Calibration error', 'Routine check'])
+# Chi phí trung vị theo loại sự cố (phân phối log-normal, kẹp trong khoảng 50 - 5000)
+ISSUE_MEDIAN_COST = np.array([1200.0, 900.0, 700.0, 1500.0, 150.0])
+ISSUE_WEIGHTS = np.array([0.15, 0.2, 0.2, 0.15, 0.3])
+STATUSES = np.array(['Success', 'Pending', 'Failed'])
+STATUS_WEIGHTS = np.array([0.6, 0.2, 0.2])  # Tỉ lệ Success cao hơn
+
+# Pragma cho SQLite khi nạp dữ liệu lớn (khôi phục lại sau khi nạp xong)
+SQLITE_BULK_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": "-262144",  # ~256 MB
+}
+SQLITE_DEFAULT_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL"}
+
+
+def day_weights(num_days, end_date, growth=1.5):
+    """
+    Phân bố số sự cố theo ngày cho giống thực tế:
+    - Tăng dần theo thời gian (máy cũ đi, hỏng nhiều hơn), growth = tỉ lệ cuối kỳ / đầu kỳ.
+    - Cuối tuần ít việc hơn, mùa hè (nóng) nhiều sự cố hơn.
+    """
+    offsets = np.arange(num_days)
+    days = np.datetime64(end_date) - (num_days - 1 - offsets).astype("timedelta64[D]")
+    trend = 1 + (growth - 1) * offsets / max(1, num_days - 1)
+    weekday = (days.astype("datetime64[D]").view("int64") + 3) % 7  # 0 = Thứ 2
+    weekly = np.where(weekday >= 5, 0.4, 1.0)
+    month = days.astype("datetime64[M]").astype(int) % 12 + 1
+    seasonal = 1 + 0.25 * np.sin(2 * np.pi * (month - 3) / 12)
+    weights = trend * weekly * seasonal
+    return days, weights / weights.sum()
+
+
+def generate_log_chunk(spec):
+    """
+    Sinh 1 khối nhật ký bảo trì bằng NumPy (chạy được trong process con).
+    Seed = (seed gốc, số thứ tự khối) nên kết quả giống nhau dù chạy bao nhiêu worker.
+    """
+    seed, chunk_index, size, machine_ids, machine_weights, tech_ids, days, day_p = spec
+    rng = np.random.default_rng([seed, chunk_index])
+
+    issue_idx = rng.choice(len(ISSUES), size=size, p=ISSUE_WEIGHTS)
+    cost = ISSUE_MEDIAN_COST[issue_idx] * rng.lognormal(mean=0.0, sigma=0.5, size=size)
+    return {
+        "machine_id": rng.choice(machine_ids, size=size, p=machine_weights),
+        "technician_id": rng.choice(tech_ids, size=size),
+        "date": rng.choice(days, size=size, p=day_p),
+        "description": ISSUES[issue_idx],
+        "cost": np.round(np.clip(cost, 50.0, 5000.0), 2),
+        "status": rng.choice(STATUSES, size=size, p=STATUS_WEIGHTS),
+    }
+
+
+def iter_chunks(specs, workers):
+    """
+    Sinh các khối song song (ProcessPoolExecutor), trả về đúng thứ tự để ghi tuần tự vào DB.
+    """
+    if workers <= 1:
+        for spec in specs:
+            yield generate_log_chunk(spec)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(generate_log_chunk, specs)
+
+
+def _date_values(days, dialect):
+    # SQLite lưu Date dạng chuỗi ISO, các driver khác nhận datetime.date
+    if dialect == "sqlite":
+        return np.datetime_as_string(days, unit="D").tolist()
+    return days.astype(object).tolist()
+
+
+def bulk_insert(connection, table, columns, rows):
+    """
+    INSERT nhiều dòng bằng executemany của driver (pyodbc dùng fast_executemany nếu engine bật).
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    sql = (
+        f"INSERT INTO {quote(table.name)} ({', '.join(quote(c) for c in columns)}) "
+        f"VALUES ({', '.join('?' for _ in columns)})"
+    )
+    connection.exec_driver_sql(sql, rows)
+
+
+def set_sqlite_pragmas(connection, pragmas):
+    for name, value in pragmas.items():
+        connection.exec_driver_sql(f"PRAGMA {name} = {value}")
+    connection.commit()
+
+
+def insert_dimension(connection, table, columns, rows):
+    """
+    Ghi bảng nhỏ (máy, kỹ sư) rồi đọc lại id do DB cấp (SQLite AUTOINCREMENT / SQL Server IDENTITY).
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    previous_max = connection.execute(text(f"SELECT MAX(id) FROM {quote(table.name)}")).scalar() or 0
+    bulk_insert(connection, table, columns, rows)
+    ids = connection.execute(
+        text(f"SELECT id FROM {quote(table.name)} WHERE id > :prev ORDER BY id"), {"prev": previous_max}
+    ).scalars().all()
+    return np.array(ids, dtype=np.int64)
+
+
+def seed(scale=1.0, seed_value=42, workers=1, chunk_size=200_000, days=365, reset=False, db_name=None):
+    """
+    scale: hệ số nhân dữ liệu. Số nhật ký = 1.000 x scale; số máy / kỹ sư tăng theo căn bậc 2 của scale.
+    seed_value: seed cho NumPy/Faker (cùng seed -> cùng dữ liệu).
+    workers: số process sinh dữ liệu song song; chunk_size: số dòng mỗi khối ghi.
+    days: số ngày lịch sử tính tới hôm nay; reset: xóa và tạo lại các bảng trước khi nạp.
+    """
     print("🔄 Đang khởi tạo database và dữ liệu giả...")
-    engine = init_db()
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    connection_string, _ = build_connection_string(db_name)
+    is_mssql = connection_string.startswith("mssql")
+    # pyodbc: gửi cả khối tham số 1 lần thay vì từng dòng
+    engine = init_db(db_name, create_schema=True, backend="sqlite", **({"fast_executemany": True} if is_mssql else {}))
+    dialect = engine.dialect.name
+
+    if reset:
+        print("🧹 Xóa dữ liệu cũ...")
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+
+    num_machines = max(NUM_MACHINES, int(NUM_MACHINES * scale ** 0.5))
+    num_techs = max(NUM_TECHS, int(NUM_TECHS * scale ** 0.5))
+    num_logs = int(NUM_LOGS * scale)
+
+    rng = np.random.default_rng(seed_value)
+    fake = Faker()
+    Faker.seed(seed_value)
+    started = time.perf_counter()
+
+    # Pragma SQLite là thiết lập theo connection -> đặt và khôi phục trên cùng 1 connection, ngoài transaction
+    with engine.connect() as connection:
+        if dialect == "sqlite":
+            set_sqlite_pragmas(connection, SQLITE_BULK_PRAGMAS)
+        with connection.begin():
+            num_logs = _seed_tables(connection, dialect, rng, fake, num_machines, num_techs, num_logs,
+                                    seed_value, workers, chunk_size, days, started)
+        if dialect == "sqlite":
+            set_sqlite_pragmas(connection, SQLITE_DEFAULT_PRAGMAS)
+
+    print(f"✅ Đã tạo {num_logs:,} nhật ký bảo trì.")
 
+    # Gộp các dòng mới vào bảng rollup (bảng vừa tạo lại -> dựng toàn bộ)
+    refresh_rollups(engine)
+
+    if dialect == "sqlite":
+        # Cập nhật thống kê (sqlite_stat1) cho query planner và ước lượng số dòng của schema cache
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ANALYZE")
+    invalidate_schema_cache(engine)
+
+    print(f"🎉 Hoàn tất seeding! ({time.perf_counter() - started:.1f}s)")
+
+
+def _seed_tables(connection, dialect, rng, fake, num_machines, num_techs, num_logs, seed_value, workers,
+                 chunk_size, days, started):
+    """
+    Ghi máy, kỹ sư rồi nhật ký bảo trì (theo khối) trong 1 transaction. Trả về số nhật ký đã ghi.
+    """
     # 1. Tạo Machines
-    machine_types = ['CNC Lathe', 'Hydraulic Press', 'Robotic Arm', 'Conveyor Belt', '3D Printer']
-    locations = ['Zone A', 'Zone B', 'Warehouse', 'Assembly Line']
-    
-    machines = []
-    for _ in range(NUM_MACHINES):
-        m = Machine(
-            name=f"{random.choice(machine_types)} #{random.randint(100, 999)}",
-            model=fake.bothify(text='Mod-####??'),
-            location=random.choice(locations),
-            install_date=fake.date_between(start_date='-5y', end_date='-1y')
-        )
-        machines.append(m)
-    session.add_all(machines)
-    session.commit() # Commit để lấy ID
-    print(f"✅ Đã tạo {NUM_MACHINES} máy móc.")
+    install_offsets = rng.integers(365, 5 * 365, size=num_machines)
+    install_dates = np.datetime64(date.today()) - install_offsets.astype("timedelta64[D]")
+    machine_rows = list(zip(
+        [f"{t} #{n}" for t, n in zip(rng.choice(MACHINE_TYPES, num_machines), rng.integers(100, 1000, num_machines))],
+        [fake.bothify(text='Mod-####??') for _ in range(num_machines)],
+        rng.choice(LOCATIONS, num_machines).tolist(),
+        _date_values(install_dates, dialect),
+    ))
+    machine_ids = insert_dimension(
+        connection, Machine.__table__, ["name", "model", "location", "install_date"], machine_rows
+    )
+    print(f"✅ Đã tạo {num_machines} máy móc.")
 
     # 2. Tạo Technicians
-    specialties = ['Electrical', 'Mechanical', 'Software', 'Hydraulics']
-    techs = []
-    for _ in range(NUM_TECHS):
-        t = Technician(
-            name=fake.name(),
-            specialty=random.choice(specialties),
-            years_experience=random.randint(1, 20)
-        )
-        techs.append(t)
-    session.add_all(techs)
-    session.commit()
-    print(f"✅ Đã tạo {NUM_TECHS} kỹ sư.")
+    tech_rows = list(zip(
+        [fake.name() for _ in range(num_techs)],
+        rng.choice(SPECIALTIES, num_techs).tolist(),
+        rng.integers(1, 21, num_techs).tolist(),
+    ))
+    tech_ids = insert_dimension(
+        connection, Technician.__table__, ["name", "specialty", "years_experience"], tech_rows
+    )
+    print(f"✅ Đã tạo {num_techs} kỹ sư.")
 
     # 3. Tạo Logs (Dữ liệu quan trọng nhất để AI phân tích)
-    logs = []
-    machine_ids = [m.id for m in machines]
-    tech_ids = [t.id for t in techs]
-    issues = ['Oil leak', 'Overheating', 'Sensor failure', 'Calibration error', 'Routine check']
-    
-    for _ in range(NUM_LOGS):
-        log = MaintenanceLog(
-            machine_id=random.choice(machine_ids),
-            technician_id=random.choice(tech_ids),
-            date=fake.date_between(start_date='-1y', end_date='today'),
-            description=random.choice(issues),
-            cost=round(random.uniform(50.0, 5000.0), 2),
-            status=random.choice(['Success', 'Success', 'Success', 'Pending', 'Failed']) # Tỉ lệ Success cao hơn
-        )
-        logs.append(log)
-    session.add_all(logs)
-    session.commit()
-    print(f"✅ Đã tạo {NUM_LOGS} nhật ký bảo trì.")
-    
-    session.close()
-    print("🎉 Hoàn tất seeding!")
+    # Một số máy hỏng nhiều hơn hẳn (phân phối Zipf), ngày theo day_weights
+    ranks = rng.permutation(num_machines) + 1
+    machine_weights = 1.0 / ranks ** 0.8
+    machine_weights /= machine_weights.sum()
+    log_days, day_p = day_weights(days, date.today())
+
+    specs = []
+    for index, start in enumerate(range(0, num_logs, chunk_size)):
+        size = min(chunk_size, num_logs - start)
+        specs.append((seed_value, index, size, machine_ids, machine_weights, tech_ids, log_days, day_p))
+
+    columns = ["machine_id", "technician_id", "date", "description", "cost", "status"]
+    written = 0
+    for chunk in iter_chunks(specs, workers):
+        rows = list(zip(
+            chunk["machine_id"].tolist(),
+            chunk["technician_id"].tolist(),
+            _date_values(chunk["date"], dialect),
+            chunk["description"].tolist(),
+            chunk["cost"].tolist(),
+            chunk["status"].tolist(),
+        ))
+        bulk_insert(connection, MaintenanceLog.__table__, columns, rows)
+        written += len(rows)
+        elapsed = time.perf_counter() - started
+        print(f"   ... {written:,}/{num_logs:,} nhật ký ({written / elapsed:,.0f} dòng/s)")
+    return written
+
 
 if __name__ == "__main__":
-    seed()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Tạo dữ liệu giả cho Database nhà máy.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Hệ số nhân dữ liệu (1 = 1.000 nhật ký)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed ngẫu nhiên (cùng seed -> cùng dữ liệu)")
+    parser.add_argument("--workers", type=int, default=1, help="Số process sinh dữ liệu song song")
+    parser.add_argument("--chunk-size", type=int, default=200_000, help="Số dòng mỗi khối ghi")
+    parser.add_argument("--days", type=int, default=365, help="Số ngày lịch sử")
+    parser.add_argument("--reset", action="store_true", help="Xóa và tạo lại bảng trước khi nạp")
+    parser.add_argument("--db", default=None, help="Tên file SQLite (mặc định factory.db, bỏ qua nếu dùng SQL Server)")
+    args = parser.parse_args()
+    seed(args.scale, args.seed, args.workers, args.chunk_size, args.days, args.reset, args.db)
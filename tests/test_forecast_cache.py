@@ -0,0 +1,69 @@
+import shutil
+import pytest
+from sqlalchemy import create_engine, event, text
+from core.forecast_cache import fetch_forecast_history
+from core.schema_cache import invalidate_schema_cache
+from core.sql_executor import execute_sql
+
+HISTORY_SQL = ("SELECT strftime('%Y-%m-01', date) AS month, SUM(cost) AS total_cost FROM maintenance_logs "
+               "GROUP BY strftime('%Y-%m-01', date)")
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    shutil.copy("factory.db", tmp_path / "factory.db")
+    monkeypatch.setenv("FORECAST_CACHE_PATH", str(tmp_path / "forecast_cache.db"))
+    monkeypatch.delenv("FORECAST_CACHE_CHECKSUM", raising=False)
+    monkeypatch.setattr("core.forecast_cache._forecast_cache", None)
+    return create_engine(f"sqlite:///{tmp_path / 'factory.db'}")
+
+
+def _update_old_row(engine, extra=""):
+    with engine.begin() as connection:
+        connection.execute(text(f"UPDATE maintenance_logs SET cost = cost + 5000{extra} WHERE id = 5"))
+
+
+def _assert_fresh(engine, history):
+    fresh = execute_sql(HISTORY_SQL, engine, use_cache=False)
+    assert history["total_cost"].sum() == pytest.approx(fresh["total_cost"].sum())
+
+
+def test_hit_does_not_scan_history(engine):
+    fetch_forecast_history(HISTORY_SQL, engine)
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, sql, *args: statements.append(sql))
+    assert fetch_forecast_history(HISTORY_SQL, engine).attrs["forecast_cache"] == "hit"
+    # Chỉ còn MAX(id) theo khóa chính: không COUNT(*) / SUM trên bảng sự kiện
+    assert statements and not any("COUNT(" in s.upper() or "SUM(" in s.upper() for s in statements)
+
+
+def test_checksum_detects_updated_rows(engine, monkeypatch):
+    monkeypatch.setenv("FORECAST_CACHE_CHECKSUM", "1")
+    fetch_forecast_history(HISTORY_SQL, engine)
+    assert fetch_forecast_history(HISTORY_SQL, engine).attrs["forecast_cache"] == "hit"
+    _update_old_row(engine)
+    history = fetch_forecast_history(HISTORY_SQL, engine)
+    assert history.attrs["forecast_cache"] == "full"
+    _assert_fresh(engine, history)
+
+
+def test_updated_at_watermark_detects_updated_rows(engine):
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE maintenance_logs ADD COLUMN updated_at TEXT"))
+        connection.execute(text("UPDATE maintenance_logs SET updated_at = '2025-01-01 00:00:00'"))
+        connection.execute(text("CREATE INDEX ix_logs_updated_at ON maintenance_logs (updated_at)"))
+    invalidate_schema_cache(engine)
+
+    assert fetch_forecast_history(HISTORY_SQL, engine).attrs["forecast_cache"] == "full"
+    assert fetch_forecast_history(HISTORY_SQL, engine).attrs["forecast_cache"] == "hit"
+    _update_old_row(engine, ", updated_at = '2025-06-01 00:00:00'")
+    history = fetch_forecast_history(HISTORY_SQL, engine)
+    assert history.attrs["forecast_cache"] == "full"
+    _assert_fresh(engine, history)
+    assert fetch_forecast_history(HISTORY_SQL, engine).attrs["forecast_cache"] == "hit"
+
+
+def test_expired_state_is_rebuilt(engine, monkeypatch):
+    fetch_forecast_history(HISTORY_SQL, engine)
+    monkeypatch.setenv("FORECAST_CACHE_MAX_AGE_HOURS", "1e-9")
+    assert fetch_forecast_history(HISTORY_SQL, engine).attrs["forecast_cache"] == "full"
@@ -0,0 +1,59 @@
+import io
+import os
+import sqlite3
+import pytest
+from sqlalchemy import text
+from core.database import _engines
+from core.ingestion import _load_csv, evict_uploads, load_uploads
+
+CSV = ("id,amount,when,flag,code\n"
+       "1,10,2025-01-01,true,12\n"
+       "2,20,2025-01-02,false,13\n"
+       "3,1.50,2025-01-03 08:30:00,true,00123\n"
+       "4,N/A,31/01/2025,yes,+7\n")
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 2, 100])
+def test_widening_keeps_loaded_rows(chunk_rows):
+    conn = sqlite3.connect(":memory:")
+    info = _load_csv(conn, "t", io.BytesIO(CSV.encode()), chunk_rows, sample_rows=2, max_indexes=5, min_index_rows=10)
+
+    assert info["rows"] == 4
+    assert info["columns"] == {"id": "integer", "amount": "float", "when": "datetime", "flag": "text", "code": "text"}
+    rows = conn.execute('SELECT amount, "when", flag, code FROM t ORDER BY rowid').fetchall()
+    assert rows == [
+        (10.0, "2025-01-01 00:00:00", "true", "12"),
+        (20.0, "2025-01-02 00:00:00", "false", "13"),
+        (1.5, "2025-01-03 08:30:00", "true", "00123"),
+        (None, "2025-01-31 00:00:00", "yes", "+7"),
+    ]
+    # Cột đã nới sang TEXT: giá trị ghi sau đó không bị ép về số theo affinity cũ
+    assert conn.execute("SELECT COUNT(*) FROM t WHERE typeof(code) != 'text'").fetchone()[0] == 0
+
+
+def _csv(name, rows):
+    fileobj = io.BytesIO(("id,value\n" + "".join(f"{i},{i * 2}\n" for i in range(rows))).encode())
+    fileobj.name = name
+    return fileobj
+
+
+def test_evict_skips_store_with_running_query(tmp_path):
+    engine, _ = load_uploads([_csv("old.csv", 50)], store_dir=str(tmp_path), backend="sqlite")
+    old_path = engine.url.database
+
+    # Đang có truy vấn (kết nối được mượn) -> không xóa file, không đóng engine
+    with engine.connect() as connection:
+        evict_uploads(str(tmp_path), max_bytes=0)
+        assert os.path.exists(old_path)
+        assert connection.execute(text("SELECT COUNT(*) FROM old")).scalar() == 50
+
+    # Hết truy vấn -> engine bị bỏ khỏi registry trước khi xóa file
+    evict_uploads(str(tmp_path), max_bytes=0)
+    assert not os.path.exists(old_path)
+    assert all(e.url.database != old_path for e in _engines.values())
+
+    # Nạp lại bộ file cũ -> dựng lại DB, engine mới đọc được
+    engine, tables = load_uploads([_csv("old.csv", 50)], store_dir=str(tmp_path), backend="sqlite")
+    assert tables["old"]["rows"] == 50
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM old")).scalar() == 50
@@ -0,0 +1,28 @@
+from core.query_cache import SqlCache
+
+SQL = "SELECT COUNT(*) FROM maintenance_logs"
+
+
+def _row(cache):
+    with cache._connect() as conn:
+        return conn.execute("SELECT sql, created_at, use_count FROM sql_cache").fetchone()
+
+
+def test_put_after_hit_keeps_created_at_and_use_count(tmp_path):
+    cache = SqlCache(path=str(tmp_path / "sql_cache.db"), ttl=3600)
+    cache.put("Có bao nhiêu lần bảo trì?", "h", "m", SQL)
+    created_at = _row(cache)[1]
+    for _ in range(3):
+        # Luồng trả lời: get() trúng cache rồi remember_sql() gọi lại put() với cùng SQL
+        assert cache.get("co bao nhieu lan bao tri", "h", "m") == SQL
+        cache.put("co bao nhieu lan bao tri", "h", "m", SQL)
+    assert _row(cache) == (SQL, created_at, 3)
+
+
+def test_put_with_new_sql_starts_fresh(tmp_path):
+    cache = SqlCache(path=str(tmp_path / "sql_cache.db"), ttl=3600)
+    cache.put("q", "h", "m", SQL)
+    cache.get("q", "h", "m")
+    cache.put("q", "h", "m", SQL + " WHERE cost > 0")
+    sql, _, use_count = _row(cache)
+    assert sql.endswith("cost > 0") and use_count == 0
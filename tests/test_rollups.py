@@ -0,0 +1,65 @@
+import shutil
+import pytest
+import pandas as pd
+from sqlalchemy import create_engine, text
+from core.rollups import create_rollup_tables, refresh_rollups, route_query
+
+# So sánh kết quả câu gốc (quét maintenance_logs) với câu đã viết lại sang rollup trên bản sao của factory.db
+QUERIES = [
+    "SELECT machine_id, COUNT(*) AS n FROM maintenance_logs GROUP BY machine_id HAVING COUNT(*) > 22",
+    "SELECT machine_id, COUNT(*) FROM maintenance_logs GROUP BY machine_id HAVING COUNT(*) > 22 ORDER BY COUNT(*) DESC",
+    "SELECT technician_id, SUM(cost) AS total FROM maintenance_logs GROUP BY technician_id ORDER BY SUM(cost) DESC, COUNT(*)",
+    "SELECT machine_id, AVG(cost) FROM maintenance_logs GROUP BY machine_id HAVING AVG(cost) > 0 AND COUNT(*) >= 10",
+    "SELECT COUNT(*) FROM maintenance_logs WHERE status = 'Failed'",
+    "SELECT machine_id, COUNT(*) AS failed FROM maintenance_logs WHERE status = 'Pending' "
+    "GROUP BY machine_id HAVING COUNT(*) > 1 ORDER BY COUNT(*) DESC",
+    "SELECT strftime('%Y-%m', date), COUNT(id), MAX(cost) FROM maintenance_logs GROUP BY strftime('%Y-%m', date)",
+    "SELECT machine_id, COUNT(1) FROM maintenance_logs GROUP BY machine_id",
+    "SELECT COUNT(1) AS n FROM maintenance_logs WHERE status = 'Success'",
+    "SELECT machine_id, COUNT(*) FROM maintenance_logs WHERE '2025-03-01' <= date GROUP BY machine_id",
+    "SELECT COUNT(*) FROM maintenance_logs WHERE '2025-03-01' > date",
+]
+
+# Không viết lại được (kết quả trên rollup sẽ khác) -> route_query trả về None, chạy câu gốc
+NOT_ROUTED = [
+    "SELECT SUM(1) FROM maintenance_logs",
+    "SELECT COUNT(m.name) FROM maintenance_logs l JOIN machines m ON l.machine_id = m.id",
+    "SELECT COUNT(*) FROM maintenance_logs WHERE '2025-03-01' < date",
+    "SELECT COUNT(*) FROM maintenance_logs WHERE '2025-03-01' >= date",
+    "SELECT COUNT(*) FROM maintenance_logs WHERE date > '2025-03-01'",
+]
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    path = tmp_path_factory.mktemp("rollups") / "factory.db"
+    shutil.copy("factory.db", path)
+    engine = create_engine(f"sqlite:///{path}")
+    create_rollup_tables(engine)
+    refresh_rollups(engine, full=True)
+    return engine
+
+
+def _run(engine, sql):
+    with engine.connect() as connection:
+        result = connection.execute(text(sql))
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_rewrite_matches_source(engine, sql):
+    routed = route_query(sql, engine)
+    assert routed is not None and "rollup_maintenance_monthly" in routed[0]
+    expected, actual = _run(engine, sql), _run(engine, routed[0])
+    # Cột không có alias giữ tên biểu thức gốc (sqlglot chỉ viết hoa tên hàm)
+    assert [c.lower() for c in actual.columns] == [c.lower() for c in expected.columns]
+    actual.columns = expected.columns
+    if "ORDER BY" not in sql:
+        expected = expected.sort_values(list(expected.columns), ignore_index=True)
+        actual = actual.sort_values(list(actual.columns), ignore_index=True)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize("sql", NOT_ROUTED)
+def test_unsafe_rewrite_is_skipped(engine, sql):
+    assert route_query(sql, engine) is None